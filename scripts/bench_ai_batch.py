@@ -0,0 +1,101 @@
+"""Benchmark: per-address vs batched LLM classification for an /ai/sync-sized job.
+
+Starts scripts/stub_ai_server.py in-process and classifies N addresses twice:
+once through get_property_update_async (one completion per address, at most
+AI_SYNC_CONCURRENCY in flight, as /ai/sync used to) and once through
+get_property_updates_batch. Caches are cleared between runs. Reports wall
+time, completion requests and prompt/completion tokens for each path.
+
+Usage (from the repo root):
+    python scripts/bench_ai_batch.py [--addresses 500] [--latency 0.4] [--tokens-per-second 400]
+        [--drop-rate 0.05] [--concurrency 6]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "src", "app")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--addresses", type=int, default=500)
+    ap.add_argument("--latency", type=float, default=0.4, help="per-completion latency (s)")
+    ap.add_argument("--search-latency", type=float, default=0.05)
+    ap.add_argument("--tokens-per-second", type=float, default=400.0)
+    ap.add_argument("--drop-rate", type=float, default=0.05, help="batch items the stub leaves out")
+    ap.add_argument("--concurrency", type=int, default=6)
+    ap.add_argument("--port", type=int, default=8767)
+    args = ap.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update({
+        "GROQ_API_KEY": "stub", "TAVILY_API_KEY": "stub",
+        "GROQ_BASE_URL": base + "/openai/v1", "TAVILY_BASE_URL": base,
+    })
+    sys.path.insert(0, SCRIPTS_DIR)
+    sys.path.insert(0, APP_DIR)
+    from stub_ai_server import serve
+    import ai_services
+    from ai_providers import GROQ, aclose_providers
+
+    server = serve(args.port, args.latency, args.search_latency, 0.0, args.drop_rate, args.tokens_per_second)
+    addresses = [f"{i} Main St, Springfield" for i in range(args.addresses)]
+
+    def chat_requests():
+        with urllib.request.urlopen(base + "/stats") as resp:
+            return json.load(resp)["chat_requests"]
+
+    async def per_address():
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one(a):
+            async with sem:
+                return await ai_services.get_property_update_async(a)
+        return await asyncio.gather(*(one(a) for a in addresses))
+
+    async def batched():
+        return list((await ai_services.get_property_updates_batch(addresses, concurrency=args.concurrency)).values())
+
+    async def measure(fn):
+        ai_services.SEARCH_STAGE.local.clear()
+        ai_services.CLASSIFY_STAGE.local.clear()
+        tokens0 = (GROQ.stats["prompt_tokens"], GROQ.stats["completion_tokens"])
+        calls0 = chat_requests()
+        t0 = time.perf_counter()
+        results = await fn()
+        wall = time.perf_counter() - t0
+        return {
+            "wall": wall,
+            "ok": sum(1 for r in results if "error" not in r),
+            "completions": chat_requests() - calls0,
+            "prompt_tokens": GROQ.stats["prompt_tokens"] - tokens0[0],
+            "completion_tokens": GROQ.stats["completion_tokens"] - tokens0[1],
+        }
+
+    async def run():
+        try:
+            return await measure(per_address), await measure(batched)
+        finally:
+            await aclose_providers()
+
+    try:
+        single, batch = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    print(f"{'path':12s} {'wall s':>8s} {'ok':>6s} {'completions':>12s} {'prompt tok':>11s} {'compl tok':>10s}")
+    for name, r in (("per-address", single), ("batched", batch)):
+        print(f"{name:12s} {r['wall']:8.2f} {r['ok']:6d} {r['completions']:12d} {r['prompt_tokens']:11d} {r['completion_tokens']:10d}")
+    print(f"batch counters: {ai_services.BATCH_STATS}")
+    print(f"speedup {single['wall'] / batch['wall']:.1f}x, prompt tokens "
+          f"{100.0 * (1 - batch['prompt_tokens'] / max(1, single['prompt_tokens'])):.0f}% fewer")
+
+
+if __name__ == "__main__":
+    main()
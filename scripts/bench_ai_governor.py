@@ -0,0 +1,139 @@
+"""Benchmark: provider governor under a quota, bulk sync plus interactive asks.
+
+Starts scripts/stub_ai_server.py in-process with an enforced RPM quota and
+runs the same workload twice. The first run is "ungoverned": the governor is
+replaced by one with no RPM limit and a high fixed concurrency, roughly
+what the old fixed semaphore did. The second run is "governed": GROQ_RPM is
+set 10% under the stub's quota. The workload is a bulk burst of
+single-address classifications at PRIORITY_BULK, plus one interactive chat
+every --ask-interval seconds.
+
+Reports bulk throughput, how many calls the stub answered with 429, and the
+interactive latency/failure counts. With the governor, 429s should be near
+zero and interactive calls should jump the bulk queue.
+
+Usage (from the repo root):
+    python scripts/bench_ai_governor.py [--rpm 120] [--bulk 150] [--latency 0.3] [--ask-interval 1.0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "src", "app")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rpm", type=int, default=120, help="quota enforced by the stub")
+    ap.add_argument("--bulk", type=int, default=150, help="bulk classifications per run")
+    ap.add_argument("--latency", type=float, default=0.3)
+    ap.add_argument("--ask-interval", type=float, default=1.0)
+    ap.add_argument("--duration", type=float, default=45.0, help="stop each run after this many seconds")
+    ap.add_argument("--port", type=int, default=8768)
+    args = ap.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update({
+        "GROQ_API_KEY": "stub", "TAVILY_API_KEY": "",
+        "GROQ_BASE_URL": base + "/openai/v1",
+        "AI_GOV_INTERACTIVE_MAX_WAIT_SECONDS": "5",
+    })
+    sys.path.insert(0, SCRIPTS_DIR)
+    sys.path.insert(0, APP_DIR)
+    from stub_ai_server import serve
+    import ai_services
+    from ai_providers import GROQ, aclose_providers
+    from ai_governor import ProviderGovernor, request_priority, PRIORITY_BULK
+
+    server = serve(args.port, args.latency, 0.0, 0.0, 0.0, 0.0, args.rpm)
+
+    def stub_stats():
+        with urllib.request.urlopen(base + "/stats") as resp:
+            return json.load(resp)
+
+    async def workload(tag):
+        ai_services.CLASSIFY_STAGE.local.clear()
+        stop = time.perf_counter() + args.duration
+        rejections0 = stub_stats()["quota_rejections"]
+        asks, ask_failures = [], 0
+
+        async def bulk():
+            with request_priority(PRIORITY_BULK):
+                async def one(i):
+                    while time.perf_counter() < stop:
+                        res = await ai_services._classify(f"{tag} {i} Main St", f"status of {tag} {i} Main St")
+                        if not res.get("quota_exceeded"):
+                            return res
+                        # what the job queue does: come back after Retry-After
+                        await asyncio.sleep(res.get("retry_after_seconds") or 1)
+                    return {"error": "deadline"}
+                return await asyncio.gather(*(one(i) for i in range(args.bulk)))
+
+        async def interactive(done):
+            nonlocal ask_failures
+            while not done.is_set():
+                t0 = time.perf_counter()
+                try:
+                    await GROQ.chat([{"role": "user", "content": "How many properties?"}])
+                    asks.append(time.perf_counter() - t0)
+                except Exception:
+                    ask_failures += 1
+                await asyncio.sleep(args.ask_interval)
+
+        t0 = time.perf_counter()
+        done = asyncio.Event()
+        asker = asyncio.create_task(interactive(done))
+        results = await bulk()
+        wall = time.perf_counter() - t0
+        done.set()
+        await asker
+        return {
+            "wall": wall,
+            "bulk_ok": sum(1 for r in results if "error" not in r),
+            "rejections": stub_stats()["quota_rejections"] - rejections0,
+            "asks": len(asks),
+            "ask_failures": ask_failures,
+            "ask_p50": statistics.median(asks) if asks else float("nan"),
+            "ask_max": max(asks) if asks else float("nan"),
+            "governor": GROQ.governor.snapshot(),
+        }
+
+    class Ungoverned(ProviderGovernor):
+        """Fixed concurrency that ignores Retry-After (the old behaviour)."""
+
+        def _on_rate_limited(self, retry_after):
+            self.stats['rate_limited'] += 1
+
+    async def run():
+        try:
+            GROQ.governor = Ungoverned("groq", rpm=0, max_concurrency=32, min_concurrency=32, initial_concurrency=32)
+            ungoverned = await workload("u")
+            # let the stub's one-minute window drain before the second run
+            await asyncio.sleep(60)
+            GROQ.governor = ProviderGovernor("groq", rpm=int(args.rpm * 0.9), max_concurrency=16)
+            governed = await workload("g")
+            return ungoverned, governed
+        finally:
+            await aclose_providers()
+
+    try:
+        ungoverned, governed = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    print(f"stub quota {args.rpm} rpm, {args.bulk} bulk calls, one ask every {args.ask_interval}s")
+    print(f"{'run':11s} {'wall s':>7s} {'bulk ok':>8s} {'429s':>6s} {'asks':>5s} {'ask fail':>9s} {'ask p50':>8s} {'ask max':>8s}")
+    for name, r in (("ungoverned", ungoverned), ("governed", governed)):
+        print(f"{name:11s} {r['wall']:7.1f} {r['bulk_ok']:8d} {r['rejections']:6d} {r['asks']:5d} "
+              f"{r['ask_failures']:9d} {r['ask_p50']:8.2f} {r['ask_max']:8.2f}")
+    print(f"governor after governed run: {governed['governor']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark: concurrent AI status lookups through the pooled async providers.
+
+Starts scripts/stub_ai_server.py in-process, points ai_providers at it and
+fires N concurrent get_property_update_async calls (one Tavily search plus
+one Groq completion each). Reports wall time against the ideal (one stub
+round trip) and how many TCP connections the stub saw, which shows the
+connection pool being reused instead of one socket per call.
+
+Usage (from the repo root):
+    python scripts/bench_ai_providers.py [--calls 200] [--latency 0.5] [--search-latency 0.2] [--max-connections 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "src", "app")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--latency", type=float, default=0.5)
+    ap.add_argument("--search-latency", type=float, default=0.2)
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--max-connections", type=int, default=20)
+    args = ap.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update({
+        "GROQ_API_KEY": "stub", "TAVILY_API_KEY": "stub",
+        "GROQ_BASE_URL": base + "/openai/v1", "TAVILY_BASE_URL": base,
+        "AI_HTTP_MAX_CONNECTIONS": str(args.max_connections),
+        "AI_HTTP_MAX_KEEPALIVE": str(args.max_connections),
+    })
+    sys.path.insert(0, SCRIPTS_DIR)
+    sys.path.insert(0, APP_DIR)
+    from stub_ai_server import serve
+    from ai_services import get_property_update_async
+    from ai_providers import aclose_providers
+
+    server = serve(args.port, args.latency, args.search_latency)
+
+    async def run():
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(get_property_update_async(f"{i} Main St") for i in range(args.calls)))
+        wall = time.perf_counter() - t0
+        await aclose_providers()
+        return wall, results
+
+    try:
+        wall, results = asyncio.run(run())
+        with urllib.request.urlopen(base + "/stats") as resp:
+            stats = json.load(resp)
+    finally:
+        server.shutdown()
+
+    ok = sum(1 for r in results if "error" not in r)
+    round_trip = args.latency + args.search_latency
+    waves = -(-args.calls // args.max_connections)
+    print(f"calls: {args.calls}  ok: {ok}  wall: {wall:.2f}s  "
+          f"(one round trip {round_trip:.2f}s; pool of {args.max_connections} -> >= {waves * round_trip:.2f}s)")
+    print(f"stub saw {stats['connections']} TCP connections for "
+          f"{stats['chat_requests'] + stats['search_requests']} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark authenticated request throughput with and without the auth caches.
+
+Runs the FastAPI app in-process against a throwaway SQLite database, seeds a
+user plus some properties, then measures requests/sec for /me and /properties
+twice: once with the token/principal caches disabled ("before") and once with
+them enabled ("after").
+
+Usage (from the repo root):
+    python scripts/bench_auth.py [--requests 2000] [--concurrency 16] [--properties 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app")
+
+
+def _setup_env():
+    tmpdir = tempfile.mkdtemp(prefix="greentree-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+
+
+def _run(client, path, headers, total, concurrency):
+    def one(_):
+        r = client.get(path, headers=headers)
+        if r.status_code != 200:
+            raise RuntimeError(f"{path} -> {r.status_code}: {r.text[:200]}")
+
+    # warm-up so connection pools / first-hit costs don't skew the numbers
+    for _ in range(min(20, total)):
+        one(None)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed if elapsed else float("inf")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--properties", type=int, default=200)
+    args = ap.parse_args()
+
+    _setup_env()
+    from fastapi.testclient import TestClient
+    import main as app_main
+    from database import SessionLocal, Property
+
+    client = TestClient(app_main.app)
+    r = client.post("/register", json={"name": "bench", "email": "bench@example.com", "password": "bench-password"})
+    token = r.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    db = SessionLocal()
+    try:
+        db.add_all([Property(address=f"{i} Bench St", price=100000 + i) for i in range(args.properties)])
+        db.commit()
+    finally:
+        db.close()
+
+    results = {}
+    for label, enabled in (("before (caches off)", False), ("after (caches on)", True)):
+        app_main.TOKEN_CACHE.max_entries = 4096 if enabled else 0
+        app_main.PRINCIPALS.ttl = 30.0 if enabled else 0.0
+        app_main.TOKEN_CACHE.clear()
+        app_main.PRINCIPALS.clear()
+        for path in ("/me", "/properties"):
+            results[(label, path)] = _run(client, path, headers, args.requests, args.concurrency)
+
+    print(f"{'endpoint':<14}{'before req/s':>16}{'after req/s':>16}{'speedup':>10}")
+    for path in ("/me", "/properties"):
+        before = results[("before (caches off)", path)]
+        after = results[("after (caches on)", path)]
+        print(f"{path:<14}{before:>16.1f}{after:>16.1f}{after / before:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
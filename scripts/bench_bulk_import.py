@@ -0,0 +1,112 @@
+"""Benchmark: POST /import/{kind} vs one POST per row.
+
+Builds a throwaway SQLite database (or uses --database-url). It times:
+
+- "bulk":   --rows properties (and --rows / 10 agents) sent as one streamed CSV
+            or NDJSON body to /import/{kind}. Each body includes a few
+            duplicate and invalid rows, so the error path is exercised.
+- "single": --single rows sent through POST /properties, one request each,
+            which is what onboarding scripts did before.
+
+Both run through the FastAPI app in-process (TestClient), so the numbers
+include validation, duplicate checks, inserts and search indexing, but not
+network time.
+
+Usage (from the repo root):
+    python scripts/bench_bulk_import.py [--rows 100000] [--single 500] [--format csv|ndjson]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "src", "app")
+
+STREETS = ["Maple", "Oak", "Cedar", "Pine", "Elm", "Willow", "Birch", "Hawthorne", "Magnolia", "Sycamore"]
+SUFFIXES = ["St", "Ave", "Blvd", "Dr", "Ln", "Ct", "Way", "Terrace"]
+FIRST = ["James", "Maria", "Robert", "Linda", "Michael", "Sofia", "David", "Olivia", "Daniel", "Grace"]
+LAST = ["Whitaker", "Hartmann", "Okafor", "Nguyen", "Castellanos", "Lindqvist", "Moreau", "Takahashi"]
+
+
+def body(rows, fmt):
+    if fmt == "ndjson":
+        return "".join(json.dumps(r) + "\n" for r in rows).encode()
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+
+def chunks(data, size=64 * 1024):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=100_000, help="properties per bulk import")
+    ap.add_argument("--single", type=int, default=500, help="rows for the one-request-per-row baseline")
+    ap.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    ap.add_argument("--database-url", default=None)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    tmpdir = None
+    if args.database_url is None:
+        tmpdir = tempfile.mkdtemp(prefix="bench_bulk_")
+        args.database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("GEOCODER_BACKENDS", "offline")
+    os.environ.setdefault("AI_WORKER_MODE", "off")
+    os.environ.setdefault("PWD_HASH_WORKERS", "0")
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    rng = random.Random(args.seed)
+    props = [{"address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)} Unit {i}",
+              "price": round(rng.uniform(100, 900), 2), "status": rng.choice(["Active", "Pending", "Sold"]),
+              "agent": f"{rng.choice(FIRST)} {rng.choice(LAST)}", "company": "Acme"} for i in range(args.rows)]
+    props += [dict(props[0]), {**props[1], "address": props[1]["address"] + " B", "price": "n/a"}]
+    agents = [{"name": f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}", "email": f"agent{i}@example.com",
+               "phone": f"555-{i:06d}", "company": "Acme"} for i in range(max(1, args.rows // 10))]
+    agents.append(dict(agents[0]))
+    ctype = "text/csv" if args.format == "csv" else "application/x-ndjson"
+
+    with TestClient(app_main.app) as c:
+        token = c.post("/register", json={"name": "bench", "email": "bench@example.com",
+                                          "password": "bench-password"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": ctype}
+        for kind, rows in (("properties", props), ("agents", agents)):
+            data = body(rows, args.format)
+            t0 = time.perf_counter()
+            res = c.post(f"/import/{kind}", content=chunks(data), headers=headers).json()
+            wall = time.perf_counter() - t0
+            print(f"bulk {kind:12s} {res['received']:7d} rows, {res['inserted']:7d} inserted, "
+                  f"{res['error_count']} errors ({res['duplicates']} duplicates): "
+                  f"{wall:.2f}s = {res['received'] / wall:,.0f} rows/s ({len(data) / 1e6:.1f} MB {args.format})")
+
+        single = [{**p, "address": p["address"] + " S"} for p in props[:args.single]]
+        t0 = time.perf_counter()
+        for p in single:
+            c.post("/properties", json=p, headers={"Authorization": headers["Authorization"]})
+        wall = time.perf_counter() - t0
+        print(f"single POST /properties {len(single)} rows: {wall:.2f}s = {len(single) / wall:,.0f} rows/s")
+
+    if tmpdir is not None:
+        app_main.engine.dispose()
+        for f in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, f))
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Load benchmark for /login: p50/p99 latency at increasing concurrency.
+
+Runs the FastAPI app in-process (httpx ASGI transport) against a throwaway
+SQLite database, registers one user, then fires N concurrent logins for each
+concurrency level and reports latency percentiles, throughput and how many
+requests were shed with 503 because the hashing pool queue was full.
+
+Usage (from the repo root):
+    python scripts/bench_login.py [--levels 50,200,1000] [--workers 4] [--queue-max 64]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app")
+
+
+def _percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+async def _level(client, n):
+    body = {"name": "bench", "password": "bench-password"}
+    latencies, shed, failed = [], 0, 0
+
+    async def one():
+        nonlocal shed, failed
+        t0 = time.perf_counter()
+        r = await client.post("/login", json=body)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        if r.status_code == 503:
+            shed += 1
+        elif r.status_code != 200:
+            failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    wall = time.perf_counter() - start
+    return latencies, shed, failed, wall
+
+
+async def _main(args):
+    import httpx
+    import main as app_main
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await client.post("/register", json={"name": "bench", "email": "bench@example.com", "password": "bench-password"})
+        # warm the pool so process start-up isn't counted
+        await client.post("/login", json={"name": "bench", "password": "bench-password"})
+
+        print(f"hash pool: {app_main.HASH_POOL.workers} workers, queue max {app_main.HASH_POOL.queue_max}")
+        print(f"{'concurrency':>12}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'req/s':>10}{'503s':>8}{'errors':>8}")
+        for n in args.levels:
+            lat, shed, failed, wall = await _level(client, n)
+            print(f"{n:>12}{_percentile(lat, 50):>10.1f}{_percentile(lat, 99):>10.1f}"
+                  f"{statistics.mean(lat):>10.1f}{n / wall:>10.1f}{shed:>8}{failed:>8}")
+    app_main.HASH_POOL.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--levels", default="50,200,1000")
+    ap.add_argument("--workers", type=int, default=None, help="override PWD_HASH_WORKERS")
+    ap.add_argument("--queue-max", type=int, default=None, help="override PWD_HASH_QUEUE_MAX")
+    args = ap.parse_args()
+    args.levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    tmpdir = tempfile.mkdtemp(prefix="greentree-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    if args.workers is not None:
+        os.environ["PWD_HASH_WORKERS"] = str(args.workers)
+    if args.queue_max is not None:
+        os.environ["PWD_HASH_QUEUE_MAX"] = str(args.queue_max)
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark: /search index vs the LIKE '%q%' scans it replaces.
+
+Builds a throwaway SQLite database (or uses --database-url) with --rows
+properties plus proportional agents and photographers. It then times:
+
+- "like":   the old lookups. lower(col) LIKE '%q%' over properties.address,
+            properties.agent, agents.name and photographers.name, one query
+            per column, with no typo tolerance.
+- "search": SearchIndex.search() on the detected backend (fts5 on SQLite).
+
+It runs exact substrings, typos and near-misses, and reports the median
+latency and hit count per query. It also reports the full rebuild time and
+the per-row cost of an ORM insert with the incremental index hooks on.
+
+Usage (from the repo root):
+    python scripts/bench_search.py [--rows 100000] [--reps 20] [--database-url sqlite:////tmp/bench_search.db]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "src", "app")
+
+STREETS = ["Maple", "Oak", "Cedar", "Pine", "Elm", "Willow", "Birch", "Hawthorne", "Magnolia", "Sycamore",
+           "Lakeview", "Ridgecrest", "Meadowbrook", "Sunnyside", "Harbor", "Riverside", "Highland", "Juniper"]
+SUFFIXES = ["St", "Ave", "Blvd", "Dr", "Ln", "Ct", "Way", "Terrace"]
+FIRST = ["James", "Maria", "Robert", "Linda", "Michael", "Sofia", "David", "Olivia", "Daniel", "Grace",
+         "Jonathan", "Priya", "Mateo", "Hannah", "Lucas", "Amara"]
+LAST = ["Whitaker", "Hartmann", "Okafor", "Nguyen", "Castellanos", "Lindqvist", "Moreau", "Takahashi",
+        "Fitzgerald", "Abernathy", "Kowalski", "Delacroix", "Ramirez", "Sorensen"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=100_000, help="properties to generate")
+    ap.add_argument("--reps", type=int, default=20, help="timed runs per query")
+    ap.add_argument("--database-url", default=None)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    tmpdir = None
+    if args.database_url is None:
+        tmpdir = tempfile.mkdtemp(prefix="bench_search_")
+        args.database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, APP_DIR)
+    from sqlalchemy import func, insert, select
+    from database import engine, SessionLocal, Property, Agent, Photographer
+    from migrations import run_migrations
+    from search_index import SearchIndex, install_search_hooks, rebuild
+
+    run_migrations()
+    rng = random.Random(args.seed)
+    n_agents, n_photographers = max(1, args.rows // 50), max(1, args.rows // 200)
+    agents = [f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}" for i in range(n_agents)]
+    with engine.begin() as conn:
+        conn.execute(insert(Agent), [{"name": n, "email": f"agent{i}@example.com", "company": "Acme"}
+                                     for i, n in enumerate(agents)])
+        conn.execute(insert(Photographer), [{"name": f"{rng.choice(FIRST)} {rng.choice(LAST)} P{i}",
+                                             "email": f"photo{i}@example.com", "company": "Acme"}
+                                            for i in range(n_photographers)])
+        conn.execute(insert(Property), [{
+            "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)} Unit {i}",
+            "agent": rng.choice(agents), "photographer_id": rng.randint(1, n_photographers),
+            "company": "Acme", "status": "Active", "price": 1000.0, "paid": False,
+        } for i in range(args.rows)])
+        # bulk core inserts bypass the ORM hooks
+        t0 = time.perf_counter()
+        rebuild(conn)
+        rebuild_s = time.perf_counter() - t0
+
+    index = SearchIndex(engine)
+    index.detect()
+    install_search_hooks(index)
+
+    def like(conn, q):
+        pat = f"%{q}%"
+        hits = 0
+        for col, stmt in (
+            (Property.address, select(Property.id)),
+            (Property.agent, select(Property.id)),
+            (Agent.name, select(Agent.id)),
+            (Photographer.name, select(Photographer.id)),
+        ):
+            hits += len(conn.execute(stmt.where(Property.company == "Acme" if col.class_ is Property else col.class_.company == "Acme",
+                                                func.lower(col).like(pat)).limit(20)).all())
+        return hits
+
+    def search(conn, q):
+        return len(index.search(conn, q, "Acme", limit=20))
+
+    queries = ["meadowbrook", "medowbrook", "whitaker", "witaker", "hartman", "7 sycamore", "unit 4242",
+               "castelanos", "zzqx"]
+    print(f"{args.rows} properties, {n_agents} agents, {n_photographers} photographers; "
+          f"backend={index.backend}; full rebuild {rebuild_s:.2f}s")
+    print(f"{'query':14s} {'like ms':>9s} {'like hits':>10s} {'search ms':>10s} {'search hits':>12s}")
+    with engine.connect() as conn:
+        for q in queries:
+            out = {}
+            for name, fn in (("like", like), ("search", search)):
+                fn(conn, q)  # warm
+                times = []
+                for _ in range(args.reps):
+                    t0 = time.perf_counter()
+                    hits = fn(conn, q)
+                    times.append((time.perf_counter() - t0) * 1000.0)
+                out[name] = (statistics.median(times), hits)
+            print(f"{q:14s} {out['like'][0]:9.2f} {out['like'][1]:10d} {out['search'][0]:10.2f} {out['search'][1]:12d}")
+    print(f"index stats: {index.stats()}")
+
+    # incremental maintenance cost: ORM inserts with and without the hooks' extra statements
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        for i in range(200):
+            db.add(Property(address=f"{i} Benchmark Row", agent=agents[0], company="Acme"))
+            db.commit()
+        hooked = (time.perf_counter() - t0) / 200 * 1000.0
+        index.backend = "none"  # hooks become no-ops
+        t0 = time.perf_counter()
+        for i in range(200):
+            db.add(Property(address=f"{i} Benchmark Row B", agent=agents[0], company="Acme"))
+            db.commit()
+        plain = (time.perf_counter() - t0) / 200 * 1000.0
+    finally:
+        db.close()
+    print(f"ORM insert+commit: {plain:.2f} ms/row without index upkeep, {hooked:.2f} ms/row with it")
+
+    if tmpdir is not None:
+        engine.dispose()
+        for f in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, f))
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
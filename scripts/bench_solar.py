@@ -0,0 +1,60 @@
+"""Benchmark: a year of golden hours for 10k properties with the vectorized engine.
+
+Computes sun_logic.solar_events over a properties x days grid (processed in
+month-sized chunks to bound memory) and compares against the per-call
+get_optimal_times wrapper, extrapolated from a sample of calls.
+
+Usage (from the repo root):
+    python scripts/bench_solar.py [--properties 10000] [--days 365] [--chunk-days 31] [--sample-calls 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--properties", type=int, default=10000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--chunk-days", type=int, default=31)
+    ap.add_argument("--sample-calls", type=int, default=2000)
+    args = ap.parse_args()
+
+    from sun_logic import solar_events, get_optimal_times
+
+    rng = np.random.default_rng(1)
+    # a continental-US-like portfolio
+    lat = rng.uniform(25.0, 49.0, args.properties)
+    lng = rng.uniform(-124.0, -67.0, args.properties)
+    days = np.datetime64("2025-01-01") + np.arange(args.days).astype("timedelta64[D]")
+
+    start = time.perf_counter()
+    windows = 0
+    for i in range(0, args.days, args.chunk_days):
+        chunk = days[i:i + args.chunk_days]
+        ev = solar_events(lat[:, None], lng[:, None], chunk[None, :])
+        windows += int(np.count_nonzero(~np.isnan(ev["golden_start"])))
+    vec_s = time.perf_counter() - start
+    pairs = args.properties * args.days
+
+    n = min(args.sample_calls, pairs)
+    idx = rng.integers(0, args.properties, n)
+    day_strs = [str(d) for d in days[rng.integers(0, args.days, n)]]
+    start = time.perf_counter()
+    for k in range(n):
+        get_optimal_times(float(lat[idx[k]]), float(lng[idx[k]]), day_strs[k])
+    per_call_s = (time.perf_counter() - start) / n
+
+    print(f"pairs (properties x days): {pairs:,}  golden windows found: {windows:,}")
+    print(f"vectorized solar_events:   {vec_s:8.2f} s  ({pairs / vec_s:,.0f} pairs/s)")
+    print(f"get_optimal_times per call:{per_call_s * 1e3:8.3f} ms  -> {per_call_s * pairs:,.0f} s extrapolated")
+    print(f"speedup: {per_call_s * pairs / vec_s:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
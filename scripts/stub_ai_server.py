@@ -0,0 +1,175 @@
+"""Local stub that imitates the Groq and Tavily HTTP APIs.
+
+Serves
+    POST /openai/v1/chat/completions   (Groq, OpenAI-compatible)
+    POST /search                        (Tavily)
+    GET  /stats                         request / connection counters
+with a configurable per-request latency, so the async provider layer can be
+exercised without network access or API keys. The chat endpoint answers with
+a JSON status object in the shape ai_services expects, or a JSON array when
+the prompt is a batch ("Items:" followed by one JSON object per line).
+--drop-rate leaves items out of batch answers to exercise split/retry, and
+--tokens-per-second adds generation time proportional to the answer length.
+--rpm enforces a requests-per-minute quota on chat completions the way Groq
+does: over-quota calls get 429 with a Retry-After of the seconds until a
+slot frees up.
+
+Point the app at it with:
+    GROQ_API_KEY=stub TAVILY_API_KEY=stub \
+    GROQ_BASE_URL=http://127.0.0.1:8765/openai/v1 TAVILY_BASE_URL=http://127.0.0.1:8765
+
+Usage (from the repo root):
+    python scripts/stub_ai_server.py [--port 8765] [--latency 0.5] [--search-latency 0.2] [--error-rate 0]
+        [--drop-rate 0] [--tokens-per-second 0] [--rpm 0]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS = {"connections": 0, "chat_requests": 0, "search_requests": 0, "errors": 0, "quota_rejections": 0}
+_LOCK = threading.Lock()
+_CHAT_TIMES = deque()  # start times of chat calls within the last minute (--rpm)
+
+
+def _over_quota(rpm):
+    """Seconds until a chat slot frees up under `rpm`, or 0 to admit (and count) the call."""
+    if not rpm:
+        return 0.0
+    now = time.monotonic()
+    with _LOCK:
+        while _CHAT_TIMES and now - _CHAT_TIMES[0] >= 60.0:
+            _CHAT_TIMES.popleft()
+        if len(_CHAT_TIMES) >= rpm:
+            STATS["quota_rejections"] += 1
+            return 60.0 - (now - _CHAT_TIMES[0])
+        _CHAT_TIMES.append(now)
+        return 0.0
+
+
+def _bump(key):
+    with _LOCK:
+        STATS[key] += 1
+
+
+def _answer(prompt, drop_rate):
+    """Single status object, or an array for a batch prompt."""
+    def status(extra):
+        return dict({"status": "Active", "sold_date": None, "confidence": 0.5}, **extra)
+
+    if "Items:\n" not in prompt:
+        return json.dumps(status({"summary": f"stub answer ({len(prompt)} prompt chars)"}))
+    out = []
+    for line in prompt.split("Items:\n", 1)[1].splitlines():
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if drop_rate and random.random() < drop_rate:
+            continue
+        out.append(status({"id": item.get("id"), "summary": f"stub answer for {item.get('address')}"}))
+    return json.dumps(out)
+
+
+def make_handler(latency, search_latency, error_rate, drop_rate=0.0, tokens_per_second=0.0, rpm=0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so client pooling is visible in /stats
+
+        def setup(self):
+            super().setup()
+            _bump("connections")
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with _LOCK:
+                    self._send(200, dict(STATS))
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                req = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "invalid json"})
+                return
+            if error_rate and random.random() < error_rate:
+                _bump("errors")
+                self._send(429, {"error": "rate limited"}, {"Retry-After": "1"})
+                return
+            if self.path.endswith("/chat/completions"):
+                wait = _over_quota(rpm)
+                if wait:
+                    self._send(429, {"error": "rate limit reached for requests per minute"},
+                               {"Retry-After": str(max(1, int(wait + 0.999)))})
+                    return
+                _bump("chat_requests")
+                prompt = (req.get("messages") or [{}])[-1].get("content", "")
+                content = _answer(prompt, drop_rate)
+                time.sleep(latency + (len(content) / 4 / tokens_per_second if tokens_per_second else 0.0))
+                self._send(200, {
+                    "id": "stub", "object": "chat.completion", "model": req.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                              "total_tokens": (len(prompt) + len(content)) // 4},
+                })
+            elif self.path == "/search":
+                _bump("search_requests")
+                time.sleep(search_latency)
+                query = req.get("query", "")
+                self._send(200, {"query": query, "results": [
+                    {"title": f"Listing for {query}", "url": "https://example.invalid/listing", "content": "Active listing."},
+                ]})
+            else:
+                self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def serve(port=8765, latency=0.5, search_latency=0.2, error_rate=0.0, drop_rate=0.0, tokens_per_second=0.0, rpm=0):
+    """Start the stub in a daemon thread; returns the server (call .shutdown())."""
+    server = ThreadingHTTPServer(("127.0.0.1", port),
+                                 make_handler(latency, search_latency, error_rate, drop_rate, tokens_per_second, rpm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.5, help="chat completion latency (s)")
+    ap.add_argument("--search-latency", type=float, default=0.2, help="search latency (s)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="fraction of batch items left out of answers")
+    ap.add_argument("--tokens-per-second", type=float, default=0.0, help="generation speed (0 = instant)")
+    ap.add_argument("--rpm", type=int, default=0, help="chat requests per minute before 429s (0 = unlimited)")
+    args = ap.parse_args()
+    server = serve(args.port, args.latency, args.search_latency, args.error_rate, args.drop_rate,
+                   args.tokens_per_second, args.rpm)
+    print(f"stub Groq/Tavily API on http://127.0.0.1:{args.port} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Validate the vectorized solar engine in sun_logic against Astral.
+
+Samples random (lat, lng, date) triples, computes sunrise/sunset with
+sun_logic.solar_events and with astral.sun for the same local day, and reports
+the absolute differences. Exits non-zero if any difference exceeds the
+tolerance (default 60 s, the accuracy stated in sun_logic).
+
+Usage (from the repo root; requires `pip install astral`):
+    python scripts/validate_solar.py [--samples 2000] [--max-lat 60] [--tolerance 60]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--samples", type=int, default=2000)
+    ap.add_argument("--max-lat", type=float, default=60.0)
+    ap.add_argument("--tolerance", type=float, default=60.0, help="seconds")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    from astral import Observer
+    from astral.sun import sunrise as astral_sunrise, sunset as astral_sunset
+    from sun_logic import solar_events
+
+    rng = np.random.default_rng(args.seed)
+    lat = rng.uniform(-args.max_lat, args.max_lat, args.samples)
+    lng = rng.uniform(-180.0, 180.0, args.samples)
+    days = np.datetime64("2025-01-01") + rng.integers(0, 365, args.samples).astype("timedelta64[D]")
+    ev = solar_events(lat, lng, days)
+
+    diffs = {"sunrise": [], "sunset": []}
+    skipped = 0
+    for i in range(args.samples):
+        day = days[i].astype(datetime)
+        # astral resolves events on the local calendar day; use the solar-time offset
+        local_tz = timezone(timedelta(hours=round(lng[i] / 15.0)))
+        obs = Observer(latitude=float(lat[i]), longitude=float(lng[i]))
+        midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        for key, fn in (("sunrise", astral_sunrise), ("sunset", astral_sunset)):
+            ours = ev[key][i]
+            try:
+                ref = fn(obs, date=day, tzinfo=local_tz)
+            except ValueError:
+                # sun never rises/sets at this location/date
+                if not np.isnan(ours):
+                    skipped += 1
+                continue
+            if np.isnan(ours):
+                skipped += 1
+                continue
+            got = midnight + timedelta(minutes=float(ours))
+            diffs[key].append(abs((got - ref).total_seconds()))
+
+    worst = 0.0
+    for key, values in diffs.items():
+        v = np.asarray(values)
+        worst = max(worst, v.max())
+        print(f"{key:8s} n={len(v):5d}  mean={v.mean():6.1f}s  p99={np.percentile(v, 99):6.1f}s  max={v.max():6.1f}s")
+    print(f"polar-day/night disagreements skipped: {skipped}")
+    print(f"tolerance {args.tolerance:.0f}s -> {'OK' if worst <= args.tolerance else 'FAIL'}")
+    sys.exit(0 if worst <= args.tolerance else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+address_keys
+
+The canonical form of a free-text address, shared by everything keyed on
+one: the AI cache (ai_cache), AI sync task dedup (ai_jobs, the
+ai_sync_tasks.address_key column) and the geocoder (geocoding, the
+geocode_cache table and the offline gazetteer). Changing it re-keys all
+of them, so persisted keys written before the change stop matching.
+"""
+
+import re
+
+_WS_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[.#]")
+
+
+def normalize_address(address: str) -> str:
+    """Return a canonical key for a free-text address.
+
+    Lowercases, drops '.'/'#', normalizes comma spacing and collapses
+    whitespace so '123 Main St.,  Springfield' and '123 main st, springfield'
+    share an entry.
+    """
+    if not address:
+        return ''
+    s = _PUNCT_RE.sub('', str(address).lower())
+    s = ', '.join(part.strip() for part in s.split(','))
+    return _WS_RE.sub(' ', s).strip(' ,')
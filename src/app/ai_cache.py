@@ -0,0 +1,547 @@
+"""
+ai_cache
+
+Bounded cache for AI property summaries. Entries are keyed by a normalized
+address (not by user) so every tenant looking at the same listing shares one
+Groq/Tavily round trip. There are two tiers:
+
+- an in-process LRU with a size cap and TTL (always on)
+- an optional shared SQLite tier so several uvicorn workers on one host can
+  reuse each other's results (enable with AI_CACHE_SHARED_PATH)
+
+Concurrent misses on the same address are collapsed into a single upstream
+call ("single-flight"); every waiter gets the same result.
+
+Summaries have two TTLs:
+- Soft (AI_CACHE_SOFT_TTL_SECONDS). Until then an entry is fresh. After it,
+  lookup() still returns the entry, marked stale, so /ai/summary can answer
+  instantly. The caller schedules one background refresh per address
+  (begin_revalidate() dedups them).
+- Hard (AI_CACHE_HARD_TTL_SECONDS). After it, the entry is dropped.
+
+get()/get_entry() return fresh entries only, so bulk sync still refreshes
+stale ones. RefreshAhead re-queues frequently read addresses shortly before
+they go stale, so hot listings rarely serve stale data at all.
+
+A local entry that is stale, or due for refresh-ahead, is checked against
+the shared tier for a newer copy before it is served or re-queued. That
+copy may have been stored by a refresh that ran in another process: an
+external AI worker, another API worker, or another process's in-process
+worker. When the worker can run out of process, stale-while-revalidate and
+refresh-ahead therefore need AI_CACHE_SHARED_PATH. Without it, the process
+that served the stale entry never sees the refreshed value and keeps
+serving its local copy until the hard TTL.
+
+StageCache applies the same tiers to the individual stages of the AI
+pipeline (Tavily search keyed by address, LLM classification keyed by a
+content hash) so each stage can be reused and measured on its own.
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from address_keys import normalize_address
+
+logger = logging.getLogger('ai_cache')
+
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL_SECONDS", "21600"))  # default 6 hours
+# served as fresh until the soft TTL, served stale (and revalidated) until the hard TTL
+AI_CACHE_SOFT_TTL = int(os.getenv("AI_CACHE_SOFT_TTL_SECONDS", str(AI_CACHE_TTL)))
+AI_CACHE_HARD_TTL = int(os.getenv("AI_CACHE_HARD_TTL_SECONDS", str(AI_CACHE_SOFT_TTL * 4)))
+# a revalidation that has not landed after this long may be scheduled again
+AI_CACHE_REVALIDATE_TIMEOUT = float(os.getenv("AI_CACHE_REVALIDATE_TIMEOUT_SECONDS", "300"))
+# refresh-ahead: re-queue addresses read at least MIN_HITS times once they
+# reach FRACTION of the soft TTL, checking every INTERVAL seconds
+AI_REFRESH_AHEAD = os.getenv("AI_REFRESH_AHEAD", "1").lower() in ("1", "true", "yes")
+AI_REFRESH_AHEAD_INTERVAL = float(os.getenv("AI_REFRESH_AHEAD_INTERVAL_SECONDS", "60"))
+AI_REFRESH_AHEAD_FRACTION = float(os.getenv("AI_REFRESH_AHEAD_FRACTION", "0.8"))
+AI_REFRESH_AHEAD_MIN_HITS = int(os.getenv("AI_REFRESH_AHEAD_MIN_HITS", "3"))
+AI_REFRESH_AHEAD_BATCH = int(os.getenv("AI_REFRESH_AHEAD_BATCH", "100"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2048"))
+# path to a sqlite file shared by workers on the same host; unset disables the tier
+AI_CACHE_SHARED_PATH = os.getenv("AI_CACHE_SHARED_PATH")
+# per-stage caches (see StageCache); classification is content-addressed so it can live long
+AI_SEARCH_CACHE_TTL = int(os.getenv("AI_SEARCH_CACHE_TTL_SECONDS", "3600"))
+AI_CLASSIFY_CACHE_TTL = int(os.getenv("AI_CLASSIFY_CACHE_TTL_SECONDS", "604800"))
+AI_STAGE_CACHE_MAX_ENTRIES = int(os.getenv("AI_STAGE_CACHE_MAX_ENTRIES", "4096"))
+
+class LRUTTLCache:
+    """Thread-safe in-process LRU with a per-entry TTL.
+
+    Values are stored as (value, stored_at) tuples so callers can report age.
+    """
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES, ttl: float = AI_CACHE_TTL):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0    # dropped because the cache was full
+        self.expirations = 0  # dropped because the entry outlived the TTL
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if (time.time() - entry[1]) >= self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def peek(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Like get() but without touching LRU order or expiring anything."""
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key: str, value: Any, stored_at: float | None = None) -> None:
+        with self._lock:
+            self._data[key] = (value, stored_at if stored_at is not None else time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """Shared cache tier stored in a local SQLite file (WAL mode).
+
+    Safe to open from several processes; each process keeps one connection
+    guarded by a lock. Values must be JSON-serializable.
+    """
+
+    def __init__(self, path: str, ttl: float = AI_CACHE_TTL, table: str = 'ai_cache'):
+        self.path = path
+        self.ttl = float(ttl)
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        if (time.time() - row[1]) >= self.ttl:
+            self.delete(key)
+            return None
+        try:
+            return json.loads(row[0]), float(row[1])
+        except Exception:
+            return None
+
+    def set(self, key: str, value: Any, stored_at: float | None = None) -> None:
+        payload = json.dumps(value, default=str)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, payload, stored_at if stored_at is not None else time.time()),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def prune(self) -> int:
+        """Delete expired rows; returns the number removed."""
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,))
+            return cur.rowcount or 0
+
+
+class AICache:
+    """Two-tier AI summary cache with single-flight fetches and counters."""
+
+    def __init__(self, local: LRUTTLCache, shared: SQLiteCacheBackend | None = None,
+                 soft_ttl: float = AI_CACHE_SOFT_TTL):
+        self.local = local
+        self.shared = shared
+        # the tiers expire at the hard TTL; soft_ttl only marks entries stale
+        self.soft_ttl = min(float(soft_ttl), local.ttl)
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that joined an in-flight fetch instead of starting one
+        self.revalidations = 0
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._revalidating: Dict[str, float] = {}  # key -> monotonic time scheduled
+        self._reads: Dict[str, List[Any]] = {}  # key -> [address, reads since last refresh-ahead pass]
+
+    @staticmethod
+    def key(address: str) -> str:
+        return f"addr:{normalize_address(address)}"
+
+    def _read_shared(self, k: str, local: Optional[Tuple[Any, float]] = None) -> Optional[Tuple[Any, float]]:
+        """The shared entry if it is newer than `local` (copied into the local tier), else `local`."""
+        if self.shared is None:
+            return local
+        try:
+            entry = self.shared.get(k)
+        except Exception:
+            logger.exception('shared AI cache read failed')
+            return local
+        if entry is None or (local is not None and entry[1] <= local[1]):
+            return local
+        self.shared_hits += 1
+        self.local.set(k, entry[0], entry[1])
+        if local is not None:
+            # a refresh landed in another process
+            self._revalidating.pop(k, None)
+        return entry
+
+    def _read(self, k: str) -> Optional[Tuple[Any, float]]:
+        entry = self.local.get(k)
+        if entry is None or time.time() - entry[1] >= self.soft_ttl:
+            return self._read_shared(k, entry)
+        return entry
+
+    def lookup(self, address: str) -> Optional[Tuple[Any, float, bool]]:
+        """(value, age_seconds, stale) for an entry within the hard TTL, else None."""
+        k = self.key(address)
+        entry = self._read(k)
+        if entry is None:
+            self.misses += 1
+            return None
+        age = max(0.0, time.time() - entry[1])
+        stale = age >= self.soft_ttl
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        reads = self._reads.get(k)
+        if reads is None:
+            if len(self._reads) >= self.local.max_entries:
+                self._reads.pop(next(iter(self._reads)))
+            self._reads[k] = [address, 1]
+        else:
+            reads[1] += 1
+        return entry[0], age, stale
+
+    def get_entry(self, address: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, stored_at) for a fresh entry or None; updates counters."""
+        hit = self.lookup(address)
+        if hit is None or hit[2]:
+            return None
+        return hit[0], time.time() - hit[1]
+
+    def get(self, address: str) -> Any:
+        entry = self.get_entry(address)
+        return entry[0] if entry is not None else None
+
+    def set(self, address: str, value: Any) -> None:
+        k = self.key(address)
+        now = time.time()
+        self._revalidating.pop(k, None)
+        self.local.set(k, value, now)
+        if self.shared is not None:
+            try:
+                self.shared.set(k, value, now)
+            except Exception:
+                logger.exception('shared AI cache write failed')
+
+    def invalidate(self, address: str) -> None:
+        k = self.key(address)
+        self.local.delete(k)
+        if self.shared is not None:
+            try:
+                self.shared.delete(k)
+            except Exception:
+                pass
+
+    def begin_revalidate(self, address: str) -> bool:
+        """True if the caller should schedule a refresh for a stale address;
+        False while one is already scheduled (until set() lands a new value or
+        AI_CACHE_REVALIDATE_TIMEOUT passes)."""
+        k = self.key(address)
+        now = time.monotonic()
+        started = self._revalidating.get(k)
+        if started is not None and now - started < AI_CACHE_REVALIDATE_TIMEOUT:
+            return False
+        self._revalidating[k] = now
+        self.revalidations += 1
+        return True
+
+    def refresh_candidates(self, fraction: float = AI_REFRESH_AHEAD_FRACTION,
+                           min_hits: int = AI_REFRESH_AHEAD_MIN_HITS, limit: int = AI_REFRESH_AHEAD_BATCH) -> List[str]:
+        """Hot addresses nearing the soft TTL, most-read first; starts a new read window.
+
+        Candidates are marked as revalidating so a stale read does not queue
+        them a second time.
+        """
+        now, cutoff = time.time(), self.soft_ttl * fraction
+        hot = []
+        for k, (address, reads) in list(self._reads.items()):
+            entry = self.local.peek(k)
+            if entry is None:
+                self._reads.pop(k, None)
+                continue
+            if reads >= min_hits and now - entry[1] >= cutoff and k not in self._revalidating:
+                entry = self._read_shared(k, entry)
+                if now - entry[1] >= cutoff:
+                    hot.append((reads, address))
+        self._reads.clear()
+        hot.sort(key=lambda r: -r[0])
+        out = [address for _, address in hot[:max(0, limit)]]
+        for address in out:
+            self.begin_revalidate(address)
+        return out
+
+    def fetch(self, address: str, fetcher: Callable[[], Awaitable[Any]]) -> "asyncio.Task[Any]":
+        """Start (or join) the single upstream fetch for an address.
+
+        Returns the shared task; successful, non-error dict results are stored
+        in the cache when it completes. Callers that time out should not cancel
+        the task (wrap it in asyncio.shield) so other waiters still get a result.
+        """
+        k = self.key(address)
+        task = self._inflight.get(k)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            return task
+
+        async def _run():
+            try:
+                res = await fetcher()
+                if isinstance(res, dict) and not res.get('error'):
+                    self.set(address, res)
+                return res
+            finally:
+                self._inflight.pop(k, None)
+
+        task = asyncio.get_running_loop().create_task(_run())
+        self._inflight[k] = task
+        return task
+
+    async def get_or_fetch(self, address: str, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self.get(address)
+        if cached is not None:
+            return cached
+        return await asyncio.shield(self.fetch(address, fetcher))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': ((self.hits + self.stale_hits) / lookups) if lookups else 0.0,
+            'evictions': self.local.evictions,
+            'expirations': self.local.expirations,
+            'entries': len(self.local),
+            'max_entries': self.local.max_entries,
+            'ttl_seconds': self.local.ttl,
+            'soft_ttl_seconds': self.soft_ttl,
+            'revalidations': self.revalidations,
+            'revalidating': len(self._revalidating),
+            'inflight': len(self._inflight),
+            'shared_enabled': self.shared is not None,
+        }
+
+
+class StageCache:
+    """Cache for one stage of the AI pipeline, with per-stage counters.
+
+    `run(key, compute)` returns the cached value for `key` or awaits
+    `compute()` once (concurrent callers for the same key share the call) and
+    stores the result when `cacheable(result)` is true. Upstream latencies of
+    recent misses are kept so stats() can report them next to the hit rate.
+    """
+
+    def __init__(self, name: str, local: LRUTTLCache, shared: SQLiteCacheBackend | None = None,
+                 latency_samples: int = 512):
+        self.name = name
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.latency_samples = max(1, int(latency_samples))
+        self._latencies: list = []  # ring buffer of recent upstream latencies (seconds)
+        self._latency_pos = 0
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+    def record_latency(self, seconds: float) -> None:
+        if len(self._latencies) < self.latency_samples:
+            self._latencies.append(seconds)
+        else:
+            self._latencies[self._latency_pos] = seconds
+            self._latency_pos = (self._latency_pos + 1) % self.latency_samples
+
+    def get(self, key: str) -> Any:
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception:
+                logger.exception('shared %s cache read failed', self.name)
+                entry = None
+            if entry is not None:
+                self.shared_hits += 1
+                self.local.set(key, entry[0], entry[1])
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        self.local.set(key, value, now)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, now)
+            except Exception:
+                logger.exception('shared %s cache write failed', self.name)
+
+    def lookup(self, key: str) -> Any:
+        """get() that counts a hit or miss, for callers that compute misses themselves."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]],
+                  cacheable: Callable[[Any], bool] = lambda v: v is not None, refresh: bool = False) -> Any:
+        """Cached value for `key`, else the (shared) result of `compute()`.
+
+        refresh=True skips the lookup but still stores the new result.
+        """
+        if not refresh:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        async def _run():
+            t0 = time.perf_counter()
+            try:
+                value = await compute()
+                if cacheable(value):
+                    self.set(key, value)
+                return value
+            finally:
+                self.record_latency(time.perf_counter() - t0)
+                self._inflight.pop(key, None)
+
+        task = asyncio.get_running_loop().create_task(_run())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        lat = sorted(self._latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p / 100.0 * len(lat)))] * 1000.0, 1) if lat else None
+
+        avg_ms = round(sum(lat) / len(lat) * 1000.0, 1) if lat else None
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'upstream_latency_ms': {'avg': avg_ms, 'p50': pct(50), 'p95': pct(95), 'samples': len(lat)},
+            # rough time saved by hits, at the average upstream latency
+            'saved_seconds': round(self.hits * (sum(lat) / len(lat)), 1) if lat else 0.0,
+            'entries': len(self.local),
+            'ttl_seconds': self.local.ttl,
+            'inflight': len(self._inflight),
+        }
+
+
+def build_stage_cache(name: str, ttl: float) -> StageCache:
+    """Create a pipeline stage cache; shares AI_CACHE_SHARED_PATH when set."""
+    shared = None
+    if AI_CACHE_SHARED_PATH:
+        try:
+            shared = SQLiteCacheBackend(AI_CACHE_SHARED_PATH, ttl=ttl, table=f'ai_stage_{name}')
+        except Exception:
+            logger.exception('Could not open shared %s cache; using in-process tier only', name)
+            shared = None
+    return StageCache(name, LRUTTLCache(AI_STAGE_CACHE_MAX_ENTRIES, ttl), shared)
+
+
+def build_ai_cache() -> AICache:
+    """Create the process-wide cache from environment configuration."""
+    shared = None
+    if AI_CACHE_SHARED_PATH:
+        try:
+            shared = SQLiteCacheBackend(AI_CACHE_SHARED_PATH, ttl=AI_CACHE_HARD_TTL)
+        except Exception:
+            logger.exception('Could not open shared AI cache at %s; using in-process tier only', AI_CACHE_SHARED_PATH)
+            shared = None
+    return AICache(LRUTTLCache(AI_CACHE_MAX_ENTRIES, AI_CACHE_HARD_TTL), shared, soft_ttl=AI_CACHE_SOFT_TTL)
+
+
+class RefreshAhead:
+    """Periodically re-queues hot addresses before their summaries go stale.
+
+    `schedule(addresses)` is awaited with each pass's candidates (the API
+    enqueues them as one refresh job for the sync worker).
+    """
+
+    def __init__(self, cache: AICache, schedule: Callable[[List[str]], Awaitable[Any]],
+                 interval: float = AI_REFRESH_AHEAD_INTERVAL):
+        self.cache = cache
+        self.schedule = schedule
+        self.interval = max(1.0, interval)
+        self.stats = {'passes': 0, 'scheduled': 0}
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        addresses = self.cache.refresh_candidates()
+        self.stats['passes'] += 1
+        if addresses:
+            await self.schedule(addresses)
+            self.stats['scheduled'] += len(addresses)
+        return len(addresses)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('AI cache refresh-ahead pass failed')
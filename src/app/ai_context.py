@@ -0,0 +1,296 @@
+"""
+ai_context
+
+Per-company database snapshots for /ai/ask. The snapshot holds the property
+count, the newest sample properties, agent and photographer contacts, the
+recent daily statistics rollups and the all-time income total, plus the
+rendered context string. A question normally costs a dict lookup instead of the
+half-dozen queries that used to run per call.
+
+Snapshots are materialized on first use (by a loader the API supplies) and
+then kept current by ORM events (see install_context_hooks). Inserts,
+updates and deletes of Property, Agent and Photographer rows, plus the
+statistics rollup increments passed to record_change(), are collected per
+session and applied to the matching company's snapshot when the session
+commits; a rollback discards them. The unscoped snapshot (users
+without a company see every row) receives every change as well. Changes that
+cannot be patched exactly, such as deleting from a full list whose next row
+is unknown or moving a row between companies, mark the snapshot dirty, and
+it is reloaded on next use.
+
+Writes made with bulk/text SQL bypass the hooks; call invalidate() after
+them. Snapshots also expire after AI_CONTEXT_TTL_SECONDS, which bounds the
+staleness when several API processes write to one database.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+AI_CONTEXT_TTL = float(os.getenv("AI_CONTEXT_TTL_SECONDS", "300"))
+AI_CONTEXT_SAMPLE_PROPERTIES = 10
+AI_CONTEXT_CONTACTS = 20
+AI_CONTEXT_STAT_ROWS = 90
+
+_SESSION_KEY = 'ai_context_changes'
+
+
+class ContextSnapshot:
+    """Materialized /ai/ask context for one company scope.
+
+    Rows are plain dicts: properties carry id, address, status, price,
+    photographer_id and photographer_name; agents/photographers carry id,
+    name, email and phone; stats are daily rollups with date, shoots_count
+    and income_total, newest first.
+    """
+
+    def __init__(self, total_properties: int, properties: List[dict], agents: List[dict],
+                 photographers: List[dict], stats: List[dict], total_income: float,
+                 agents_complete: bool = True, photographers_complete: bool = True):
+        self.total_properties = int(total_properties)
+        self.properties = list(properties)[:AI_CONTEXT_SAMPLE_PROPERTIES]
+        self.agents = list(agents)[:AI_CONTEXT_CONTACTS]
+        self.photographers = list(photographers)[:AI_CONTEXT_CONTACTS]
+        self.stats = list(stats)[:AI_CONTEXT_STAT_ROWS]
+        self.total_income = float(total_income or 0.0)
+        # *_complete: the list holds every row in scope, so a delete can be patched
+        self.agents_complete = agents_complete
+        self.photographers_complete = photographers_complete
+        self.loaded_at = time.monotonic()
+        self.dirty = False
+        self._text: Optional[str] = None
+
+    # ----- derived values -----
+    @property
+    def total_shoots(self) -> int:
+        return sum(int(s.get('shoots_count') or 0) for s in self.stats)
+
+    @property
+    def avg_shoots_per_day(self) -> float:
+        # per calendar day since the oldest kept row, days without shoots included
+        if not self.stats:
+            return 0.0
+        days = (datetime.utcnow().date() - min(s['date'] for s in self.stats)).days + 1
+        return self.total_shoots / max(1, days)
+
+    @property
+    def context_text(self) -> str:
+        if self._text is None:
+            self._text = self._render()
+        return self._text
+
+    def _render(self) -> str:
+        ctx_lines = [f"Total properties in scope: {self.total_properties}"]
+        if self.properties:
+            ctx_lines.append("Sample properties (most recent):")
+            for p in self.properties:
+                pr = p.get('price')
+                pr_s = f"${float(pr):,.2f}" if pr is not None and str(pr) != 'None' else '—'
+                ctx_lines.append(f"- {p.get('address') or '—'} | status: {p.get('status') or 'Unknown'} | "
+                                 f"price: {pr_s} | photographer: {p.get('photographer_name') or '—'}")
+        if self.agents:
+            ctx_lines.append("Agents (name — email — phone):")
+            for a in self.agents:
+                ctx_lines.append(f"- {a.get('name') or '—'} — {a.get('email') or '—'} — {a.get('phone') or '—'}")
+        if self.photographers:
+            ctx_lines.append("Photographers (name — email — phone):")
+            for p in self.photographers:
+                ctx_lines.append(f"- {p.get('name') or '—'} — {p.get('email') or '—'} — {p.get('phone') or '—'}")
+        if self.stats:
+            ctx_lines.append("Statistics (recent):")
+            ctx_lines.append(f"- total_shoots: {self.total_shoots}")
+            ctx_lines.append(f"- total_income: ${self.total_income:,.2f}")
+            ctx_lines.append(f"- avg_shoots_per_day: {self.avg_shoots_per_day:.2f}")
+        return "\n".join(ctx_lines)
+
+    # ----- incremental patches -----
+    def apply(self, change: dict) -> None:
+        kind, op, row = change['kind'], change['op'], dict(change['row'])
+        handler = getattr(self, f'_apply_{kind}', None)
+        if handler is not None:
+            handler(op, row, change)
+            self._text = None
+
+    def _apply_property(self, op: str, row: dict, change: dict) -> None:
+        if op == 'insert':
+            self.total_properties += 1
+            self.properties.insert(0, row)
+            del self.properties[AI_CONTEXT_SAMPLE_PROPERTIES:]
+        elif op == 'update':
+            for i, p in enumerate(self.properties):
+                if p['id'] == row['id']:
+                    self.properties[i] = row
+        elif op == 'delete':
+            self.total_properties = max(0, self.total_properties - 1)
+            if any(p['id'] == row['id'] for p in self.properties):
+                self.dirty = True  # the next-newest property is not known here
+
+    def _apply_contacts(self, attr: str, op: str, row: dict) -> None:
+        rows = getattr(self, attr)
+        complete_attr = f'{attr}_complete'
+        if op == 'insert':
+            if len(rows) < AI_CONTEXT_CONTACTS:
+                rows.append(row)
+            else:
+                setattr(self, complete_attr, False)
+        elif op == 'update':
+            for i, r in enumerate(rows):
+                if r['id'] == row['id']:
+                    rows[i] = row
+        elif op == 'delete':
+            before = len(rows)
+            rows[:] = [r for r in rows if r['id'] != row['id']]
+            if len(rows) != before and not getattr(self, complete_attr):
+                self.dirty = True  # a row outside the list should move up
+
+    def _apply_agent(self, op: str, row: dict, change: dict) -> None:
+        self._apply_contacts('agents', op, row)
+
+    def _apply_photographer(self, op: str, row: dict, change: dict) -> None:
+        self._apply_contacts('photographers', op, row)
+        if op in ('update', 'delete'):
+            name = row.get('name') if op == 'update' else None
+            for p in self.properties:
+                if p.get('photographer_id') == row['id']:
+                    p['photographer_name'] = name
+                    if op == 'delete':
+                        p['photographer_id'] = None
+
+    def _apply_rollup(self, op: str, row: dict, change: dict) -> None:
+        # row: date plus shoots_count/income_total deltas (see stats_rollup.record)
+        self.total_income += float(row.get('income_total') or 0.0)
+        for s in self.stats:
+            if s['date'] == row['date']:
+                s['shoots_count'] = int(s.get('shoots_count') or 0) + int(row.get('shoots_count') or 0)
+                s['income_total'] = float(s.get('income_total') or 0.0) + float(row.get('income_total') or 0.0)
+                return
+        if len(self.stats) >= AI_CONTEXT_STAT_ROWS and row['date'] < self.stats[-1]['date']:
+            return  # older than every day kept
+        self.stats.append(row)
+        self.stats.sort(key=lambda s: s['date'], reverse=True)
+        del self.stats[AI_CONTEXT_STAT_ROWS:]
+
+
+class CompanySnapshots:
+    """company -> snapshot, materialized lazily and patched on commit.
+
+    Snapshots are any objects with `apply(change)`, `dirty` and `loaded_at`
+    (ContextSnapshot here, ai_intents.CompanyIndex for the name index).
+    """
+
+    def __init__(self, ttl: float = AI_CONTEXT_TTL):
+        self.ttl = float(ttl)
+        self._data: Dict[Optional[str], ContextSnapshot] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.patches = 0
+        self._generation = 0  # bumped on every applied commit
+
+    def get(self, company: Optional[str], loader: Callable[[Optional[str]], Any]) -> Any:
+        with self._lock:
+            snap = self._data.get(company)
+            if snap is not None and not snap.dirty and (self.ttl <= 0 or time.monotonic() - snap.loaded_at < self.ttl):
+                self.hits += 1
+                return snap
+            generation = self._generation
+        snap = loader(company)
+        with self._lock:
+            # a commit landed while loading: use this snapshot once, reload next time
+            snap.dirty = self._generation != generation
+            self._data[company] = snap
+            self.loads += 1
+        return snap
+
+    def apply(self, changes: List[dict]) -> None:
+        with self._lock:
+            self._generation += 1
+            for change in changes:
+                scopes = {change['company'], None}
+                if change.get('old_company', change['company']) != change['company']:
+                    # moved between companies: reload both sides
+                    for scope in (change['company'], change.get('old_company')):
+                        if scope in self._data:
+                            self._data[scope].dirty = True
+                    scopes = {None}
+                for scope in scopes:
+                    snap = self._data.get(scope)
+                    if snap is not None and not snap.dirty:
+                        snap.apply(change)
+                        self.patches += 1
+
+    def invalidate(self, company: Optional[str] = None, everything: bool = False) -> None:
+        with self._lock:
+            if everything:
+                self._data.clear()
+            else:
+                self._data.pop(company, None)
+                self._data.pop(None, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'loads': self.loads, 'patches': self.patches,
+                'companies': len(self._data), 'ttl_seconds': self.ttl}
+
+
+# ----------------------
+# ORM hooks
+# ----------------------
+def _row(kind: str, target: Any, connection) -> dict:
+    if kind == 'property':
+        row = {f: getattr(target, f, None) for f in ('id', 'address', 'status', 'price', 'agent', 'photographer_id')}
+        row['photographer_name'] = None
+        if row['photographer_id'] is not None:
+            from sqlalchemy import select
+            from database import Photographer
+            row['photographer_name'] = connection.execute(
+                select(Photographer.name).where(Photographer.id == row['photographer_id'])
+            ).scalar()
+        return row
+    return {f: getattr(target, f, None) for f in ('id', 'name', 'email', 'phone')}
+
+
+def record_change(session, change: dict) -> None:
+    """Queue a change for the registries; applied when `session` commits.
+
+    Used by the ORM hooks below and by writers that bypass the ORM, such as the
+    statistics rollup upserts ({'kind': 'rollup', 'op': 'increment', ...}).
+    """
+    session.info.setdefault(_SESSION_KEY, []).append(change)
+
+
+def install_context_hooks(session_factory, registries: List[CompanySnapshots], models: Dict[str, Any]) -> None:
+    """Patch every registry from ORM writes to `models` ({kind: model}) once they commit."""
+    from sqlalchemy import event, inspect
+    from sqlalchemy.orm import object_session
+
+    def _record(op: str, kind: str):
+        def handler(mapper, connection, target):
+            session = object_session(target)
+            if session is None:
+                return
+            state = inspect(target)
+            change = {'kind': kind, 'op': op, 'company': getattr(target, 'company', None),
+                      'row': _row(kind, target, connection)}
+            if op == 'update':
+                hist = state.attrs.company.history
+                if hist.deleted:
+                    change['old_company'] = hist.deleted[0]
+            record_change(session, change)
+        return handler
+
+    for kind, model in models.items():
+        for op in ('insert', 'update', 'delete'):
+            event.listen(model, f'after_{op}', _record(op, kind))
+
+    @event.listens_for(session_factory, 'after_commit')
+    def _apply(session):
+        changes = session.info.pop(_SESSION_KEY, None)
+        if changes:
+            for registry in registries:
+                registry.apply(changes)
+
+    @event.listens_for(session_factory, 'after_soft_rollback')
+    def _discard(session, previous_transaction):
+        session.info.pop(_SESSION_KEY, None)
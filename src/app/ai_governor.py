@@ -0,0 +1,341 @@
+"""
+ai_governor
+
+Process-wide admission control for AI provider calls. Each provider client
+(ai_providers.GROQ / TAVILY) owns a ProviderGovernor that every request
+passes through:
+
+- Token buckets for requests per minute and tokens per minute, holding
+  AI_GOV_BURST_SECONDS of quota. Set the limits about 10% under the
+  provider's quota so a burst cannot cross its sliding window. A request
+  reserves its estimated tokens up front, and the estimate is corrected from
+  the reported usage once the answer arrives.
+- An AIMD concurrency limit. Each success adds about one slot per window
+  (limit += 1/limit). A 429 halves the limit. A latency spike (a sample above
+  AI_GOV_LATENCY_FACTOR x the baseline) or a 5xx/transport error cuts it by
+  AI_GOV_BACKOFF_FACTOR. Decreases apply at most once per cooldown, so one
+  burst of failures shrinks the limit only once.
+- Retry-After: a 429 pauses all dispatch for that provider until the
+  deadline (AI_GOV_DEFAULT_RETRY_AFTER_SECONDS when the header is missing).
+- A priority queue. Waiters are served lowest priority value first, so
+  interactive calls (/ai/ask, /ai/summary) run ahead of bulk sync work.
+  Interactive callers also have a bounded wait: if a slot is not granted
+  within AI_GOV_INTERACTIVE_MAX_WAIT_SECONDS (or the provider is paused past
+  that point), QuotaExceeded is raised with a retry_after hint, and the API
+  turns it into 429 + Retry-After instead of hanging.
+
+Priority is carried in a context variable. Callers wrap bulk work in
+`with request_priority(PRIORITY_BULK):` (the sync worker does), and
+everything else defaults to interactive. scripts/bench_ai_governor.py drives
+the governor against scripts/stub_ai_server.py with an enforced RPM quota.
+
+Configuration (per provider, prefix GROQ_ or TAVILY_):
+    <P>_RPM / <P>_TPM                  per-minute quotas (0 = unlimited)
+    <P>_MAX_CONCURRENCY                AIMD ceiling (default 16)
+    <P>_MIN_CONCURRENCY                AIMD floor (default 1)
+    <P>_INITIAL_CONCURRENCY            starting limit (default 4)
+Shared:
+    AI_GOV_LATENCY_FACTOR              default 2.5
+    AI_GOV_BACKOFF_FACTOR              default 0.8
+    AI_GOV_COOLDOWN_SECONDS            default 2
+    AI_GOV_DEFAULT_RETRY_AFTER_SECONDS default 10
+    AI_GOV_INTERACTIVE_MAX_WAIT_SECONDS default 8
+    AI_GOV_BURST_SECONDS               bucket depth in seconds of quota (default 6)
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+AI_GOV_LATENCY_FACTOR = float(os.getenv("AI_GOV_LATENCY_FACTOR", "2.5"))
+AI_GOV_BACKOFF_FACTOR = float(os.getenv("AI_GOV_BACKOFF_FACTOR", "0.8"))
+AI_GOV_COOLDOWN_SECONDS = float(os.getenv("AI_GOV_COOLDOWN_SECONDS", "2"))
+AI_GOV_DEFAULT_RETRY_AFTER = float(os.getenv("AI_GOV_DEFAULT_RETRY_AFTER_SECONDS", "10"))
+AI_GOV_INTERACTIVE_MAX_WAIT = float(os.getenv("AI_GOV_INTERACTIVE_MAX_WAIT_SECONDS", "8"))
+AI_GOV_BURST_SECONDS = float(os.getenv("AI_GOV_BURST_SECONDS", "6"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar('ai_request_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Run provider calls made inside the block (and tasks it spawns) at `priority`."""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority() -> int:
+    return _PRIORITY.get()
+
+
+class QuotaExceeded(Exception):
+    """The governor could not admit a call in time; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1.0, retry_after)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute, holding at most `burst_seconds`
+    worth. A small burst keeps any 60 s window under per_minute x
+    (1 + burst_seconds / 60), so a provider's sliding-window quota is never
+    crossed when the rate is set that far below it. A zero rate means
+    unlimited. Reconciling a reservation can drive the
+    level negative (debt), which delays later callers accordingly.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = None):
+        self.per_minute = float(per_minute or 0)
+        burst = AI_GOV_BURST_SECONDS if burst_seconds is None else burst_seconds
+        self.capacity = max(1.0, self.per_minute * burst / 60.0) if self.per_minute else 0.0
+        self.level = self.capacity
+        self._stamp = time.monotonic()
+
+    @property
+    def limited(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self, now: float) -> None:
+        if self.limited:
+            self.level = min(self.capacity, self.level + (now - self._stamp) * self.per_minute / 60.0)
+        self._stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` (capped at capacity) can be taken."""
+        if not self.limited:
+            return 0.0
+        self._refill(now)
+        need = min(amount, self.capacity) - self.level
+        return 0.0 if need <= 0 else need * 60.0 / self.per_minute
+
+    def take(self, amount: float, now: float) -> None:
+        if self.limited:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Give back (delta < 0) or charge extra (delta > 0) after the fact."""
+        if self.limited:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'tokens', 'future')
+
+    def __init__(self, priority: int, seq: int, tokens: float, future: asyncio.Future):
+        self.priority, self.seq, self.tokens, self.future = priority, seq, tokens, future
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Lease:
+    """One admitted call; report the outcome through exactly one of the methods."""
+
+    def __init__(self, governor: 'ProviderGovernor', tokens: float):
+        self.governor = governor
+        self.tokens = tokens
+        self.started = time.monotonic()
+        self._done = False
+
+    def _finish(self) -> float:
+        if self._done:
+            return 0.0
+        self._done = True
+        self.governor._release()
+        return time.monotonic() - self.started
+
+    def succeeded(self, tokens_used: Optional[float] = None) -> None:
+        if tokens_used is not None:
+            self.governor.tokens.adjust(tokens_used - self.tokens)
+        self.governor._on_success(self._finish())
+
+    def rate_limited(self, retry_after: Optional[float] = None) -> None:
+        self._finish()
+        self.governor._on_rate_limited(retry_after)
+
+    def failed(self) -> None:
+        self._finish()
+        self.governor._on_error()
+
+    def release(self) -> None:
+        """Free the slot without feedback (e.g. a 4xx caused by the request itself)."""
+        self._finish()
+
+
+class ProviderGovernor:
+    """Token buckets + AIMD concurrency + priority queue for one provider."""
+
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, max_concurrency: int = 16,
+                 min_concurrency: int = 1, initial_concurrency: int = 4):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency_baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+        self._loop = None
+        self.stats = {'admitted': 0, 'rate_limited': 0, 'errors': 0, 'decreases': 0,
+                      'rejected': 0, 'queue_wait_ms_max': 0.0}
+
+    @classmethod
+    def from_env(cls, prefix: str, name: str) -> 'ProviderGovernor':
+        def env(key, default):
+            return float(os.getenv(f"{prefix}_{key}", default))
+        return cls(name, rpm=env('RPM', '0'), tpm=env('TPM', '0'),
+                   max_concurrency=int(env('MAX_CONCURRENCY', '16')),
+                   min_concurrency=int(env('MIN_CONCURRENCY', '1')),
+                   initial_concurrency=int(env('INITIAL_CONCURRENCY', '4')))
+
+    # ----- admission -----
+    def _delay(self, tokens: float, now: float) -> float:
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _pump(self) -> None:
+        """Grant slots to queued waiters in priority order while capacity allows."""
+        now = time.monotonic()
+        while self._queue:
+            w = self._queue[0]
+            if w.future.done():  # timed out or cancelled
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= int(self.limit):
+                return
+            delay = self._delay(w.tokens, now)
+            if delay > 0:
+                self._schedule(now + delay)
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1, now)
+            self.tokens.take(w.tokens, now)
+            self.in_flight += 1
+            w.future.set_result(None)
+
+    def _schedule(self, at: float) -> None:
+        if self._timer is not None and not self._timer.cancelled() and self._timer_at <= at and self._timer_at > time.monotonic():
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer_at = at
+        self._timer = loop.call_later(max(0.0, at - time.monotonic()), self._pump)
+
+    async def acquire(self, tokens: float = 0, priority: Optional[int] = None,
+                      max_wait: Optional[float] = None) -> Lease:
+        """Wait for a slot. Interactive calls default to a bounded wait and raise
+        QuotaExceeded when it runs out; bulk calls wait as long as needed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # waiters and timers belong to the previous loop (scripts calling
+            # asyncio.run repeatedly); start over on this one
+            self._queue, self.in_flight, self._timer, self._loop = [], 0, None, loop
+        priority = current_priority() if priority is None else priority
+        if max_wait is None and priority <= PRIORITY_INTERACTIVE:
+            max_wait = AI_GOV_INTERACTIVE_MAX_WAIT
+        now = time.monotonic()
+        if max_wait is not None and self.paused_until - now > max_wait:
+            self.stats['rejected'] += 1
+            raise QuotaExceeded(f'{self.name} rate limited', self.paused_until - now)
+
+        waiter = _Waiter(priority, next(self._seq), float(tokens), loop.create_future())
+        heapq.heappush(self._queue, waiter)
+        self._pump()
+        try:
+            if max_wait is None:
+                await waiter.future
+            else:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # granted in the same tick the wait expired; keep the slot
+                pass
+            else:
+                waiter.future.cancel()
+                self.stats['rejected'] += 1
+                retry = max(self._delay(tokens, time.monotonic()), AI_GOV_COOLDOWN_SECONDS)
+                raise QuotaExceeded(f'{self.name} busy: no capacity within {max_wait:.0f}s', retry)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # slot was granted but the caller went away
+            else:
+                waiter.future.cancel()
+            raise
+        waited = (time.monotonic() - now) * 1000.0
+        self.stats['admitted'] += 1
+        self.stats['queue_wait_ms_max'] = max(self.stats['queue_wait_ms_max'], round(waited, 1))
+        return Lease(self, tokens)
+
+    def _release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        self._pump()
+
+    # ----- AIMD feedback -----
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < AI_GOV_COOLDOWN_SECONDS:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        self.stats['decreases'] += 1
+
+    def _on_success(self, latency: float) -> None:
+        base = self.latency_baseline
+        if base is not None and latency > AI_GOV_LATENCY_FACTOR * base:
+            self._decrease(AI_GOV_BACKOFF_FACTOR)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(1.0, self.limit))
+        # slow-moving baseline that tracks the fast end of the distribution
+        if base is None:
+            self.latency_baseline = latency
+        elif latency < base:
+            self.latency_baseline = base * 0.7 + latency * 0.3
+        else:
+            self.latency_baseline = base * 0.98 + latency * 0.02
+        self._pump()
+
+    def _on_rate_limited(self, retry_after: Optional[float]) -> None:
+        self.stats['rate_limited'] += 1
+        wait = retry_after if retry_after and retry_after > 0 else AI_GOV_DEFAULT_RETRY_AFTER
+        self.paused_until = max(self.paused_until, time.monotonic() + wait)
+        self._decrease(0.5)
+        self._pump()
+
+    def _on_error(self) -> None:
+        self.stats['errors'] += 1
+        self._decrease(AI_GOV_BACKOFF_FACTOR)
+
+    def retry_after(self) -> float:
+        """Seconds until the provider is expected to accept calls again."""
+        return max(0.0, self.paused_until - time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'queued': sum(1 for w in self._queue if not w.future.done()),
+            'paused_for_seconds': round(self.retry_after(), 2),
+            'latency_baseline_ms': round(self.latency_baseline * 1000.0, 1) if self.latency_baseline else None,
+            'rpm': self.requests.per_minute or None,
+            'tpm': self.tokens.per_minute or None,
+            **self.stats,
+        }
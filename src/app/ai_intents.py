@@ -0,0 +1,266 @@
+"""
+ai_intents
+
+Local fast paths for /ai/ask. IntentRouter holds a table of precompiled
+patterns with a handler each; the first handler that returns an answer
+wins, and the question only goes to the LLM when none does. The built-in
+routes are:
+
+- person:       "who is X", "tell me about X" -> agent, photographer or user contact
+- photographer: "who shot/photographed X"     -> the photographer of a property
+- counts:       "how many properties/agents/photographers"
+- stats:        total/average shoots and income
+
+Names and addresses are resolved through CompanyIndex, an in-memory trigram
+index per company. Matching follows the old lower(col) LIKE '%q%' semantics
+(an exact name wins, then the lowest id containing the query), but it only
+looks at rows whose trigrams overlap the query. The indexes are materialized
+on first use and patched on commit by the same ORM hooks as the /ai/ask
+context snapshot (see ai_context.install_context_hooks), so answering is a
+dictionary walk with no database access.
+"""
+
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from ai_context import ContextSnapshot
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _norm(text: Any) -> str:
+    return _WS_RE.sub(' ', str(text or '').lower()).strip()
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Substring search over short strings keyed by integer id."""
+
+    def __init__(self):
+        self._text: Dict[int, str] = {}
+        self._exact: Dict[str, Set[int]] = {}
+        self._grams: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def add(self, key: int, text: Any) -> None:
+        self.remove(key)
+        t = _norm(text)
+        if not t:
+            return
+        self._text[key] = t
+        self._exact.setdefault(t, set()).add(key)
+        for g in _trigrams(t):
+            self._grams.setdefault(g, set()).add(key)
+
+    def remove(self, key: int) -> None:
+        t = self._text.pop(key, None)
+        if t is None:
+            return
+        self._discard(self._exact, t, key)
+        for g in _trigrams(t):
+            self._discard(self._grams, g, key)
+
+    @staticmethod
+    def _discard(table: Dict[str, Set[int]], k: str, key: int) -> None:
+        keys = table.get(k)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del table[k]
+
+    def find(self, query: Any) -> Optional[int]:
+        """Id of the exact match, else the lowest id whose text contains `query`."""
+        q = _norm(query)
+        if not q:
+            return None
+        exact = self._exact.get(q)
+        if exact:
+            return min(exact)
+        grams = _trigrams(q)
+        if not grams:
+            # one or two characters: too short for trigrams, scan the (small) candidates
+            hits = [k for k, t in self._text.items() if q in t]
+            return min(hits) if hits else None
+        postings = sorted((self._grams.get(g, set()) for g in grams), key=len)
+        if not postings[0]:
+            return None
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates &= p
+            if not candidates:
+                return None
+        hits = [k for k in candidates if q in self._text[k]]
+        return min(hits) if hits else None
+
+
+class CompanyIndex:
+    """Contacts and property addresses of one company scope, searchable by name."""
+
+    def __init__(self, agents: Iterable[dict], photographers: Iterable[dict], users: Iterable[dict],
+                 properties: Iterable[dict]):
+        self.loaded_at = time.monotonic()
+        self.dirty = False
+        self.rows: Dict[str, Dict[int, dict]] = {'agent': {}, 'photographer': {}, 'user': {}, 'property': {}}
+        self.names: Dict[str, TrigramIndex] = {k: TrigramIndex() for k in self.rows}
+        self.agent_properties: Counter = Counter()  # agent name -> number of properties
+        for kind, rows in (('agent', agents), ('photographer', photographers), ('user', users), ('property', properties)):
+            for row in rows:
+                self._put(kind, row)
+
+    def _put(self, kind: str, row: dict) -> None:
+        self._drop(kind, row['id'])
+        self.rows[kind][row['id']] = row
+        self.names[kind].add(row['id'], row.get('address') if kind == 'property' else row.get('name'))
+        if kind == 'property' and row.get('agent'):
+            self.agent_properties[row['agent']] += 1
+
+    def _drop(self, kind: str, key: int) -> None:
+        old = self.rows[kind].pop(key, None)
+        if old is None:
+            return
+        self.names[kind].remove(key)
+        if kind == 'property' and old.get('agent'):
+            self.agent_properties[old['agent']] -= 1
+            if self.agent_properties[old['agent']] <= 0:
+                del self.agent_properties[old['agent']]
+
+    def apply(self, change: dict) -> None:
+        kind = change['kind']
+        if kind not in self.rows:
+            return
+        if change['op'] == 'delete':
+            self._drop(kind, change['row']['id'])
+            if kind == 'photographer':
+                for p in self.rows['property'].values():
+                    if p.get('photographer_id') == change['row']['id']:
+                        p['photographer_id'] = None
+        else:
+            self._put(kind, dict(change['row']))
+
+    def find(self, kind: str, query: str) -> Optional[dict]:
+        key = self.names[kind].find(query)
+        return self.rows[kind].get(key) if key is not None else None
+
+    def photographer_of(self, prop: dict) -> Optional[dict]:
+        pid = prop.get('photographer_id')
+        return self.rows['photographer'].get(pid) if pid is not None else None
+
+    def count(self, kind: str) -> int:
+        return len(self.rows[kind])
+
+
+class AskContext:
+    """What intent handlers may consult; both parts are loaded on first access."""
+
+    def __init__(self, company: Optional[str], index: Callable[[], CompanyIndex],
+                 snapshot: Callable[[], ContextSnapshot]):
+        self.company = company
+        self._index, self._snapshot = index, snapshot
+
+    @property
+    def index(self) -> CompanyIndex:
+        if callable(self._index):
+            self._index = self._index()
+        return self._index
+
+    @property
+    def snapshot(self) -> ContextSnapshot:
+        if callable(self._snapshot):
+            self._snapshot = self._snapshot()
+        return self._snapshot
+
+
+Handler = Callable[["re.Match", AskContext], Optional[dict]]
+
+
+class IntentRouter:
+    """Ordered (name, compiled pattern, handler) table."""
+
+    def __init__(self):
+        self.routes: List[tuple] = []
+        self.stats: Counter = Counter()
+
+    def route(self, name: str, *patterns: str) -> Callable[[Handler], Handler]:
+        compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+
+        def register(handler: Handler) -> Handler:
+            for rx in compiled:
+                self.routes.append((name, rx, handler))
+            return handler
+        return register
+
+    def dispatch(self, question: str, ctx: AskContext) -> Optional[dict]:
+        q = question.strip()
+        for name, rx, handler in self.routes:
+            m = rx.search(q)
+            if m is None:
+                continue
+            answer = handler(m, ctx)
+            if answer is not None:
+                self.stats[name] += 1
+                answer.setdefault('intent', name)
+                return answer
+        self.stats['llm'] += 1
+        return None
+
+
+ASK_ROUTER = IntentRouter()
+
+
+def _subject(m: "re.Match") -> str:
+    return m.group(1).strip().rstrip("?.! ").strip()
+
+
+@ASK_ROUTER.route('photographer',
+                  r"who\s+(?:shot|photographed|took(?: the)? photos (?:for|of)|took photos of)\s+(.+?)\??$")
+def _property_photographer(m, ctx: AskContext) -> Optional[dict]:
+    prop = ctx.index.find('property', _subject(m))
+    if prop is None:
+        return None
+    ph = ctx.index.photographer_of(prop)
+    if ph is None:
+        return {'answer': f"No photographer is assigned to {prop['address']}."}
+    return {'answer': f"Photographer {ph['name']} photographed {prop['address']}: "
+                      f"email {ph.get('email') or 'unknown'}, phone {ph.get('phone') or 'unknown'}."}
+
+
+@ASK_ROUTER.route('person', r"who is\s+([\w\s'.-]+)\??", r"tell me about\s+([\w\s'.-]+)\??")
+def _person(m, ctx: AskContext) -> Optional[dict]:
+    name = _subject(m)
+    a = ctx.index.find('agent', name)
+    if a is not None:
+        cnt = ctx.index.agent_properties.get(a['name'], 0)
+        return {'answer': f"Agent {a['name']}: email {a.get('email') or 'unknown'}, phone {a.get('phone') or 'unknown'}. "
+                          f"Associated properties: {cnt}."}
+    p = ctx.index.find('photographer', name)
+    if p is not None:
+        return {'answer': f"Photographer {p['name']}: email {p.get('email') or 'unknown'}, phone {p.get('phone') or 'unknown'}."}
+    u = ctx.index.find('user', name)
+    if u is not None:
+        return {'answer': f"User {u['name']}: email {u.get('email') or 'unknown'}."}
+    return None
+
+
+@ASK_ROUTER.route('counts', r"^how many\s+(properties|listings|agents|photographers)\b")
+def _counts(m, ctx: AskContext) -> Optional[dict]:
+    what = m.group(1).lower()
+    if what in ('properties', 'listings'):
+        return {'answer': f"There are {ctx.snapshot.total_properties} properties in your scoped dataset."}
+    kind = what[:-1]
+    return {'answer': f"There are {ctx.index.count(kind)} {what} in your scoped dataset."}
+
+
+@ASK_ROUTER.route('stats',
+                  r"\b(?:total|average|avg)\s+(?:income|revenue|shoots)\b",
+                  r"^how (?:much|many)\s+(?:income|revenue|money|shoots)\b")
+def _stats(m, ctx: AskContext) -> Optional[dict]:
+    s = ctx.snapshot
+    return {'answer': f"Recent stats: total_shoots={s.total_shoots}, total_income=${s.total_income:,.2f}, "
+                      f"avg_shoots_per_day={s.avg_shoots_per_day:.2f}"}
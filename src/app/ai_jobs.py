@@ -0,0 +1,531 @@
+"""
+ai_jobs
+
+Persistent background jobs for AI sync. POST /ai/sync records a job row and
+one task row per property (database.AISyncJob / AISyncTask) and returns
+immediately; a worker claims due tasks, resolves them through the AI cache
+and the batched classifier, and writes the results back. Because the state
+lives in the database, work survives client disconnects and API restarts,
+and clients follow progress by polling the job or subscribing to its SSE
+stream.
+
+- Dedup: tasks are claimed per address_key, and finishing an address also
+  completes every queued task for the same address (in any job), so an
+  address is looked up once however many jobs ask for it.
+- Retries: failed lookups are re-queued with exponential backoff plus jitter
+  (never sooner than a provider's Retry-After) up to AI_JOB_MAX_ATTEMPTS,
+  then marked failed.
+- Crash safety: a task claimed longer than AI_JOB_LEASE_SECONDS ago is
+  returned to the queue.
+
+The worker runs inside the API process by default (AI_WORKER_MODE=inprocess).
+Set AI_WORKER_MODE=external and run `python ai_jobs.py` (from src/app) to
+use a separate worker process instead; several workers may run at once.
+"""
+
+import os
+import json
+import uuid
+import random
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update, insert, func
+
+from database import SessionLocal, AISyncJob, AISyncTask
+from address_keys import normalize_address
+from ai_governor import request_priority, PRIORITY_BULK
+
+logger = logging.getLogger('ai_jobs')
+
+AI_WORKER_MODE = os.getenv("AI_WORKER_MODE", "inprocess").lower()  # inprocess | external | off
+# chunks (AI_BATCH_MAX_ITEMS addresses, or 1 without batching) processed at once
+AI_WORKER_CONCURRENCY = int(os.getenv("AI_WORKER_CONCURRENCY", os.getenv("AI_SYNC_CONCURRENCY", "6")))
+AI_WORKER_CLAIM_SIZE = int(os.getenv("AI_WORKER_CLAIM_SIZE", "120"))  # distinct addresses per claim
+AI_WORKER_POLL_SECONDS = float(os.getenv("AI_WORKER_POLL_SECONDS", "1.0"))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "4"))
+AI_JOB_BACKOFF_SECONDS = float(os.getenv("AI_JOB_BACKOFF_SECONDS", "5"))
+AI_JOB_BACKOFF_MAX_SECONDS = float(os.getenv("AI_JOB_BACKOFF_MAX_SECONDS", "300"))
+AI_JOB_LEASE_SECONDS = float(os.getenv("AI_JOB_LEASE_SECONDS", "600"))
+# classify in multi-address batches (set AI_SYNC_BATCH=0 for one completion per address)
+AI_SYNC_BATCH = os.getenv('AI_SYNC_BATCH', '1').lower() in ('1', 'true', 'yes')
+
+# processor(addresses, refresh) -> {address: status dict}
+Processor = Callable[[List[str], bool], Awaitable[Dict[str, Any]]]
+
+
+def is_success(res: Any) -> bool:
+    return isinstance(res, dict) and not res.get('error')
+
+
+def is_retryable(res: Any) -> bool:
+    """Errors are retried unless the result says retrying cannot help."""
+    if is_success(res):
+        return False
+    return not (isinstance(res, dict) and res.get('retryable') is False)
+
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds before retry number `attempts` (1-based), with 50-100% jitter."""
+    delay = min(AI_JOB_BACKOFF_MAX_SECONDS, AI_JOB_BACKOFF_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ----------------------
+# Enqueue / inspect
+# ----------------------
+def enqueue_sync_job(db, props: Iterable[Tuple[int, Optional[str]]], company: str | None,
+                     user_id: int | None, refresh: bool = False) -> AISyncJob:
+    """Create a job with one task per (property_id, address); commits."""
+    now = datetime.utcnow()
+    props = list(props)
+    job = AISyncJob(company=company, created_by=user_id, kind='sync', refresh=bool(refresh),
+                    status='queued', total=len(props), created_at=now)
+    db.add(job)
+    db.flush()
+    rows, no_address = [], 0
+    for property_id, address in props:
+        key = normalize_address(address) if address else ''
+        row = {'job_id': job.id, 'property_id': property_id, 'address': address, 'address_key': key or None,
+               'status': 'queued', 'next_attempt_at': now, 'updated_at': now}
+        if not key:
+            row.update(status='failed', error='No address')
+            no_address += 1
+        rows.append(row)
+    if rows:
+        db.execute(insert(AISyncTask), rows)
+    job.failed = no_address
+    if no_address == len(props):
+        job.status, job.finished_at = 'done', now
+    db.commit()
+    return job
+
+
+def enqueue_refresh(db, address: str) -> Optional[int]:
+    """Queue a single-address cache refresh unless one is already pending.
+
+    Returns the id of the job that will refresh the address (new or existing).
+    """
+    key = normalize_address(address)
+    if not key:
+        return None
+    existing = db.execute(
+        select(AISyncTask.job_id)
+        .where(AISyncTask.address_key == key, AISyncTask.status.in_(('queued', 'running')))
+        .limit(1)
+    ).scalar()
+    if existing is not None:
+        return existing
+    return enqueue_refreshes(db, [address])
+
+
+def enqueue_refreshes(db, addresses: Iterable[str], refresh: bool = False,
+                      kind: str = 'refresh') -> Optional[int]:
+    """Queue one job refreshing every address that has no pending task.
+
+    refresh=True bypasses the cached summary and search (refresh-ahead uses
+    it for entries that are still fresh). Returns the new job id, or None if
+    everything was already pending.
+    """
+    wanted = {}
+    for a in addresses:
+        key = normalize_address(a)
+        if key and key not in wanted:
+            wanted[key] = a
+    if wanted:
+        pending = set(db.execute(
+            select(AISyncTask.address_key)
+            .where(AISyncTask.address_key.in_(list(wanted)), AISyncTask.status.in_(('queued', 'running')))
+        ).scalars().all())
+        for key in pending:
+            wanted.pop(key, None)
+    if not wanted:
+        return None
+    now = datetime.utcnow()
+    job = AISyncJob(kind=kind, refresh=refresh, status='queued', total=len(wanted), created_at=now)
+    db.add(job)
+    db.flush()
+    db.execute(insert(AISyncTask), [
+        {'job_id': job.id, 'address': a, 'address_key': key, 'status': 'queued',
+         'next_attempt_at': now, 'updated_at': now}
+        for key, a in wanted.items()
+    ])
+    db.commit()
+    return job.id
+
+
+def job_visible(job: AISyncJob, company: str | None, user_id: int | None) -> bool:
+    if company:
+        return job.company == company
+    return job.created_by is not None and job.created_by == user_id
+
+
+def job_progress(job: AISyncJob) -> Dict[str, Any]:
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'total': job.total,
+        'completed': job.completed,
+        'failed': job.failed,
+        'pending': max(0, (job.total or 0) - (job.completed or 0) - (job.failed or 0)),
+        'refresh': bool(job.refresh),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def job_tasks(db, job_id: int, exclude: Set[int] | None = None,
+              finished_only: bool = True) -> List[Dict[str, Any]]:
+    """Task rows of a job with decoded results, in id order.
+
+    `exclude` skips task ids the caller already has. The streaming endpoints
+    pass the ids they've emitted, so each poll returns only new completions.
+    done/failed are final, so a finished id not yet emitted is new however
+    late its transaction committed. A clock-based cursor on updated_at would
+    miss a worker commit stamped before the previous poll. Only the ids are
+    read for the whole job; the full rows are read for the new ones.
+    """
+    cols = (AISyncTask.id, AISyncTask.property_id, AISyncTask.address, AISyncTask.status,
+            AISyncTask.attempts, AISyncTask.result, AISyncTask.error)
+    q = select(*cols).where(AISyncTask.job_id == job_id).order_by(AISyncTask.id)
+    if finished_only:
+        q = q.where(AISyncTask.status.in_(('done', 'failed')))
+    if exclude:
+        ids = q.with_only_columns(AISyncTask.id)
+        new = [i for (i,) in db.execute(ids) if i not in exclude]
+        if not new:
+            return []
+        rows = []
+        for start in range(0, len(new), 500):
+            rows.extend(db.execute(q.where(AISyncTask.id.in_(new[start:start + 500]))).mappings())
+    else:
+        rows = db.execute(q).mappings()
+    out = []
+    for r in rows:
+        item = dict(r)
+        try:
+            item['result'] = json.loads(item['result']) if item['result'] else None
+        except ValueError:
+            item['result'] = None
+        out.append(item)
+    return out
+
+
+def _refresh_job_counters(db, job_ids: Iterable[int]) -> None:
+    job_ids = list(set(job_ids))
+    if not job_ids:
+        return
+    counts: Dict[int, Dict[str, int]] = {}
+    for job_id, st, n in db.execute(
+        select(AISyncTask.job_id, AISyncTask.status, func.count())
+        .where(AISyncTask.job_id.in_(job_ids))
+        .group_by(AISyncTask.job_id, AISyncTask.status)
+    ):
+        counts.setdefault(job_id, {})[st] = n
+    now = datetime.utcnow()
+    for job_id in job_ids:
+        c = counts.get(job_id, {})
+        values = {'completed': c.get('done', 0), 'failed': c.get('failed', 0)}
+        if not c.get('queued') and not c.get('running'):
+            values.update(status='done', finished_at=now)
+        db.execute(update(AISyncJob).where(AISyncJob.id == job_id, AISyncJob.status != 'done').values(**values))
+
+
+# ----------------------
+# Worker
+# ----------------------
+def make_processor(cache, batch_fn, concurrency: int = 1) -> Processor:
+    """Processor that serves cached summaries and batch-classifies the rest.
+
+    `cache` is an ai_cache.AICache; `batch_fn` is
+    ai_services.get_property_updates_batch (or a compatible callable). The
+    worker already runs chunks concurrently, so each call defaults to one
+    completion in flight.
+    """
+    async def process(addresses: List[str], refresh: bool) -> Dict[str, Any]:
+        out, missing = {}, []
+        for a in addresses:
+            cached = None if refresh else cache.get(a)
+            if cached is not None:
+                out[a] = cached
+            else:
+                missing.append(a)
+        if missing:
+            fresh = await batch_fn(missing, refresh_search=refresh, concurrency=concurrency)
+            for a, res in fresh.items():
+                if is_success(res):
+                    cache.set(a, res)
+                out[a] = res
+        return out
+    return process
+
+
+class SyncWorker:
+    """Claims due tasks, runs them through `processor` and records results."""
+
+    def __init__(self, processor: Processor, claim_size: int = AI_WORKER_CLAIM_SIZE,
+                 poll_seconds: float = AI_WORKER_POLL_SECONDS, worker_id: str | None = None,
+                 concurrency: int = AI_WORKER_CONCURRENCY, chunk_size: int = 1):
+        self.processor = processor
+        self.claim_size = max(1, claim_size)
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = max(1, chunk_size)
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stats = {'cycles': 0, 'claimed_addresses': 0, 'done': 0, 'deduped': 0, 'retried': 0, 'failed': 0}
+        self._wake: asyncio.Event | None = None
+        self._loop = None
+        self._task: "asyncio.Task | None" = None
+        self._stopping = False
+        self._progress: asyncio.Event | None = None
+
+    # -- lifecycle --
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = self._loop.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self.wake()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=10)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    def wake(self) -> None:
+        """Ask the worker to look for work now instead of at the next poll."""
+        if self._wake is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _notify_progress(self) -> None:
+        if self._progress is not None:
+            self._progress.set()
+        self._progress = asyncio.Event()
+
+    async def wait_for_progress(self, timeout: float) -> bool:
+        """Wait until this worker records results (or `timeout`); True if it did."""
+        if self._progress is None:
+            self._progress = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self) -> None:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        while not self._stopping:
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                logger.exception('AI sync worker cycle failed')
+                claimed = 0
+            if claimed == 0 and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def run_once(self) -> int:
+        """One claim/process/record cycle; returns the number of addresses claimed.
+
+        Provider calls made here queue behind interactive ones (see ai_governor).
+        """
+        with request_priority(PRIORITY_BULK):
+            return await self._run_once()
+
+    async def _run_once(self) -> int:
+        claimed = await asyncio.to_thread(self._claim)
+        if not claimed:
+            return 0
+        self.stats['cycles'] += 1
+        self.stats['claimed_addresses'] += len(claimed)
+        # process in chunks (at most `concurrency` in flight) and record each
+        # chunk as soon as it finishes, so results stream out per chunk rather
+        # than per claim
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def do(keys: List[str], refresh: bool):
+            part = {k: claimed[k] for k in keys}
+            addresses = [c['address'] for c in part.values()]
+            async with semaphore:
+                try:
+                    results = await self.processor(addresses, refresh)
+                except Exception as e:
+                    logger.exception('AI sync processor failed for %d addresses', len(addresses))
+                    results = {a: {'error': str(e)} for a in addresses}
+            await asyncio.to_thread(self._record, part, results)
+            self._notify_progress()
+
+        chunks = []
+        for refresh in (False, True):
+            keys = [k for k, c in claimed.items() if c['refresh'] == refresh]
+            chunks += [(keys[i:i + self.chunk_size], refresh) for i in range(0, len(keys), self.chunk_size)]
+        await asyncio.gather(*(do(keys, refresh) for keys, refresh in chunks))
+        return len(claimed)
+
+    # -- database steps (run in a thread) --
+    def _claim(self) -> Dict[str, Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            # return tasks whose worker died mid-flight to the queue
+            db.execute(
+                update(AISyncTask)
+                .where(AISyncTask.status == 'running',
+                       AISyncTask.claimed_at < now - timedelta(seconds=AI_JOB_LEASE_SECONDS))
+                .values(status='queued', claimed_by=None, updated_at=now)
+            )
+            keys = db.execute(
+                select(AISyncTask.address_key)
+                .where(AISyncTask.status == 'queued', AISyncTask.next_attempt_at <= now,
+                       AISyncTask.address_key.isnot(None))
+                .group_by(AISyncTask.address_key)
+                .order_by(func.min(AISyncTask.id))
+                .limit(self.claim_size)
+            ).scalars().all()
+            if keys:
+                # another worker holds these addresses; finishing them completes our tasks too
+                busy = set(db.execute(
+                    select(AISyncTask.address_key)
+                    .where(AISyncTask.status == 'running', AISyncTask.address_key.in_(keys))
+                ).scalars())
+                keys = [k for k in keys if k not in busy]
+            if not keys:
+                db.commit()
+                return {}
+            db.execute(
+                update(AISyncTask)
+                .where(AISyncTask.address_key.in_(keys), AISyncTask.status == 'queued',
+                       AISyncTask.next_attempt_at <= now)
+                .values(status='running', claimed_by=self.worker_id, claimed_at=now, updated_at=now)
+            )
+            rows = db.execute(
+                select(AISyncTask.job_id, AISyncTask.address, AISyncTask.address_key,
+                       AISyncTask.attempts, AISyncJob.refresh)
+                .join(AISyncJob, AISyncJob.id == AISyncTask.job_id)
+                .where(AISyncTask.claimed_by == self.worker_id, AISyncTask.status == 'running')
+            ).all()
+            claimed: Dict[str, Dict[str, Any]] = {}
+            for job_id, address, key, attempts, refresh in rows:
+                c = claimed.setdefault(key, {'address': address, 'refresh': False, 'attempts': 0, 'jobs': set()})
+                c['refresh'] = c['refresh'] or bool(refresh)
+                c['attempts'] = max(c['attempts'], attempts or 0)
+                c['jobs'].add(job_id)
+            job_ids = {j for c in claimed.values() for j in c['jobs']}
+            if job_ids:
+                db.execute(
+                    update(AISyncJob)
+                    .where(AISyncJob.id.in_(job_ids), AISyncJob.status == 'queued')
+                    .values(status='running', started_at=now)
+                )
+            db.commit()
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _record(self, claimed: Dict[str, Dict[str, Any]], results: Dict[str, Any]) -> None:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            touched = set()
+            for key, c in claimed.items():
+                res = results.get(c['address'], {'error': 'no result'})
+                mine = (AISyncTask.address_key == key) & (AISyncTask.claimed_by == self.worker_id) & (AISyncTask.status == 'running')
+                if not is_retryable(res):
+                    payload = json.dumps(res, default=str)
+                    db.execute(update(AISyncTask).where(mine).values(
+                        status='done', result=payload, error=None, attempts=AISyncTask.attempts + 1, updated_at=now))
+                    # complete queued duplicates for the same address (other jobs) as well
+                    dup_jobs = db.execute(
+                        select(AISyncTask.job_id).where(AISyncTask.address_key == key, AISyncTask.status == 'queued')
+                    ).scalars().all()
+                    if dup_jobs:
+                        db.execute(update(AISyncTask)
+                                   .where(AISyncTask.address_key == key, AISyncTask.status == 'queued')
+                                   .values(status='done', result=payload, error=None, updated_at=now))
+                        self.stats['deduped'] += len(dup_jobs)
+                        touched.update(dup_jobs)
+                    self.stats['done'] += 1
+                else:
+                    attempts = c['attempts'] + 1
+                    err = str(res.get('error') if isinstance(res, dict) else res)[:1000]
+                    if attempts >= AI_JOB_MAX_ATTEMPTS:
+                        db.execute(update(AISyncTask).where(mine).values(
+                            status='failed', error=err, attempts=attempts, updated_at=now))
+                        self.stats['failed'] += 1
+                    else:
+                        # a provider 429 says when to come back; never retry sooner
+                        delay = max(backoff_delay(attempts), float(res.get('retry_after_seconds') or 0)
+                                    if isinstance(res, dict) else 0.0)
+                        db.execute(update(AISyncTask).where(mine).values(
+                            status='queued', error=err, attempts=attempts, claimed_by=None,
+                            next_attempt_at=now + timedelta(seconds=delay), updated_at=now))
+                        self.stats['retried'] += 1
+                touched.update(c['jobs'])
+            _refresh_job_counters(db, touched)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def build_worker(cache) -> SyncWorker:
+    """Worker wired to the AI cache and the batched classifier (or one
+    completion per address when AI_SYNC_BATCH=0)."""
+    from ai_services import get_property_updates_batch, get_property_update_async, AI_BATCH_MAX_ITEMS
+
+    if AI_SYNC_BATCH:
+        return SyncWorker(make_processor(cache, get_property_updates_batch), chunk_size=AI_BATCH_MAX_ITEMS)
+
+    async def one_by_one(addresses, refresh_search=False, concurrency=1):
+        return {a: await get_property_update_async(a, refresh_search=refresh_search) for a in addresses}
+
+    return SyncWorker(make_processor(cache, one_by_one), chunk_size=1)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from ai_cache import build_ai_cache
+    from migrations import run_migrations
+    from ai_providers import aclose_providers
+
+    ap = argparse.ArgumentParser(description='Run a standalone AI sync worker (use with AI_WORKER_MODE=external on the API).')
+    ap.add_argument('--once', action='store_true', help='drain the queue once and exit')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_migrations()
+    worker = build_worker(build_ai_cache())
+
+    async def main():
+        try:
+            if args.once:
+                while await worker.run_once():
+                    pass
+            else:
+                logger.info('AI sync worker %s started', worker.worker_id)
+                await worker.run()
+        finally:
+            await aclose_providers()
+            logger.info('worker stats: %s', worker.stats)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,251 @@
+"""
+ai_providers
+
+Async, pooled HTTP clients for the AI providers (Groq chat completions and
+Tavily search). Each provider keeps one shared httpx.AsyncClient, so calls
+reuse keep-alive connections (and HTTP/2 when enabled and `h2` is installed)
+instead of opening a socket per request. Handlers await these directly; no
+threadpool hop is involved.
+
+Every request is admitted by the provider's ai_governor.ProviderGovernor
+(RPM/TPM token buckets, AIMD concurrency, Retry-After pauses, interactive
+before bulk); a call the governor cannot admit in time raises ProviderError
+with status 429 and a retry_after hint, exactly like a provider 429.
+
+Groq is called through its OpenAI-compatible REST API, so the `groq` SDK is
+not required. Base URLs are configurable, which is how
+scripts/stub_ai_server.py stands in for both APIs during testing.
+
+Configuration:
+    GROQ_API_KEY / TAVILY_API_KEY   provider credentials (unset = disabled)
+    GROQ_BASE_URL                   default https://api.groq.com/openai/v1
+    TAVILY_BASE_URL                 default https://api.tavily.com
+    AI_HTTP2                        "1" to negotiate HTTP/2 (needs `h2`)
+    AI_HTTP_MAX_CONNECTIONS         pool size per provider (default 20)
+    AI_HTTP_MAX_KEEPALIVE           idle connections kept (default 10)
+    AI_HTTP_KEEPALIVE_EXPIRY        idle seconds before close (default 30)
+    GROQ_TIMEOUT_SECONDS            default 30
+    TAVILY_TIMEOUT_SECONDS          default 8
+    GROQ_COMPLETION_TOKEN_ESTIMATE  completion tokens reserved per call (default 400)
+    GROQ_RPM / GROQ_TPM / ...       governor limits, see ai_governor
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from ai_governor import ProviderGovernor, QuotaExceeded
+
+logger = logging.getLogger('ai_providers')
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+AI_HTTP2 = os.getenv("AI_HTTP2", "0").lower() in ("1", "true", "yes")
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "20"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "10"))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "30"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT_SECONDS", "30"))
+TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT_SECONDS", "8"))
+GROQ_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("GROQ_COMPLETION_TOKEN_ESTIMATE", "400"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+class ProviderError(Exception):
+    """A provider call failed (transport error, non-2xx status or bad payload)."""
+
+    def __init__(self, message: str, status_code: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def quota_exceeded(self) -> bool:
+        return self.status_code == 429
+
+
+class AsyncProviderClient:
+    """One lazily created, pooled httpx.AsyncClient per provider.
+
+    The client is bound to the event loop that first used it; if a different
+    loop shows up (tests, scripts calling asyncio.run twice) a new client is
+    created for it.
+    """
+
+    name = 'provider'
+    env_prefix = 'AI_PROVIDER'
+
+    def __init__(self, base_url: str, api_key: str | None, timeout: float,
+                 http2: bool = AI_HTTP2, max_connections: int = AI_HTTP_MAX_CONNECTIONS,
+                 max_keepalive: int = AI_HTTP_MAX_KEEPALIVE, keepalive_expiry: float = AI_HTTP_KEEPALIVE_EXPIRY):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.http2 = bool(http2)
+        if self.http2 and not _http2_available():
+            logger.warning('%s: HTTP/2 requested but the h2 package is not installed; using HTTP/1.1', self.name)
+            self.http2 = False
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self.governor = ProviderGovernor.from_env(self.env_prefix, self.name)
+        self.stats = {'requests': 0, 'errors': 0}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _headers(self) -> Dict[str, str]:
+        return {}
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers(), timeout=self.timeout,
+                                             limits=self.limits, http2=self.http2)
+            self._loop = loop
+        return self._client
+
+    def _usage_tokens(self, data: Any) -> Optional[float]:
+        """Tokens the provider reports for a response (None = keep the estimate)."""
+        return None
+
+    async def post_json(self, path: str, payload: Dict[str, Any], tokens: float = 0,
+                        priority: Optional[int] = None) -> Any:
+        try:
+            lease = await self.governor.acquire(tokens, priority=priority)
+        except QuotaExceeded as e:
+            raise ProviderError(f'{self.name} quota exceeded: {e}', status_code=429, retry_after=e.retry_after) from e
+        self.stats['requests'] += 1
+        try:
+            resp = await self.client().post(path, json=payload)
+        except httpx.HTTPError as e:
+            self.stats['errors'] += 1
+            lease.failed()
+            raise ProviderError(f'{self.name} request failed: {e}') from e
+        except BaseException:
+            lease.release()
+            raise
+        if resp.status_code >= 400:
+            self.stats['errors'] += 1
+            retry_after = None
+            try:
+                retry_after = float(resp.headers.get('retry-after')) if resp.headers.get('retry-after') else None
+            except ValueError:
+                pass
+            if resp.status_code == 429:
+                lease.rate_limited(retry_after)
+                retry_after = max(retry_after or 0.0, self.governor.retry_after())
+            elif resp.status_code >= 500:
+                lease.failed()
+            else:
+                lease.release()
+            raise ProviderError(f'{self.name} returned HTTP {resp.status_code}: {resp.text[:200]}',
+                                status_code=resp.status_code, retry_after=retry_after)
+        try:
+            data = resp.json()
+        except ValueError as e:
+            self.stats['errors'] += 1
+            lease.failed()
+            raise ProviderError(f'{self.name} returned invalid JSON') from e
+        lease.succeeded(self._usage_tokens(data))
+        return data
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            try:
+                await self._client.aclose()
+            except RuntimeError:
+                # the loop that owned the client is already gone
+                pass
+        self._client = None
+        self._loop = None
+
+
+class GroqAsyncClient(AsyncProviderClient):
+    """Groq chat completions over the OpenAI-compatible endpoint."""
+
+    name = 'groq'
+    env_prefix = 'GROQ'
+
+    def __init__(self, api_key: str | None = GROQ_API_KEY, base_url: str = GROQ_BASE_URL,
+                 model: str = GROQ_MODEL, timeout: float = GROQ_TIMEOUT, **kwargs):
+        super().__init__(base_url, api_key, timeout, **kwargs)
+        self.model = model
+        self.stats.update(prompt_tokens=0, completion_tokens=0)
+
+    def _headers(self) -> Dict[str, str]:
+        return {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+
+    def _usage_tokens(self, data: Any) -> Optional[float]:
+        usage = data.get('usage') if isinstance(data, dict) else None
+        if isinstance(usage, dict) and usage.get('total_tokens') is not None:
+            return float(usage['total_tokens'])
+        return None
+
+    async def chat(self, messages: List[Dict[str, str]], model: str | None = None,
+                   priority: Optional[int] = None, **params) -> str:
+        """Return the first choice's message content for a chat completion.
+
+        The TPM reservation is the prompt size (~4 chars per token) plus
+        max_tokens, or GROQ_COMPLETION_TOKEN_ESTIMATE when that is unset;
+        it is trued up from the reported usage.
+        """
+        body = {'model': model or self.model, 'messages': messages, **params}
+        estimate = sum(len(m.get('content') or '') for m in messages) // 4 + \
+            int(params.get('max_tokens') or GROQ_COMPLETION_TOKEN_ESTIMATE)
+        data = await self.post_json('/chat/completions', body, tokens=estimate, priority=priority)
+        usage = data.get('usage') if isinstance(data, dict) else None
+        if isinstance(usage, dict):
+            self.stats['prompt_tokens'] += int(usage.get('prompt_tokens') or 0)
+            self.stats['completion_tokens'] += int(usage.get('completion_tokens') or 0)
+        try:
+            return data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError) as e:
+            raise ProviderError('groq response had no message content') from e
+
+
+class TavilyAsyncClient(AsyncProviderClient):
+    """Tavily web search."""
+
+    name = 'tavily'
+    env_prefix = 'TAVILY'
+
+    def __init__(self, api_key: str | None = TAVILY_API_KEY, base_url: str = TAVILY_BASE_URL,
+                 timeout: float = TAVILY_TIMEOUT, **kwargs):
+        super().__init__(base_url, api_key, timeout, **kwargs)
+
+    async def search(self, query: str, **params) -> Any:
+        """Return the `results` list of a search (or the whole payload if absent)."""
+        data = await self.post_json('/search', {'api_key': self.api_key, 'query': query, **params})
+        if isinstance(data, dict) and 'results' in data:
+            return data['results']
+        return data
+
+
+GROQ = GroqAsyncClient()
+TAVILY = TavilyAsyncClient()
+
+
+def governor_stats() -> Dict[str, Any]:
+    """Live governor state per provider (limits, queue, 429s, pauses)."""
+    return {c.name: c.governor.snapshot() for c in (GROQ, TAVILY)}
+
+
+async def aclose_providers() -> None:
+    """Close the pooled provider connections (called at API shutdown)."""
+    await GROQ.aclose()
+    await TAVILY.aclose()
@@ -1,46 +1,48 @@
 """
 ai_services (Groq-only)
 
-This module intentionally uses Groq as the sole LLM provider. It provides a
-single helper `get_property_update(address)` which the application uses to
-obtain property status info. If Groq is not configured the helper returns a
-structured error dict with a low-confidence local fallback so the UI can
-render test data.
+This module intentionally uses Groq as the sole LLM provider. It provides
+`get_property_update_async(address)`, which the API awaits to obtain property
+status info (optionally grounded with a Tavily search), and a blocking
+`get_property_update(address)` wrapper for scripts. Provider calls go through
+the pooled async clients in ai_providers. If Groq is not configured the helper
+returns a structured error dict with a low-confidence local fallback so the
+UI can render test data.
+
+The lookup runs as two separately cached stages (see ai_cache.StageCache):
+
+1. search: Tavily results keyed by normalized address (AI_SEARCH_CACHE_TTL_SECONDS)
+2. classify: the Groq answer keyed by a hash of the search payload, prompt
+   and model (AI_CLASSIFY_CACHE_TTL_SECONDS)
+
+so a re-sync whose search content has not changed never calls the LLM, and a
+model or prompt change re-classifies without repeating the searches.
 """
 
 import os
 import json
+import math
+import time
+import asyncio
+import hashlib
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
+
+from address_keys import normalize_address
+from ai_cache import build_stage_cache, AI_SEARCH_CACHE_TTL, AI_CLASSIFY_CACHE_TTL
+from ai_providers import GROQ, TAVILY, GROQ_MODEL, ProviderError, aclose_providers, governor_stats
 
 logger = logging.getLogger('ai_services')
 logger.setLevel(logging.DEBUG)
 
-# Configuration
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-
-# Attempt to import Groq and requests; keep graceful fallbacks so the app
-# can start even if the libs or keys are missing.
-GROQ_CLIENT = None
-requests = None
-try:
-    from groq import Groq  # type: ignore
-    import requests as _requests  # type: ignore
-    requests = _requests
-    if GROQ_API_KEY:
-        try:
-            GROQ_CLIENT = Groq(api_key=GROQ_API_KEY)
-        except Exception:
-            GROQ_CLIENT = None
-except Exception:
-    GROQ_CLIENT = None
-    try:
-        import requests as _requests  # type: ignore
-        requests = _requests
-    except Exception:
-        requests = None
+GROQ_ENABLED = GROQ.configured
+
+SEARCH_STAGE = build_stage_cache('search', AI_SEARCH_CACHE_TTL)
+CLASSIFY_STAGE = build_stage_cache('classify', AI_CLASSIFY_CACHE_TTL)
+
+# fields of a Tavily result that carry content; scores/timings are dropped so
+# the payload (and the classification key) only changes when the content does
+_SEARCH_FIELDS = ('title', 'url', 'content', 'published_date')
 
 
 def _try_parse_json_from_text(text: str) -> Any:
@@ -67,83 +69,123 @@ def _try_parse_json_from_text(text: str) -> Any:
     raise ValueError('Unable to parse JSON from model response')
 
 
-def _get_live_data_via_tavily(address: str) -> str | None:
+def _canonical_search(results: Any) -> Any:
+    if not isinstance(results, list):
+        return results
+    items = [{k: r[k] for k in _SEARCH_FIELDS if r.get(k) is not None} if isinstance(r, dict) else r for r in results]
+    return sorted(items, key=lambda r: json.dumps(r, sort_keys=True, default=str))
+
+
+async def _get_live_data_via_tavily(address: str) -> Any:
     """Call Tavily (best-effort) to obtain live search data for an address.
 
-    Returns a stringified result or None on failure / if not configured.
+    Returns the canonicalized results or None on failure / if not configured.
     """
-    if not TAVILY_API_KEY or not requests:
+    if not TAVILY.configured:
         return None
     try:
-        url = "https://api.tavily.com"
-        payload = {"api_key": TAVILY_API_KEY, "query": f"status of {address} zillow redfin"}
-        resp = requests.post(url, json=payload, timeout=8)
-        resp.raise_for_status()
-        j = resp.json()
-        if isinstance(j, dict) and 'results' in j:
-            return str(j.get('results'))
-        return str(j)
-    except Exception:
+        return _canonical_search(await TAVILY.search(f"status of {address} zillow redfin"))
+    except ProviderError:
         logger.exception('Failed to fetch live data from Tavily')
         return None
 
 
-def _ai_status_check_groq(address: str) -> Dict[str, Any]:
-    """Use Groq to classify the property status given optional live search data.
+async def _search_stage(address: str, refresh: bool = False) -> str:
+    """Stage 1: live search payload for an address ('' when unavailable)."""
+    if not TAVILY.configured:
+        return ""
+    res = await SEARCH_STAGE.run(normalize_address(address), lambda: _get_live_data_via_tavily(address), refresh=refresh)
+    if res is None:
+        return ""
+    return res if isinstance(res, str) else json.dumps(res, sort_keys=True, default=str)
 
-    Returns a parsed JSON dict on success, or an error dict with 'error' on
-    failure.
-    """
-    if not GROQ_CLIENT:
-        return {"error": "Groq client not configured"}
 
-    live_info = _get_live_data_via_tavily(address) or ""
-    try:
-        # Keep the prompt minimal and ask for JSON only.
-        prompt = (
-            f"Based on this search data: {live_info}, what is the status of {address}? "
-            "Return JSON only with keys: status (Sold|Active|Pending), sold_date (YYYY-MM-DD or null), "
-            "confidence (0.0-1.0), summary (provide references and summary of the property... E.G: Sources [] A beautiful 3 bedroom estate located on a lake, for example)."
-        )
-        chat_completion = GROQ_CLIENT.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=GROQ_MODEL,
-        )
-        # Extract content from common response shapes
-        content = None
-        try:
-            content = chat_completion.choices[0].message.content
-        except Exception:
-            content = getattr(chat_completion, 'text', None) or str(chat_completion)
+def _status_prompt(address: str, live_info: str) -> str:
+    # Keep the prompt minimal and ask for JSON only.
+    return (
+        f"Based on this search data: {live_info}, what is the status of {address}? "
+        "Return JSON only with keys: status (Sold|Active|Pending), sold_date (YYYY-MM-DD or null), "
+        "confidence (0.0-1.0), summary (provide references and summary of the property... E.G: Sources [] A beautiful 3 bedroom estate located on a lake, for example)."
+    )
+
+
+def _classification_key(search_payload: str, prompt: str, model: str) -> str:
+    h = hashlib.sha256()
+    for part in (model, search_payload, prompt):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return 'cls:' + h.hexdigest()
+
+
+def _quota_error(e: ProviderError) -> Dict[str, Any]:
+    """Error dict for a rate-limited call; /ai/summary turns it into 429 + Retry-After."""
+    return {"error": str(e), "quota_exceeded": True,
+            "retry_after_seconds": int(math.ceil(e.retry_after or GROQ.governor.retry_after() or 1))}
 
+
+async def _classify(address: str, prompt: str) -> Dict[str, Any]:
+    try:
+        content = await GROQ.chat([{"role": "user", "content": prompt}], model=GROQ_MODEL)
         parsed = _try_parse_json_from_text(content)
         if not isinstance(parsed, dict):
             return {"error": "Groq returned non-dict JSON"}
         return parsed
+    except ProviderError as e:
+        if e.quota_exceeded:
+            logger.warning('Groq rate limited for %s: %s', address, e)
+            return _quota_error(e)
+        logger.exception('Groq integration failed for %s', address)
+        return {"error": str(e)}
     except Exception as e:
         logger.exception('Groq integration failed for %s', address)
         return {"error": str(e)}
 
 
-def get_property_update(address: str) -> Dict[str, Any]:
-    """Public helper used by the API to produce a property status dictionary.
+async def _ai_status_check_groq(address: str, refresh_search: bool = False) -> Dict[str, Any]:
+    """Use Groq to classify the property status given optional live search data.
 
-    On success returns a dict with keys: status, sold_date, confidence, summary.
-    On failure returns a dict containing 'error' and a low-confidence 'fallback'.
+    Returns a parsed JSON dict on success, or an error dict with 'error' on
+    failure. Both stages are served from cache when possible.
     """
-    if not GROQ_CLIENT:
-        details = {"error": "Groq not configured (GROQ_API_KEY missing)."}
-        details["suggestion"] = "Set GROQ_API_KEY in environment and restart the server."
-        details["fallback"] = {
-            'status': 'Unknown',
-            'sold_date': None,
-            'confidence': 0.0,
-            'summary': f'Groq not configured. Local heuristic suggests unknown status for {address}.',
-            '_local_fallback': True,
-        }
-        return details
+    if not GROQ.configured:
+        return {"error": "Groq client not configured"}
+
+    live_info = await _search_stage(address, refresh=refresh_search)
+    prompt = _status_prompt(address, live_info)
+    return await CLASSIFY_STAGE.run(
+        _classification_key(live_info, prompt, GROQ_MODEL),
+        lambda: _classify(address, prompt),
+        cacheable=lambda v: isinstance(v, dict) and not v.get('error'),
+    )
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    """Per-stage hit rates and upstream latencies, plus batch/token counters."""
+    return {
+        'search': SEARCH_STAGE.stats(),
+        'classify': CLASSIFY_STAGE.stats(),
+        'batch': dict(BATCH_STATS),
+        'tokens': {'prompt': GROQ.stats.get('prompt_tokens', 0), 'completion': GROQ.stats.get('completion_tokens', 0)},
+        'governor': governor_stats(),
+    }
+
+
+def _not_configured(address: str) -> Dict[str, Any]:
+    details = {"error": "Groq not configured (GROQ_API_KEY missing)."}
+    details["suggestion"] = "Set GROQ_API_KEY in environment and restart the server."
+    details["fallback"] = {
+        'status': 'Unknown',
+        'sold_date': None,
+        'confidence': 0.0,
+        'summary': f'Groq not configured. Local heuristic suggests unknown status for {address}.',
+        '_local_fallback': True,
+    }
+    details["retryable"] = False
+    return details
+
 
-    res = _ai_status_check_groq(address)
+def _shape_update(address: str, res: Any) -> Dict[str, Any]:
+    """Classification result -> the public status dict (or error + fallback)."""
     if isinstance(res, dict) and not res.get('error'):
         out = {
             'status': (res.get('status') or 'Unknown'),
@@ -162,5 +204,193 @@ def get_property_update(address: str) -> Dict[str, Any]:
         '_local_fallback': True,
     }
     err = res.get('error') if isinstance(res, dict) else str(res)
-    return {"error": err, "fallback": fallback}
-    
\ No newline at end of file
+    out = {"error": err, "fallback": fallback}
+    if isinstance(res, dict) and res.get('quota_exceeded'):
+        out['quota_exceeded'] = True
+        out['retry_after_seconds'] = res.get('retry_after_seconds')
+    return out
+
+
+async def get_property_update_async(address: str, refresh_search: bool = False) -> Dict[str, Any]:
+    """Public helper used by the API to produce a property status dictionary.
+
+    refresh_search=True re-runs the search stage even when it is cached; the
+    classification is still reused if the search content is unchanged.
+
+    On success returns a dict with keys: status, sold_date, confidence, summary.
+    On failure returns a dict containing 'error' and a low-confidence 'fallback'.
+    """
+    if not GROQ.configured:
+        return _not_configured(address)
+    res = await _ai_status_check_groq(address, refresh_search=refresh_search)
+    return _shape_update(address, res)
+
+
+# ----------------------
+# Batched classification
+# ----------------------
+# One completion classifies up to AI_BATCH_MAX_ITEMS addresses, sized so the
+# prompt stays under AI_BATCH_TOKEN_BUDGET (estimated at ~4 chars per token).
+# The model answers with a JSON array; items that are missing or invalid are
+# split off and retried in smaller batches, down to the single-address path.
+# Results go into the same classify-stage cache as the single path (same key),
+# so the two paths reuse each other's work.
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "20"))
+AI_BATCH_TOKEN_BUDGET = int(os.getenv("AI_BATCH_TOKEN_BUDGET", "6000"))
+AI_BATCH_SNIPPET_CHARS = int(os.getenv("AI_BATCH_SNIPPET_CHARS", "1500"))
+_STATUSES = {'sold', 'active', 'pending', 'unknown'}
+
+BATCH_STATS = {'batches': 0, 'items': 0, 'retried_items': 0, 'single_fallbacks': 0}
+
+_BATCH_INSTRUCTIONS = (
+    "For each item below, use its search data to decide the status of the property at its address. "
+    "Return a JSON array only, one object per item, each with keys: id (the item's id), "
+    "status (Sold|Active|Pending), sold_date (YYYY-MM-DD or null), confidence (0.0-1.0), "
+    "summary (short summary of the property with sources).\nItems:\n"
+)
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _batch_item(idx: int, address: str, live_info: str) -> str:
+    return json.dumps({'id': idx, 'address': address, 'search': live_info[:AI_BATCH_SNIPPET_CHARS]})
+
+
+def _pack_batches(items: List[Tuple[int, str, str]]) -> List[List[Tuple[int, str, str]]]:
+    """Group (idx, address, live_info) items into batches within the token budget."""
+    budget = max(1, AI_BATCH_TOKEN_BUDGET - _estimate_tokens(_BATCH_INSTRUCTIONS))
+    batches, current, used = [], [], 0
+    for item in items:
+        cost = _estimate_tokens(_batch_item(*item)) + 1
+        if current and (used + cost > budget or len(current) >= AI_BATCH_MAX_ITEMS):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _valid_item(obj: Any) -> bool:
+    if not isinstance(obj, dict) or str(obj.get('status') or '').lower() not in _STATUSES:
+        return False
+    conf = obj.get('confidence')
+    if conf is not None:
+        try:
+            if not 0.0 <= float(conf) <= 1.0:
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
+
+
+def _parse_batch(content: str) -> Dict[int, Dict[str, Any]]:
+    """Parse a JSON array answer into {id: item} for the items that validate."""
+    clean = (content or '').replace('```json', '').replace('```', '').strip()
+    try:
+        data = json.loads(clean)
+    except ValueError:
+        start, end = clean.find('['), clean.rfind(']')
+        try:
+            data = json.loads(clean[start:end + 1]) if start != -1 and end > start else None
+        except ValueError:
+            data = None
+    if isinstance(data, dict):
+        data = data.get('items') or data.get('results') or [data]
+    out = {}
+    for obj in data if isinstance(data, list) else []:
+        if not _valid_item(obj):
+            continue
+        try:
+            idx = int(obj.get('id'))
+        except (TypeError, ValueError):
+            continue
+        out[idx] = {k: obj.get(k) for k in ('status', 'sold_date', 'confidence', 'summary')}
+    return out
+
+
+async def _classify_batch(batch: List[Tuple[int, str, str]]) -> Dict[int, Dict[str, Any]]:
+    """Classify a batch; failed items are split and retried, singles use _classify."""
+    if len(batch) == 1:
+        idx, address, live_info = batch[0]
+        BATCH_STATS['single_fallbacks'] += 1
+        return {idx: await _classify(address, _status_prompt(address, live_info))}
+    BATCH_STATS['batches'] += 1
+    BATCH_STATS['items'] += len(batch)
+    prompt = _BATCH_INSTRUCTIONS + "\n".join(_batch_item(*item) for item in batch)
+    try:
+        parsed = _parse_batch(await GROQ.chat([{"role": "user", "content": prompt}], model=GROQ_MODEL))
+    except ProviderError as e:
+        if e.quota_exceeded:
+            # splitting would only multiply the calls the provider just refused
+            logger.warning('Groq rate limited for a batch of %d items: %s', len(batch), e)
+            err = _quota_error(e)
+            return {idx: dict(err) for idx, _, _ in batch}
+        logger.exception('Groq batch classification failed for %d items', len(batch))
+        parsed = {}
+    except Exception:
+        logger.exception('Groq batch classification failed for %d items', len(batch))
+        parsed = {}
+    results = {idx: parsed[idx] for idx, _, _ in batch if idx in parsed}
+    failed = [item for item in batch if item[0] not in results]
+    if failed:
+        BATCH_STATS['retried_items'] += len(failed)
+        mid = len(failed) // 2
+        halves = [h for h in (failed[:mid], failed[mid:]) if h]
+        for part in await asyncio.gather(*(_classify_batch(h) for h in halves)):
+            results.update(part)
+    return results
+
+
+async def get_property_updates_batch(addresses: List[str], refresh_search: bool = False,
+                                     concurrency: int = 4) -> Dict[str, Dict[str, Any]]:
+    """Batched get_property_update_async: {address: status dict} for many addresses.
+
+    Search results and cached classifications are reused per address; the
+    remaining addresses are classified several per completion, with at most
+    `concurrency` completions in flight.
+    """
+    addresses = list(dict.fromkeys(a for a in addresses if a))
+    if not GROQ.configured:
+        return {a: _not_configured(a) for a in addresses}
+
+    live = await asyncio.gather(*(_search_stage(a, refresh=refresh_search) for a in addresses))
+    keys, classified, pending = {}, {}, []
+    for idx, (address, live_info) in enumerate(zip(addresses, live)):
+        keys[idx] = _classification_key(live_info, _status_prompt(address, live_info), GROQ_MODEL)
+        # a hit also covers refreshed searches whose content did not change
+        cached = CLASSIFY_STAGE.lookup(keys[idx])
+        if cached is not None:
+            classified[idx] = cached
+        else:
+            pending.append((idx, address, live_info))
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(batch):
+        async with semaphore:
+            t0 = time.perf_counter()
+            res = await _classify_batch(batch)
+            # amortized per address, comparable with single-path samples
+            CLASSIFY_STAGE.record_latency((time.perf_counter() - t0) / len(batch))
+            return res
+
+    for part in await asyncio.gather(*(run(b) for b in _pack_batches(pending))):
+        for idx, res in part.items():
+            if isinstance(res, dict) and not res.get('error'):
+                CLASSIFY_STAGE.set(keys[idx], res)
+            classified[idx] = res
+    return {a: _shape_update(a, classified.get(i)) for i, a in enumerate(addresses)}
+
+
+def get_property_update(address: str) -> Dict[str, Any]:
+    """Blocking wrapper around get_property_update_async for scripts and shells."""
+    async def _once():
+        try:
+            return await get_property_update_async(address)
+        finally:
+            await aclose_providers()
+    return asyncio.run(_once())
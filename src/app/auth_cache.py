@@ -0,0 +1,158 @@
+"""
+auth_cache
+
+Hot-path caches for authentication so `get_current_user` only pays for a dict
+lookup on repeated requests:
+
+- TokenCache memoizes verified JWT payloads per token string until the token's
+  own `exp` claim (bounded LRU).
+- PrincipalCache keeps a detached snapshot of the user row keyed by the
+  `user_id` claim with a short TTL. Entries are dropped explicitly whenever a
+  User row is updated or deleted through the ORM (see install_invalidation_hooks);
+  code that changes users with bulk/text SQL must call `invalidate` itself.
+
+Set PRINCIPAL_CACHE_TTL_SECONDS=0 or TOKEN_CACHE_MAX_ENTRIES=0 to disable.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "4096"))
+
+# user attributes copied into the cached principal; hashed_password is left out on purpose
+PRINCIPAL_FIELDS = ("id", "name", "email", "company", "created_at")
+
+
+def snapshot_user(user: Any) -> SimpleNamespace:
+    """Copy the public attributes of a User (ORM row or textual fallback row).
+
+    The snapshot is safe to share between requests because it is not bound to
+    any Session.
+    """
+    return SimpleNamespace(**{f: getattr(user, f, None) for f in PRINCIPAL_FIELDS})
+
+
+class PrincipalCache:
+    """user_id -> user snapshot, with a TTL and explicit invalidation."""
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._data: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, user_id: int) -> Optional[SimpleNamespace]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._data[user_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id: int, user: Any) -> SimpleNamespace:
+        """Store a snapshot of `user` and return it."""
+        principal = snapshot_user(user)
+        if not self.enabled:
+            return principal
+        with self._lock:
+            self._data[user_id] = (principal, time.monotonic() + self.ttl)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data), "ttl_seconds": self.ttl}
+
+
+class TokenCache:
+    """Bounded memo of verified JWT payloads keyed by the raw token string.
+
+    An entry is only served while the token's `exp` claim is in the future, so
+    caching never extends a token's lifetime.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES):
+        self.max_entries = int(max_entries)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, token: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+                if entry is not None:
+                    del self._data[token]
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token: str, payload: dict) -> None:
+        if not self.enabled:
+            return
+        exp = payload.get("exp") if isinstance(payload, dict) else None
+        try:
+            exp = float(exp) if exp is not None else None
+        except (TypeError, ValueError):
+            exp = None
+        with self._lock:
+            self._data[token] = (payload, exp)
+            self._data.move_to_end(token)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data), "max_entries": self.max_entries}
+
+
+def install_invalidation_hooks(model, cache: PrincipalCache) -> None:
+    """Drop cached principals whenever a `model` row is updated or deleted via the ORM."""
+    from sqlalchemy import event
+
+    def _invalidate(mapper, connection, target):
+        uid = getattr(target, "id", None)
+        if uid is not None:
+            cache.invalidate(uid)
+
+    event.listen(model, "after_update", _invalidate)
+    event.listen(model, "after_delete", _invalidate)
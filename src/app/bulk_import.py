@@ -0,0 +1,331 @@
+"""
+bulk_import
+
+Bulk ingest of properties, agents and photographers from CSV or NDJSON, for
+onboarding a brokerage in one request instead of one POST per row.
+
+The body is parsed as it streams in. CSV takes a header row, and quoted
+fields may span lines. NDJSON takes one JSON object per line. Each record
+goes through the same Pydantic model as the single-row endpoint. In CSV,
+empty cells count as missing, so model defaults apply.
+
+Duplicates are checked against in-memory indexes, loaded once per import
+and updated as rows go in. They use the same rules as the single-row
+endpoints:
+
+- Agents: lower(name), across all companies, as in POST /agents.
+- Photographers: email (unique column).
+- Properties: (company, lower(address)). The single-row POST /properties
+  doesn't check, but without this a re-run import would duplicate listings.
+
+A properties file may name the photographer by `photographer_email`
+instead of `photographer_id`; it's resolved through the same email index.
+
+Valid rows are inserted BULK_CHUNK_ROWS at a time: one executemany INSERT
+... RETURNING id per chunk, in its own transaction. If a chunk hits a
+constraint (say, a row another request inserted meanwhile), it is retried
+row by row under savepoints, so only the offending rows fail. Each invalid
+or duplicate row is reported with its row number, up to BULK_MAX_ERRORS.
+
+The inserts bypass the ORM hooks. The search documents of the new rows are
+written in the same transaction (search_index.reindex), and the caller
+invalidates the /ai/ask snapshots of the companies touched. New properties
+aren't geocoded here. Their (id, address) pairs are collected in
+`new_properties`, and the caller queues them for background geocoding.
+"""
+
+import os
+import csv
+import json
+import codecs
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from database import Property, Agent, Photographer
+import search_index
+
+logger = logging.getLogger('bulk_import')
+
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "2000"))
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "1000"))
+
+KINDS = ('properties', 'agents', 'photographers')
+FORMATS = ('csv', 'ndjson')
+
+_MODELS = {'properties': Property, 'agents': Agent, 'photographers': Photographer}
+# search_index document kinds
+_SEARCH_KIND = {'properties': 'property', 'agents': 'agent', 'photographers': 'photographer'}
+
+
+def detect_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    """`format` wins; otherwise the Content-Type decides. Raises ValueError when neither does."""
+    if fmt:
+        f = fmt.strip().lower()
+        if f in ('jsonl', 'json'):
+            f = 'ndjson'
+        if f not in FORMATS:
+            raise ValueError(f"unknown format {fmt!r}; expected csv or ndjson")
+        return f
+    ct = (content_type or '').split(';')[0].strip().lower()
+    if ct in ('text/csv', 'application/csv'):
+        return 'csv'
+    if ct in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        return 'ndjson'
+    raise ValueError("send Content-Type text/csv or application/x-ndjson, or pass ?format=csv|ndjson")
+
+
+# ----------------------
+# Streaming parsers
+# ----------------------
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    tail = ''
+    async for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        lines = text.split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+async def _csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # a record ends at a newline outside quotes: i.e. once its quote count is even
+    pending: List[str] = []
+    quotes = 0
+    async for line in _lines(chunks):
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield '\n'.join(pending)
+            pending, quotes = [], 0
+    if pending:
+        yield '\n'.join(pending)
+
+
+async def parse_batches(chunks: AsyncIterator[bytes], fmt: str,
+                        batch_rows: int = BULK_CHUNK_ROWS) -> AsyncIterator[List[Tuple[int, Any]]]:
+    """Yield lists of (row number, dict or parse error message) as the body arrives.
+
+    Row numbers count data rows from 1 (the CSV header isn't one).
+    """
+    batch: List[Tuple[int, Any]] = []
+    rowno = 0
+    if fmt == 'csv':
+        header: Optional[List[str]] = None
+        records: List[str] = []
+
+        def flush_records():
+            nonlocal rowno
+            for values in csv.reader(records):
+                if not values or all(not v.strip() for v in values):
+                    continue
+                rowno += 1
+                if len(values) > len(header):
+                    batch.append((rowno, f"expected {len(header)} columns, got {len(values)}"))
+                    continue
+                batch.append((rowno, {k: v for k, v in zip(header, values) if v != ''}))
+            records.clear()
+
+        async for record in _csv_records(chunks):
+            if header is None:
+                if record.strip():
+                    header = [h.strip().lower() for h in next(csv.reader([record]))]
+                continue
+            records.append(record)
+            if len(records) >= batch_rows:
+                flush_records()
+                yield batch
+                batch = []
+        if header is not None and records:
+            flush_records()
+    else:
+        async for line in _lines(chunks):
+            if not line.strip():
+                continue
+            rowno += 1
+            try:
+                obj = json.loads(line)
+                batch.append((rowno, obj if isinstance(obj, dict) else 'expected a JSON object'))
+            except ValueError as e:
+                batch.append((rowno, f"invalid JSON: {e}"))
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+# ----------------------
+# Importer
+# ----------------------
+def _validation_message(e: ValidationError) -> str:
+    return '; '.join(f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors())
+
+
+class BulkImporter:
+    """One import: validation model, duplicate indexes and running counters.
+
+    load_chunk() is blocking (run it in a worker thread from async code).
+    """
+
+    def __init__(self, bind, kind: str, model, company: Optional[str]):
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind {kind!r}; expected one of {', '.join(KINDS)}")
+        self.bind = bind
+        self.kind = kind
+        self.model = model
+        self.company = company
+        self.table = _MODELS[kind].__table__
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.companies: Set[Optional[str]] = set()
+        self.new_properties: List[Tuple[int, str]] = []
+        self.started = time.perf_counter()
+        self._agent_names: Set[str] = set()
+        self._photographer_emails: Dict[str, Tuple[int, Optional[str]]] = {}
+        self._addresses: Dict[Optional[str], Set[str]] = {}
+        self._load_indexes()
+
+    def _load_indexes(self) -> None:
+        with self.bind.connect() as conn:
+            if self.kind == 'agents':
+                self._agent_names = {n for (n,) in conn.execute(select(func.lower(Agent.name))) if n}
+            if self.kind in ('photographers', 'properties'):
+                self._photographer_emails = {
+                    e: (pid, comp) for pid, e, comp in conn.execute(
+                        select(Photographer.id, Photographer.email, Photographer.company)
+                        .where(Photographer.email.isnot(None)))
+                }
+
+    def _addresses_of(self, company: Optional[str]) -> Set[str]:
+        # loaded per company the first time a row targets it
+        known = self._addresses.get(company)
+        if known is None:
+            with self.bind.connect() as conn:
+                known = self._addresses[company] = {
+                    a for (a,) in conn.execute(select(func.lower(Property.address)).where(
+                        Property.company.is_(None) if company is None else Property.company == company)) if a
+                }
+        return known
+
+    def _error(self, rowno: int, message: str, duplicate: bool = False) -> None:
+        self.error_count += 1
+        if duplicate:
+            self.duplicates += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            err = {'row': rowno, 'error': message}
+            if duplicate:
+                err['duplicate'] = True
+            self.errors.append(err)
+
+    # ----- row -> column values, mirroring the single-row endpoints -----
+    def _values(self, rowno: int, raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raw = dict(raw)
+        photographer_email = raw.pop('photographer_email', None) if self.kind == 'properties' else None
+        try:
+            item = self.model.model_validate(raw)
+        except ValidationError as e:
+            self._error(rowno, _validation_message(e))
+            return None
+        company = item.company or self.company
+        if self.kind == 'properties':
+            key = item.address.strip().lower()
+            known = self._addresses_of(company)
+            if key in known:
+                self._error(rowno, f"property {item.address!r} already exists", duplicate=True)
+                return None
+            photographer_id = item.photographer_id
+            if photographer_email:
+                hit = self._photographer_emails.get(photographer_email.strip())
+                if hit is None or (company is not None and hit[1] != company):
+                    self._error(rowno, f"unknown photographer_email {photographer_email!r}")
+                    return None
+                photographer_id = hit[0]
+            known.add(key)
+            return {'address': item.address, 'status': item.status, 'price': item.price, 'agent': item.agent,
+                    'photographer_id': photographer_id, 'company': company, 'image_url': item.image_url}
+        if self.kind == 'agents':
+            name = (item.name or '').strip()
+            if not name:
+                self._error(rowno, 'name: Agent name is required')
+                return None
+            if name.lower() in self._agent_names:
+                self._error(rowno, f"agent {name!r} already exists", duplicate=True)
+                return None
+            self._agent_names.add(name.lower())
+            return {'name': name, 'email': item.email, 'phone': item.phone, 'company': company}
+        if item.email:
+            if item.email in self._photographer_emails:
+                self._error(rowno, f"photographer with email {item.email!r} already exists", duplicate=True)
+                return None
+            self._photographer_emails[item.email] = (0, company)  # id unknown until inserted
+        return {'name': item.name, 'email': item.email, 'phone': item.phone, 'company': company}
+
+    # ----- inserts -----
+    def _insert(self, conn, rows: List[Dict[str, Any]]) -> List[int]:
+        stmt = insert(self.table).returning(self.table.c.id, sort_by_parameter_order=True)
+        return list(conn.execute(stmt, rows).scalars())
+
+    def _insert_each(self, rows: List[Tuple[int, Dict[str, Any]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        inserted = []
+        with self.bind.begin() as conn:
+            for rowno, values in rows:
+                try:
+                    with conn.begin_nested():
+                        inserted.extend((i, values) for i in self._insert(conn, [values]))
+                except IntegrityError as e:
+                    self._error(rowno, f"rejected by the database: {e.orig}")
+            self._index(conn, [i for i, _ in inserted])
+        return inserted
+
+    def _index(self, conn, ids: List[int]) -> None:
+        if ids:
+            search_index.reindex(conn, _SEARCH_KIND[self.kind], self.table.c.id.in_(ids))
+
+    def load_chunk(self, batch: Iterable[Tuple[int, Any]]) -> int:
+        """Validate, de-duplicate and insert one parsed batch; returns the rows inserted."""
+        rows: List[Tuple[int, Dict[str, Any]]] = []
+        for rowno, raw in batch:
+            self.received += 1
+            if isinstance(raw, str):
+                self._error(rowno, raw)
+                continue
+            values = self._values(rowno, raw)
+            if values is not None:
+                rows.append((rowno, values))
+        if not rows:
+            return 0
+        try:
+            with self.bind.begin() as conn:
+                ids = self._insert(conn, [v for _, v in rows])
+                self._index(conn, ids)
+            inserted = list(zip(ids, (v for _, v in rows)))
+        except IntegrityError:
+            logger.info('bulk %s chunk hit a constraint; retrying row by row', self.kind)
+            inserted = self._insert_each(rows)
+        self.inserted += len(inserted)
+        self.companies.update(v['company'] for _, v in rows)
+        if self.kind == 'properties':
+            self.new_properties.extend((i, v['address']) for i, v in inserted)
+        return len(inserted)
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            'kind': self.kind, 'received': self.received, 'inserted': self.inserted,
+            'duplicates': self.duplicates, 'error_count': self.error_count, 'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'elapsed_ms': round(elapsed * 1000.0, 1),
+            'rows_per_sec': round(self.received / elapsed, 1) if elapsed > 0 else None,
+        }
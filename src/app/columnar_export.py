@@ -0,0 +1,330 @@
+"""
+columnar_export
+
+Apache Arrow IPC / Parquet exports of the CRM tables for reporting jobs, so
+they no longer page through the JSON endpoints.
+
+Exportable tables:
+
+- properties, agents, photographers and payment_events: every column.
+- statistics: daily (date, company, shoots_count, income_total), read like
+  payment_ledger.series(): the day rollups plus the events not compacted yet,
+  in one statement. Company-less rows have company ''.
+
+Rows come off a server-side cursor (yield_per) in EXPORT_CHUNK_ROWS chunks.
+Each chunk becomes one Arrow record batch, or one Parquet row group, and is
+sent before the next chunk is fetched, so memory stays at one chunk no
+matter how big the table is. Scoping matches the JSON endpoints: a user with
+a company only ever gets that company's rows.
+
+Heavy aggregate reports don't have to hit the OLTP database. A
+ReportSnapshots cache holds one in-memory Arrow copy of the tables per
+company, reloaded after EXPORT_SNAPSHOT_TTL_SECONDS. Queries over it run in
+DuckDB, which is optional (`pip install duckdb`): without it the reports
+answer 501 and the plain exports still work.
+
+CLI (from src/app):
+    python columnar_export.py properties --format parquet --out properties.parquet [--company Acme]
+    python columnar_export.py --all --format parquet --out-dir export/ [--company Acme]
+    python columnar_export.py --query "SELECT status, count(*) FROM properties GROUP BY 1" [--company Acme]
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, func, select, union_all
+
+from database import Property, Agent, Photographer, PaymentEvent, StatRollup
+import payment_ledger
+from stats_rollup import company_key
+
+try:
+    import duckdb
+except Exception:
+    duckdb = None
+
+logger = logging.getLogger('columnar_export')
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+EXPORT_SNAPSHOT_TTL = float(os.getenv("EXPORT_SNAPSHOT_TTL_SECONDS", "300"))
+
+FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+_rollups = StatRollup.__table__
+_events = PaymentEvent.__table__
+
+
+def _statistics_select():
+    rolled = select(_rollups.c.period_start.label('date'), _rollups.c.company,
+                    _rollups.c.shoots_count, _rollups.c.income_total).where(_rollups.c.period == 'day')
+    tail = select(_events.c.day, func.coalesce(_events.c.company, ''), _events.c.shoots, _events.c.amount) \
+        .where(payment_ledger.unfolded())
+    both = union_all(rolled, tail).subquery('statistics')
+    stmt = select(
+        both.c.date, both.c.company,
+        func.sum(both.c.shoots_count).label('shoots_count'),
+        func.sum(both.c.income_total).label('income_total'),
+    ).group_by(both.c.date, both.c.company).order_by(both.c.date, both.c.company)
+    return stmt, both.c.company
+
+
+# name -> (statement, company column); statements select every exported column in order
+EXPORT_TABLES = {
+    'properties': (select(Property.__table__).order_by(Property.id), Property.__table__.c.company),
+    'agents': (select(Agent.__table__).order_by(Agent.id), Agent.__table__.c.company),
+    'photographers': (select(Photographer.__table__).order_by(Photographer.id), Photographer.__table__.c.company),
+    'payment_events': (select(PaymentEvent.__table__).order_by(PaymentEvent.id), PaymentEvent.__table__.c.company),
+    'statistics': _statistics_select(),
+}
+
+
+def _arrow_type(sa_type) -> pa.DataType:
+    if isinstance(sa_type, Boolean):
+        return pa.bool_()
+    if isinstance(sa_type, Integer):
+        return pa.int64()
+    if isinstance(sa_type, Float):
+        return pa.float64()
+    if isinstance(sa_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(sa_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def schema_for(table: str) -> pa.Schema:
+    stmt, _ = EXPORT_TABLES[table]
+    return pa.schema([pa.field(c.name, _arrow_type(c.type)) for c in stmt.selected_columns])
+
+
+def parse_table(table: str) -> str:
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"unknown table {table!r}; expected one of {', '.join(EXPORT_TABLES)}")
+    return table
+
+
+def parse_format(fmt: Optional[str]) -> str:
+    f = (fmt or 'arrow').strip().lower()
+    if f not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    return f
+
+
+def scoped_statement(table: str, company: Optional[str]):
+    stmt, company_col = EXPORT_TABLES[table]
+    if company is not None:
+        # rollups key company-less rows as '' (see stats_rollup.company_key)
+        stmt = stmt.where(company_col == (company_key(company) if table == 'statistics' else company))
+    return stmt
+
+
+def record_batches(conn, table: str, company: Optional[str],
+                   chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pa.RecordBatch]:
+    """Yield the scoped table as record batches of up to `chunk_rows` rows, off a server-side cursor."""
+    schema = schema_for(table)
+    names = schema.names
+    result = conn.execute(scoped_statement(table, company).execution_options(yield_per=chunk_rows))
+    for rows in result.partitions(chunk_rows):
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, schema)], names=names)
+
+
+def read_table(conn, table: str, company: Optional[str]) -> pa.Table:
+    return pa.Table.from_batches(list(record_batches(conn, table, company)), schema=schema_for(table))
+
+
+class _ChunkSink:
+    """Write-only file object that hands out what was written since the last drain()."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        b = bytes(data)
+        self._parts.append(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        out, self._parts = b''.join(self._parts), []
+        return out
+
+
+def _writer(fmt: str, sink, schema: pa.Schema):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+    return pa.ipc.new_stream(sink, schema)
+
+
+def write_batches(fmt: str, sink, schema: pa.Schema, batches) -> int:
+    """Write `batches` to a file path or object; returns the row count."""
+    n = 0
+    with _writer(fmt, sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+
+def stream_export(db, table: str, company: Optional[str], fmt: str) -> Iterator[bytes]:
+    """Yield an export body chunk by chunk; closes `db` at the end (like property_listing.stream_json_array)."""
+    try:
+        sink = _ChunkSink()
+        with _writer(fmt, sink, schema_for(table)) as writer:
+            for batch in record_batches(db, table, company):
+                writer.write_batch(batch)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        yield sink.drain()
+    finally:
+        db.close()
+
+
+# ----------------------
+# Report snapshots (DuckDB over Arrow)
+# ----------------------
+REPORTS = {
+    'income_by_month': """
+        SELECT date_trunc('month', date)::DATE AS month, sum(shoots_count) AS shoots, sum(income_total) AS income
+        FROM statistics GROUP BY 1 ORDER BY 1""",
+    'properties_by_status': """
+        SELECT status, count(*) AS properties, sum(price) AS total_price, avg(price) AS avg_price,
+               count(*) FILTER (WHERE paid) AS paid
+        FROM properties GROUP BY 1 ORDER BY 2 DESC""",
+    'photographer_workload': """
+        SELECT ph.id, ph.name, count(p.id) AS properties, count(p.id) FILTER (WHERE p.paid) AS paid,
+               coalesce(sum(p.price) FILTER (WHERE p.paid), 0) AS paid_income
+        FROM photographers ph LEFT JOIN properties p ON p.photographer_id = ph.id
+        GROUP BY 1, 2 ORDER BY 3 DESC, 2""",
+    'agent_listings': """
+        SELECT p.agent, count(*) AS properties, count(*) FILTER (WHERE p.status = 'Sold') AS sold,
+               sum(p.price) AS total_price
+        FROM properties p WHERE coalesce(p.agent, '') <> '' GROUP BY 1 ORDER BY 2 DESC, 1""",
+}
+
+
+class ReportsUnavailable(RuntimeError):
+    """DuckDB isn't installed."""
+
+
+class ReportSnapshots:
+    """company -> in-memory Arrow copy of every export table, reloaded after `ttl` seconds."""
+
+    def __init__(self, bind, ttl: float = EXPORT_SNAPSHOT_TTL):
+        self.bind = bind
+        self.ttl = float(ttl)
+        self._data: Dict[Optional[str], Any] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+
+    def tables(self, company: Optional[str]) -> Dict[str, pa.Table]:
+        with self._lock:
+            entry = self._data.get(company)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+        with self.bind.connect() as conn:
+            tables = {name: read_table(conn, name, company) for name in EXPORT_TABLES}
+        with self._lock:
+            self._data[company] = (time.monotonic(), tables)
+            self.loads += 1
+        return tables
+
+    def invalidate(self, company: Optional[str] = None) -> None:
+        with self._lock:
+            if company is None:
+                self._data.clear()
+            else:
+                self._data.pop(company, None)
+
+    def query(self, company: Optional[str], sql: str) -> pa.Table:
+        return query_tables(self.tables(company), sql)
+
+    def report(self, company: Optional[str], name: str) -> pa.Table:
+        if name not in REPORTS:
+            raise ValueError(f"unknown report {name!r}; expected one of {', '.join(REPORTS)}")
+        return self.query(company, REPORTS[name])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = {str(k): sum(t.num_rows for t in v[1].values()) for k, v in self._data.items()}
+        return {'duckdb': duckdb is not None, 'loads': self.loads, 'hits': self.hits, 'snapshot_rows': rows}
+
+
+def query_tables(tables: Dict[str, pa.Table], sql: str) -> pa.Table:
+    """Run `sql` in a throwaway DuckDB connection that sees each Arrow table as a view."""
+    if duckdb is None:
+        raise ReportsUnavailable("reports need the optional duckdb package")
+    con = duckdb.connect()
+    try:
+        for name, table in tables.items():
+            con.register(name, table)
+        cur = con.execute(sql)
+        # to_arrow_table() since duckdb 1.4; older releases only have fetch_arrow_table()
+        return cur.to_arrow_table() if hasattr(cur, 'to_arrow_table') else cur.fetch_arrow_table()
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from database import engine
+
+    ap = argparse.ArgumentParser(description='Export CRM tables as Arrow IPC or Parquet.')
+    ap.add_argument('table', nargs='?', choices=list(EXPORT_TABLES))
+    ap.add_argument('--all', action='store_true', help='export every table into --out-dir')
+    ap.add_argument('--format', default='parquet', choices=list(FORMATS))
+    ap.add_argument('--out', help='output file (default: <table>.<ext>)')
+    ap.add_argument('--out-dir', default='.')
+    ap.add_argument('--company', default=None, help='only this company\'s rows')
+    ap.add_argument('--query', help='SQL over the exported tables (needs duckdb)')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.query:
+        with engine.connect() as conn:
+            snapshot = {name: read_table(conn, name, args.company) for name in EXPORT_TABLES}
+        result = query_tables(snapshot, args.query)
+        print('\t'.join(result.column_names))
+        for row in result.to_pylist():
+            print('\t'.join('' if v is None else str(v) for v in row.values()))
+    elif args.all or args.table:
+        os.makedirs(args.out_dir, exist_ok=True)
+        ext = FORMATS[args.format][1]
+        for name in (list(EXPORT_TABLES) if args.all else [args.table]):
+            path = args.out if (args.out and not args.all) else os.path.join(args.out_dir, f'{name}.{ext}')
+            t0 = time.perf_counter()
+            with engine.connect() as conn:
+                n = write_batches(args.format, path, schema_for(name), record_batches(conn, name, args.company))
+            print(f'{name}: {n} rows -> {path} ({time.perf_counter() - t0:.2f}s)')
+    else:
+        ap.print_help()
@@ -4,7 +4,7 @@ load_dotenv()  # load .env before reading DATABASE_URL or SECRET_KEY
 import os
 
 # SQLAlchemy imports for engine, model and session setup
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Date, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Date, Boolean, Index, Text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -39,6 +39,13 @@ class Property(Base):
     photographer = relationship('Photographer', back_populates='properties', lazy='joined')
     # whether the property has been paid/invoiced
     paid = Column(Boolean, default=False, nullable=False)
+    # when it was last marked paid, so un-paying reverses that day's rollup
+    paid_at = Column(DateTime, nullable=True)
+    # geocoded coordinates + IANA timezone, filled in the background whenever the
+    # address changes so sun planning never has to geocode on the request path
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    timezone = Column(String(64), nullable=True)
 
     def __repr__(self):
         return f"<Property id={self.id} address={self.address!r}>"
@@ -57,9 +64,6 @@ class User(Base):
     def __repr__(self):
         return f"<User id={self.id} name={self.name!r}>"
 
-# 7) Ensure tables exist (for simple setups). For production use Alembic migrations instead.
-Base.metadata.create_all(bind=engine)
-
 # Photographer model: separate table for photographers to associate with properties
 class Photographer(Base):
     __tablename__ = 'photographers'
@@ -96,5 +100,116 @@ class Statistic(Base):
     company = Column(String, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-# Recreate tables (will add missing tables/columns). For production use Alembic instead.
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+# Statistics rollups (see stats_rollup.py): one row per (period, company, period
+# start) holding running shoot/income counters, written with atomic upserts.
+# `company` is '' rather than NULL so the unique key covers company-less rows.
+class StatRollup(Base):
+    __tablename__ = 'stat_rollups'
+    id = Column(Integer, primary_key=True)
+    period = Column(String(10), nullable=False)          # day | week | month
+    company = Column(String, nullable=False, default='')
+    period_start = Column(Date, nullable=False)          # the day, the week's Monday or the month's 1st
+    shoots_count = Column(Integer, nullable=False, default=0)
+    income_total = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Payment ledger (see payment_ledger.py): append-only +/- events per paid,
+# un-paid or manual stats entry. `day` is the rollup bucket the event counts
+# toward; a reversal copies the day and negated amounts of the event it cancels.
+# `folded` flips once, in the transaction that adds the event to the rollups.
+class PaymentEvent(Base):
+    __tablename__ = 'payment_events'
+    id = Column(Integer, primary_key=True)
+    property_id = Column(Integer, ForeignKey('properties.id', ondelete='SET NULL'), nullable=True)
+    company = Column(String, nullable=True)
+    kind = Column(String(20), nullable=False)        # paid | unpaid | manual | opening
+    day = Column(Date, nullable=False)
+    shoots = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0.0)
+    reverses_id = Column(Integer, nullable=True)     # payment_events.id an unpaid entry cancels
+    created_at = Column(DateTime, default=datetime.utcnow)
+    folded = Column(Boolean, nullable=False, default=False)
+
+# Geocoding cache: normalized address -> coordinates, filled by geocoding.py so
+# /sun and property writes don't re-geocode the same address over the network.
+class GeocodeCache(Base):
+    __tablename__ = 'geocode_cache'
+    address_key = Column(String, primary_key=True)   # address_keys.normalize_address(address)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    source = Column(String(50), nullable=True)       # backend that resolved it (offline/nominatim)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Background AI sync jobs (see ai_jobs.py): one job per /ai/sync request, one
+# task per property. Tasks are claimed by a worker, retried with backoff and
+# deduplicated by address_key across jobs.
+class AISyncJob(Base):
+    __tablename__ = 'ai_sync_jobs'
+    id = Column(Integer, primary_key=True)
+    company = Column(String, nullable=True)
+    created_by = Column(Integer, nullable=True)                # users.id of the requester
+    kind = Column(String(20), default='sync', nullable=False)  # sync | refresh
+    refresh = Column(Boolean, default=False, nullable=False)   # re-run the live search
+    status = Column(String(20), default='queued', nullable=False)  # queued/running/done
+    total = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class AISyncTask(Base):
+    __tablename__ = 'ai_sync_tasks'
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('ai_sync_jobs.id', ondelete='CASCADE'), nullable=False)
+    property_id = Column(Integer, nullable=True)
+    address = Column(String, nullable=True)
+    address_key = Column(String, nullable=True)   # address_keys.normalize_address(address)
+    status = Column(String(20), default='queued', nullable=False)  # queued/running/done/failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    claimed_by = Column(String(64), nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    result = Column(Text, nullable=True)          # JSON status dict
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Search documents (see search_index.py): one row per property, agent and
+# photographer holding the lowercased text /search matches against. SQLite
+# mirrors `body` into an FTS5 trigram table, Postgres indexes it with pg_trgm.
+class SearchDocument(Base):
+    __tablename__ = 'search_documents'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)     # property | agent | photographer
+    ref_id = Column(Integer, nullable=False)      # id in the source table
+    company = Column(String, nullable=True)
+    title = Column(String, nullable=True)         # address or name
+    subtitle = Column(String, nullable=True)      # agent or email
+    body = Column(Text, nullable=False, default='')
+
+# Composite indexes for tenant-scoped queries: almost every endpoint filters on
+# `company` first, then on id/status/paid/date. The lower(name) indexes back the
+# case-insensitive name lookups (agent dedupe, assistant person lookup).
+Index('ix_properties_company_id', Property.company, Property.id)
+Index('ix_properties_company_status', Property.company, Property.status)
+Index('ix_properties_company_paid', Property.company, Property.paid)
+Index('ix_properties_photographer_id', Property.photographer_id)
+Index('ix_agents_company_id', Agent.company, Agent.id)
+Index('ix_agents_lower_name', func.lower(Agent.name))
+Index('ix_photographers_company_id', Photographer.company, Photographer.id)
+Index('ix_photographers_lower_name', func.lower(Photographer.name))
+Index('ix_users_lower_name', func.lower(User.name))
+Index('ix_statistics_company_date', Statistic.company, Statistic.date)
+Index('ix_ai_sync_tasks_job_id', AISyncTask.job_id, AISyncTask.id)
+Index('ix_ai_sync_tasks_status_due', AISyncTask.status, AISyncTask.next_attempt_at)
+Index('ix_ai_sync_tasks_address_status', AISyncTask.address_key, AISyncTask.status)
+Index('ix_ai_sync_jobs_company_id', AISyncJob.company, AISyncJob.id)
+Index('ux_stat_rollups_period_company_start', StatRollup.period, StatRollup.company, StatRollup.period_start, unique=True)
+Index('ix_payment_events_property_id', PaymentEvent.property_id, PaymentEvent.id)
+Index('ix_payment_events_folded_id', PaymentEvent.folded, PaymentEvent.id)
+Index('ux_search_documents_kind_ref', SearchDocument.kind, SearchDocument.ref_id, unique=True)
+Index('ix_search_documents_company_kind', SearchDocument.company, SearchDocument.kind)
+
+# Tables and indexes are created/upgraded by migrations.run_migrations(), which
+# the API calls once at startup (replaces the old import-time create_all calls).
\ No newline at end of file
@@ -0,0 +1,365 @@
+"""
+geocoding
+
+Address -> (lat, lng) resolution for /sun and property writes.
+
+Lookups go through, in order:
+1. an in-process LRU of recent results
+2. the persistent `geocode_cache` table (database.GeocodeCache)
+3. the configured backends, first hit wins:
+   - "offline": a local gazetteer (SQLite file built from a CSV with
+     import_gazetteer_csv), no network
+   - "nominatim": OpenStreetMap Nominatim behind a rate limiter that also
+     coalesces concurrent lookups of the same address
+
+Successful backend results are written back to the cache table, so once a
+property has been geocoded (create_property/update_property precompute it in
+the background) /sun never touches the network for that address.
+
+Properties that reach a request without coordinates (bulk imports, rows
+created before geocoding existed) are handed to a PropertyGeocodeQueue: a
+single background thread that geocodes them one by one at the backends'
+pace. Requests only ever do local lookups (allow_remote=False), so a batch
+of never-geocoded properties can't hold a request for one remote call each.
+
+Configuration:
+    GEOCODER_BACKENDS               comma list, default "offline,nominatim"
+    GEOCODER_GAZETTEER_PATH         SQLite gazetteer for the offline backend
+    GEOCODER_USER_AGENT             Nominatim user agent (default greentree_crm)
+    NOMINATIM_MIN_INTERVAL_SECONDS  spacing between remote calls (default 1.0)
+"""
+
+import os
+import csv
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from address_keys import normalize_address
+from database import SessionLocal, GeocodeCache
+
+logger = logging.getLogger('geocoding')
+
+GEOCODER_BACKENDS = os.getenv("GEOCODER_BACKENDS", "offline,nominatim")
+GEOCODER_GAZETTEER_PATH = os.getenv("GEOCODER_GAZETTEER_PATH")
+GEOCODER_USER_AGENT = os.getenv("GEOCODER_USER_AGENT", "greentree_crm")
+NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL_SECONDS", "1.0"))
+GEOCODER_MEMORY_ENTRIES = int(os.getenv("GEOCODER_MEMORY_ENTRIES", "4096"))
+
+Coords = Tuple[float, float]
+
+
+class GeocoderBackend(ABC):
+    """Backend interface: return (lat, lng) for an address or None."""
+
+    name = 'base'
+
+    @abstractmethod
+    def geocode(self, address: str) -> Optional[Coords]:
+        ...
+
+
+class OfflineGazetteerBackend(GeocoderBackend):
+    """Exact-match lookup in a local SQLite gazetteer.
+
+    The gazetteer has one table `gazetteer(address_key TEXT PRIMARY KEY, lat, lng)`
+    keyed by normalize_address(). When the full address is unknown the backend
+    retries with leading components dropped ("12 Elm St, Springfield, IL" ->
+    "springfield, il"), which is accurate enough for sun times.
+    """
+
+    name = 'offline'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    def geocode(self, address: str) -> Optional[Coords]:
+        key = normalize_address(address)
+        parts = [p for p in key.split(', ') if p]
+        with self._lock:
+            for i in range(len(parts)):
+                candidate = ', '.join(parts[i:])
+                row = self._conn.execute("SELECT lat, lng FROM gazetteer WHERE address_key = ?", (candidate,)).fetchone()
+                if row:
+                    return float(row[0]), float(row[1])
+        return None
+
+
+def import_gazetteer_csv(csv_path: str, sqlite_path: str, address_col: str = 'address',
+                         lat_col: str = 'lat', lng_col: str = 'lng') -> int:
+    """Build/extend an offline gazetteer from a CSV; returns rows imported."""
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS gazetteer (address_key TEXT PRIMARY KEY, lat REAL NOT NULL, lng REAL NOT NULL)")
+        n = 0
+        with open(csv_path, newline='', encoding='utf-8') as fh:
+            batch = []
+            for row in csv.DictReader(fh):
+                try:
+                    batch.append((normalize_address(row[address_col]), float(row[lat_col]), float(row[lng_col])))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if len(batch) >= 5000:
+                    conn.executemany("INSERT OR REPLACE INTO gazetteer VALUES (?, ?, ?)", batch)
+                    n += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany("INSERT OR REPLACE INTO gazetteer VALUES (?, ?, ?)", batch)
+                n += len(batch)
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+
+class CoalescingRateLimiter:
+    """Spaces calls at least `min_interval` apart and collapses concurrent
+    calls for the same key into one (the others wait and share its result)."""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = float(min_interval)
+        self._slot_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._inflight_lock = threading.Lock()
+        self._inflight: Dict[str, list] = {}  # key -> [Event, result]
+
+    def _wait_for_slot(self) -> None:
+        with self._slot_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def call(self, key: str, fn, *args):
+        with self._inflight_lock:
+            entry = self._inflight.get(key)
+            leader = entry is None
+            if leader:
+                entry = [threading.Event(), None]
+                self._inflight[key] = entry
+        if not leader:
+            entry[0].wait()
+            return entry[1]
+        try:
+            self._wait_for_slot()
+            entry[1] = fn(*args)
+            return entry[1]
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            entry[0].set()
+
+
+class NominatimBackend(GeocoderBackend):
+    """Remote OpenStreetMap geocoder; one shared client behind a rate limiter."""
+
+    name = 'nominatim'
+
+    def __init__(self, user_agent: str = GEOCODER_USER_AGENT, min_interval: float = NOMINATIM_MIN_INTERVAL):
+        from geopy.geocoders import Nominatim
+        self._client = Nominatim(user_agent=user_agent)
+        self._limiter = CoalescingRateLimiter(min_interval)
+
+    def _lookup(self, address: str) -> Optional[Coords]:
+        location = self._client.geocode(address)
+        if not location:
+            return None
+        return float(location.latitude), float(location.longitude)
+
+    def geocode(self, address: str) -> Optional[Coords]:
+        return self._limiter.call(normalize_address(address), self._lookup, address)
+
+
+class Geocoder:
+    """Cached geocoding front-end used by the API."""
+
+    def __init__(self, backends: List[GeocoderBackend], memory_entries: int = GEOCODER_MEMORY_ENTRIES):
+        self.backends = backends
+        self.memory_entries = max(1, memory_entries)
+        self._memory: "OrderedDict[str, Coords]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'backend_hits': 0, 'misses': 0}
+
+    def _remember(self, key: str, coords: Coords) -> None:
+        with self._lock:
+            self._memory[key] = coords
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def cached(self, address: str, db=None) -> Optional[Coords]:
+        """Memory/DB lookup only; never calls a backend."""
+        key = normalize_address(address)
+        if not key:
+            return None
+        with self._lock:
+            coords = self._memory.get(key)
+            if coords is not None:
+                self._memory.move_to_end(key)
+        if coords is not None:
+            self.stats['memory_hits'] += 1
+            return coords
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            row = db.get(GeocodeCache, key)
+            if row is not None:
+                coords = (float(row.latitude), float(row.longitude))
+        except Exception:
+            logger.exception('geocode cache read failed')
+            coords = None
+        finally:
+            if own:
+                db.close()
+        if coords is not None:
+            self.stats['db_hits'] += 1
+            self._remember(key, coords)
+        return coords
+
+    def _store(self, key: str, coords: Coords, source: str) -> None:
+        self._remember(key, coords)
+        db = SessionLocal()
+        try:
+            db.merge(GeocodeCache(address_key=key, latitude=coords[0], longitude=coords[1],
+                                  source=source, created_at=datetime.utcnow()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception('geocode cache write failed')
+        finally:
+            db.close()
+
+    def geocode(self, address: str, db=None, allow_remote: bool = True) -> Optional[Coords]:
+        """Resolve an address through the caches, then the backends."""
+        coords = self.cached(address, db=db)
+        if coords is not None:
+            return coords
+        key = normalize_address(address)
+        if not key:
+            return None
+        for backend in self.backends:
+            if not allow_remote and not isinstance(backend, OfflineGazetteerBackend):
+                continue
+            try:
+                coords = backend.geocode(address)
+            except Exception:
+                logger.exception('geocoder backend %s failed for %s', backend.name, address)
+                coords = None
+            if coords is not None:
+                self.stats['backend_hits'] += 1
+                self._store(key, coords, backend.name)
+                return coords
+        self.stats['misses'] += 1
+        return None
+
+    def precompute(self, address: str) -> None:
+        """Background-task helper: warm the cache for an address, ignoring errors."""
+        try:
+            self.geocode(address)
+        except Exception:
+            logger.exception('geocode precompute failed for %s', address)
+
+
+class PropertyGeocodeQueue:
+    """Background geocoding of properties on one daemon thread.
+
+    `resolve(property_id, address)` does the work (geocode and store). Ids
+    already waiting are not queued twice, so repeated /sun/batch calls over
+    the same pending properties cost nothing extra.
+    """
+
+    def __init__(self, resolve: Callable[[int, str], None]):
+        self.resolve = resolve
+        self.stats = {'queued': 0, 'done': 0, 'failed': 0}
+        self._pending: "OrderedDict[int, str]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def submit(self, items: Iterable[Tuple[int, str]]) -> int:
+        """Queue (property_id, address) pairs; returns how many were new."""
+        added = 0
+        with self._cond:
+            for property_id, address in items:
+                if address and self._pending.get(property_id) != address:
+                    self._pending[property_id] = address
+                    added += 1
+            if added:
+                self.stats['queued'] += added
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='property-geocoder', daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+        return added
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                # leave the id in _pending until resolved so a resubmit doesn't queue it again
+                property_id, address = next(iter(self._pending.items()))
+            try:
+                self.resolve(property_id, address)
+                self.stats['done'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logger.exception('background geocode failed for property %s', property_id)
+            with self._cond:
+                current = self._pending.get(property_id)
+                if current == address:
+                    del self._pending[property_id]
+                elif current is not None:
+                    # re-submitted with a new address meanwhile: keep it queued, at the back
+                    self._pending.move_to_end(property_id)
+
+
+def build_geocoder() -> Geocoder:
+    """Create the process-wide geocoder from environment configuration."""
+    backends: List[GeocoderBackend] = []
+    for name in [n.strip().lower() for n in GEOCODER_BACKENDS.split(',') if n.strip()]:
+        try:
+            if name == 'offline':
+                if GEOCODER_GAZETTEER_PATH and os.path.exists(GEOCODER_GAZETTEER_PATH):
+                    backends.append(OfflineGazetteerBackend(GEOCODER_GAZETTEER_PATH))
+            elif name == 'nominatim':
+                backends.append(NominatimBackend())
+            else:
+                logger.warning('unknown geocoder backend %r ignored', name)
+        except Exception:
+            logger.exception('could not initialise geocoder backend %s', name)
+    return Geocoder(backends)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    ap = argparse.ArgumentParser(description='Import a CSV gazetteer for the offline geocoder backend.')
+    ap.add_argument('csv_path')
+    ap.add_argument('sqlite_path')
+    ap.add_argument('--address-col', default='address')
+    ap.add_argument('--lat-col', default='lat')
+    ap.add_argument('--lng-col', default='lng')
+    args = ap.parse_args()
+    count = import_gazetteer_csv(args.csv_path, args.sqlite_path, args.address_col, args.lat_col, args.lng_col)
+    print(f'imported {count} rows into {args.sqlite_path}')
@@ -1,45 +1,153 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Response, Request, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from sqlalchemy import func, select, update
 from sqlalchemy.exc import ProgrammingError
 from types import SimpleNamespace
 from pydantic import BaseModel
 from datetime import datetime, timedelta, date
 import os
-
-from database import SessionLocal, Property, User, Photographer, Statistic, Agent  # ensure Photographer + Statistic + Agent models are available
-from sun_logic import get_optimal_times
-from geopy.geocoders import Nominatim
-from ai_services import get_property_update, GROQ_CLIENT, GROQ_MODEL
+import json
+import io
+import math
+
+from database import engine, SessionLocal, Property, User, Photographer, Statistic, Agent, AISyncJob, StatRollup, PaymentEvent  # ensure Photographer + Statistic + Agent models are available
+from migrations import run_migrations, explain_endpoint_queries
+from schema_probe import SCHEMA
+from sun_logic import get_optimal_times, get_optimal_times_range, resolve_timezone, precompute_timezones, sun_cache_stats
+from geocoding import build_geocoder, PropertyGeocodeQueue
+from ai_services import get_property_update_async, pipeline_stats, GROQ_ENABLED, GROQ_MODEL
+from ai_providers import GROQ, ProviderError, aclose_providers
+from ai_cache import build_ai_cache, RefreshAhead, AI_REFRESH_AHEAD
+from ai_intents import ASK_ROUTER, AskContext, CompanyIndex
+from ai_context import (
+    ContextSnapshot, CompanySnapshots, install_context_hooks, record_change,
+    AI_CONTEXT_SAMPLE_PROPERTIES, AI_CONTEXT_CONTACTS, AI_CONTEXT_STAT_ROWS,
+)
+from ai_jobs import (
+    AI_WORKER_MODE, build_worker, enqueue_sync_job, enqueue_refresh, enqueue_refreshes, job_visible, job_progress,
+    job_tasks,
+)
+from property_listing import (
+    MAX_PAGE_SIZE, STREAM_CHUNK_SIZE, PROPERTY_FIELDS, parse_fields, decode_cursor, encode_cursor, listing_filters,
+    build_listing_query, build_count_query, row_to_item, stream_json_array,
+)
+from auth_cache import PrincipalCache, TokenCache, install_invalidation_hooks
+from search_index import SearchIndex, install_search_hooks, parse_kinds, SEARCH_MAX_LIMIT
+from stats_rollup import parse_period
+import payment_ledger
+from payment_ledger import LedgerCompactor, series as rollup_series, totals as rollup_totals
+from stats_analytics import (
+    analytics as compute_analytics, etag as analytics_etag, etag_matches,
+    ANALYTICS_DEFAULT_WINDOW, ANALYTICS_MAX_BUCKETS,
+)
+from columnar_export import (
+    ReportSnapshots, ReportsUnavailable, REPORTS, FORMATS as EXPORT_FORMATS, EXPORT_TABLES,
+    parse_table as parse_export_table, parse_format as parse_export_format, stream_export, write_batches,
+)
+from bulk_import import BulkImporter, detect_format as detect_import_format, parse_batches as parse_import_batches
 import asyncio
 import time
 
-# Simple in-memory cache for AI summaries to avoid repeated slow calls
-AI_CACHE: dict = {}
-AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL_SECONDS", "21600"))  # default 6 hours
+# Create tables / apply pending schema migrations once per process at startup,
+# then record which tables/columns exist so handlers can build one query each
+run_migrations()
+SCHEMA.refresh()
+
+# /search backend (FTS5, pg_trgm or LIKE) and the hooks that keep its documents
+# current from ORM writes (see search_index.py)
+SEARCH = SearchIndex(engine)
+SEARCH.detect()
+install_search_hooks(SEARCH)
 
-async def _refresh_ai_cache(address: str, user_id: int | None = None):
-    """Background task that refreshes the AI cache for an address.
+# Cached geocoder for /sun and property writes (see geocoding.py)
+GEOCODER = build_geocoder()
 
-    If user_id is provided, the cache key will be scoped to that user so
-    summaries are cached per-session. If user_id is None we fall back to the
-    legacy address-only key.
+
+def _precompute_property_timezones():
+    """Pin the timezone of every grid cell our geocoded properties occupy, so
+    sun-time renders for the portfolio never run a timezone polygon lookup."""
+    if not SCHEMA.has_column(Property.__tablename__, 'latitude'):
+        return
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            SCHEMA.select(Property, ['latitude', 'longitude', 'timezone'])
+            .where(Property.latitude.isnot(None), Property.longitude.isnot(None))
+            .distinct()
+        ).all()
+        precompute_timezones(rows)
+    except Exception:
+        pass
+    finally:
+        db.close()
+
+
+_precompute_property_timezones()
+
+# Shared, bounded cache for AI summaries (see ai_cache.py). Keys are normalized
+# addresses so every tenant viewing the same listing reuses one upstream call.
+AI_CACHE = build_ai_cache()
+
+
+def _fetch_property_update(address: str, refresh_search: bool = False):
+    """Return a zero-arg coroutine factory for the async Groq helper."""
+    return lambda: get_property_update_async(address, refresh_search=refresh_search)
+
+
+# Background AI sync worker (see ai_jobs.py); AI_WORKER_MODE=external runs it
+# as a separate process instead
+AI_WORKER = build_worker(AI_CACHE) if AI_WORKER_MODE == 'inprocess' else None
+
+
+def _enqueue_refresh(address: str):
+    db = SessionLocal()
+    try:
+        return enqueue_refresh(db, address)
+    finally:
+        db.close()
+
+
+async def _refresh_ai_cache(address: str):
+    """Queue a tracked background refresh of the AI cache for an address.
+
+    Deduplicated: nothing is queued while a refresh for the address is pending.
     """
     try:
-        res = await asyncio.to_thread(get_property_update, address)
-        if isinstance(res, dict) and not res.get('error'):
-            key = f"user:{user_id}|addr:{address.lower().strip()}" if user_id is not None else address.lower().strip()
-            AI_CACHE[key] = (res, time.time())
+        await asyncio.to_thread(_enqueue_refresh, address)
+        if AI_WORKER is not None:
+            AI_WORKER.wake()
     except Exception:
-        # ignore background refresh failures
+        # a failed enqueue only loses the early refresh; the next request retries
         pass
 
+
+def _enqueue_refresh_ahead(addresses):
+    db = SessionLocal()
+    try:
+        return enqueue_refreshes(db, addresses, refresh=True, kind='refresh_ahead')
+    finally:
+        db.close()
+
+
+async def _schedule_refresh_ahead(addresses):
+    await asyncio.to_thread(_enqueue_refresh_ahead, addresses)
+    if AI_WORKER is not None:
+        AI_WORKER.wake()
+
+
+# Re-queues frequently read summaries shortly before their soft TTL (see ai_cache.py)
+AI_REFRESH_AHEAD_TASK = RefreshAhead(AI_CACHE, _schedule_refresh_ahead) if AI_REFRESH_AHEAD else None
+# folds payment_events into the statistics rollups (see payment_ledger.py)
+LEDGER_COMPACTOR = LedgerCompactor(engine)
+# per-company Arrow copies of the tables for /reports, off the OLTP path (see columnar_export.py)
+REPORT_SNAPSHOTS = ReportSnapshots(engine)
+
 from fastapi.middleware.cors import CORSMiddleware
 
 # Security libs
-# use a pure-python, well-supported scheme that accepts long passwords
-from passlib.context import CryptContext
 from jose import jwt, JWTError
+from password_hashing import HashingPool, HashingSaturated
 
 app = FastAPI()
 
@@ -68,6 +176,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the dashboard revalidates /stats/analytics with If-None-Match
+    expose_headers=["ETag"],
 )
 
 # DB session dependency
@@ -79,73 +189,155 @@ def get_db():
         db.close()
 
 
-# Helper: safe user lookup wrappers. Some deployed DBs may not have new columns yet
-# (for example `users.company`), which would make ORM queries raise ProgrammingError.
-# These helpers attempt an ORM query first and fall back to a textual select of the
-# known columns so the app continues to authenticate until you run a migration.
+# Helper: user lookups. Some deployed DBs may not have new columns yet (for
+# example `users.company`). The startup schema probe (schema_probe.SCHEMA) knows
+# which columns exist, so each lookup is one SELECT of the present columns with
+# missing ones filled from the model defaults.
 def _user_from_row(row):
     if not row:
         return None
-    # row may be an ORM-mapped User instance or a mapping result
-    if isinstance(row, SimpleNamespace) or hasattr(row, 'id') and hasattr(row, 'name'):
-        return row
-    try:
-        # SQLAlchemy MappingResult -> dict-like
-        m = dict(row)
-        return SimpleNamespace(**m)
-    except Exception:
-        return row
+    return SimpleNamespace(**dict(row))
+
+def _find_user(db: Session, *criteria):
+    row = db.execute(SCHEMA.select(User).where(*criteria).limit(1)).mappings().first()
+    return _user_from_row(row)
 
 def find_user_by_name(db: Session, name: str):
-    try:
-        return db.query(User).filter(User.name == name).first()
-    except ProgrammingError:
-        # likely the DB schema missing a column; rollback and run a safe text query
-        db.rollback()
-        row = db.execute(text("SELECT id, name, email, hashed_password, created_at FROM users WHERE name = :name LIMIT 1"), {"name": name}).mappings().first()
-        return _user_from_row(row)
+    return _find_user(db, User.name == name)
 
 
 def find_user_by_email(db: Session, email: str):
-    try:
-        return db.query(User).filter(User.email == email).first()
-    except ProgrammingError:
-        db.rollback()
-        row = db.execute(text("SELECT id, name, email, hashed_password, created_at FROM users WHERE email = :email LIMIT 1"), {"email": email}).mappings().first()
-        return _user_from_row(row)
+    return _find_user(db, User.email == email)
 
 
 def find_user_by_id(db: Session, user_id: int):
-    try:
-        return db.query(User).filter(User.id == user_id).first()
-    except ProgrammingError:
-        db.rollback()
-        row = db.execute(text("SELECT id, name, email, hashed_password, created_at FROM users WHERE id = :id LIMIT 1"), {"id": user_id}).mappings().first()
-        return _user_from_row(row)
+    return _find_user(db, User.id == user_id)
 
 # ----------------------
 # Auth configuration
 # ----------------------
-# Use pbkdf2_sha256 (pure-python). Accepts long inputs and avoids 72-byte bcrypt limit.
-PWD_CTX = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# PWD_CTX (pbkdf2_sha256) lives in password_hashing.py so pool workers can use it.
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-change-me")  # set in .env for production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))  # default 60 minutes (login valid 1 hour)
 
-def hash_password(password: str) -> str:
-    return PWD_CTX.hash(password)
+# Dedicated process pool for PBKDF2 so login/register bursts don't block the
+# event loop or the default threadpool (see password_hashing.py).
+HASH_POOL = HashingPool()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """
-    Verify password safely. If the incoming plain_password is too long or invalid
-    for the underlying bcrypt implementation, treat it as a failed login instead
-    of raising a 500 error.
-    """
+def _hashing_busy(exc: HashingSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry shortly",
+        headers={"Retry-After": str(int(exc.retry_after))},
+    )
+
+async def hash_password_async(password: str) -> str:
+    try:
+        return await HASH_POOL.hash(password)
+    except HashingSaturated as exc:
+        raise _hashing_busy(exc)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify in the hashing pool. Returns (ok, new_hash); new_hash is set when
+    the stored hash should be upgraded (PWD_CTX.needs_update)."""
+    try:
+        return await HASH_POOL.verify_and_update(plain_password, hashed_password)
+    except HashingSaturated as exc:
+        raise _hashing_busy(exc)
+
+# The auth handlers are async so they can await the hashing pool; their DB
+# steps run in a worker thread, each with its own short-lived session.
+def _registration_conflict(name: str, email: str | None) -> str | None:
+    db = SessionLocal()
+    try:
+        # check by email if provided, otherwise by name
+        if email and find_user_by_email(db, email):
+            return "Email already registered"
+        if find_user_by_name(db, name):
+            return "Username already registered"
+        return None
+    finally:
+        db.close()
+
+def _create_user(name: str, email: str | None, hashed: str) -> tuple[int, str, str | None]:
+    db = SessionLocal()
+    try:
+        # store proper datetime object (DB column is DateTime)
+        user = User(name=name, email=email, hashed_password=hashed, created_at=datetime.utcnow())
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user.id, user.name, user.email
+    finally:
+        db.close()
+
+def _find_login_user(email: str | None, name: str | None):
+    # allow login by email or name
+    db = SessionLocal()
     try:
-        return PWD_CTX.verify(plain_password, hashed_password)
-    except (ValueError, TypeError) as exc:
-        # treat as authentication failure
-        return False
+        if email:
+            return find_user_by_email(db, email)
+        if name:
+            return find_user_by_name(db, name)
+        return None
+    finally:
+        db.close()
+
+def _store_rehash(user_id: int, new_hash: str) -> None:
+    """Persist an upgraded password hash; failures never block the login."""
+    db = SessionLocal()
+    try:
+        db.execute(update(User).where(User.id == user_id).values(hashed_password=new_hash))
+        db.commit()
+        PRINCIPALS.invalidate(user_id)
+    except Exception:
+        db.rollback()
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+def _shutdown_hash_pool():
+    HASH_POOL.shutdown()
+
+
+@app.on_event("shutdown")
+async def _close_ai_providers():
+    await aclose_providers()
+
+
+@app.on_event("startup")
+async def _start_ai_worker():
+    if AI_WORKER is not None:
+        AI_WORKER.start()
+
+
+@app.on_event("shutdown")
+async def _stop_ai_worker():
+    if AI_WORKER is not None:
+        await AI_WORKER.stop()
+
+
+@app.on_event("startup")
+async def _start_refresh_ahead():
+    if AI_REFRESH_AHEAD_TASK is not None:
+        AI_REFRESH_AHEAD_TASK.start()
+
+
+@app.on_event("shutdown")
+async def _stop_refresh_ahead():
+    if AI_REFRESH_AHEAD_TASK is not None:
+        await AI_REFRESH_AHEAD_TASK.stop()
+
+
+@app.on_event("startup")
+async def _start_ledger_compactor():
+    LEDGER_COMPACTOR.start()
+
+
+@app.on_event("shutdown")
+async def _stop_ledger_compactor():
+    await LEDGER_COMPACTOR.stop()
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
@@ -153,12 +345,30 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Hot-path auth caches (see auth_cache.py): verified JWT payloads per token and
+# user snapshots per user_id, invalidated whenever a User row changes.
+TOKEN_CACHE = TokenCache()
+PRINCIPALS = PrincipalCache()
+install_invalidation_hooks(User, PRINCIPALS)
+
+# /ai/ask context per company, patched from ORM writes on commit (see ai_context.py)
+AI_CONTEXT = CompanySnapshots()
+# contact / address name index behind the /ai/ask intent router (see ai_intents.py)
+INTENT_INDEX = CompanySnapshots()
+install_context_hooks(SessionLocal, [AI_CONTEXT, INTENT_INDEX], {
+    'property': Property, 'agent': Agent, 'photographer': Photographer, 'user': User,
+})
+
 def verify_token(token: str):
+    payload = TOKEN_CACHE.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    TOKEN_CACHE.set(token, payload)
+    return payload
 
 # ----------------------
 # Pydantic models
@@ -214,34 +424,27 @@ class AgentUpdate(BaseModel):
     company: str | None = None
 
 
+class SunBatchRequest(BaseModel):
+    property_ids: list[int]
+    # inclusive YYYY-MM-DD range; defaults to today .. today + 6 (one week)
+    start_date: str | None = None
+    end_date: str | None = None
+
+
 # ----------------------
 # Auth endpoints
 # ----------------------
 @app.post("/register", status_code=201)
-def register(user_in: UserCreate, response: Response, db: Session = Depends(get_db)):
-    # check by email if provided, otherwise by name
-    if user_in.email:
-        exists = find_user_by_email(db, user_in.email)
-        if exists:
-            raise HTTPException(status_code=400, detail="Email already registered")
-    exists_name = find_user_by_name(db, user_in.name)
-    if exists_name:
-        raise HTTPException(status_code=400, detail="Username already registered")
-
-    hashed = hash_password(user_in.password)
-    # store proper datetime object (DB column is DateTime)
-    user = User(
-        name=user_in.name,
-        email=user_in.email,
-        hashed_password=hashed,
-        created_at=datetime.utcnow()
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+async def register(user_in: UserCreate, response: Response):
+    conflict = await asyncio.to_thread(_registration_conflict, user_in.name, user_in.email)
+    if conflict:
+        raise HTTPException(status_code=400, detail=conflict)
+
+    hashed = await hash_password_async(user_in.password)
+    user_id, name, email = await asyncio.to_thread(_create_user, user_in.name, user_in.email, hashed)
 
     # create token and return it so frontend can store/use it (also set cookie for compat)
-    token = create_access_token({"sub": user.name, "user_id": user.id})
+    token = create_access_token({"sub": name, "user_id": user_id})
     response.set_cookie(
         key="access_token",
         value=token,
@@ -250,19 +453,19 @@ def register(user_in: UserCreate, response: Response, db: Session = Depends(get_
         secure=False,
         max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60
     )
-    return {"id": user.id, "name": user.name, "email": user.email, "access_token": token}
+    return {"id": user_id, "name": name, "email": email, "access_token": token}
 
 @app.post("/login")
-def login(creds: UserLogin, response: Response, db: Session = Depends(get_db)):
-    # allow login by email or name
-    user = None
-    if creds.email:
-        user = find_user_by_email(db, creds.email)
-    elif creds.name:
-        user = find_user_by_name(db, creds.name)
-
-    if not user or not verify_password(creds.password, user.hashed_password):
+async def login(creds: UserLogin, response: Response):
+    user = await asyncio.to_thread(_find_login_user, creds.email, creds.name)
+    if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    ok, new_hash = await verify_password_async(creds.password, user.hashed_password)
+    if not ok:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if new_hash:
+        # transparently upgrade hashes created with deprecated settings
+        await asyncio.to_thread(_store_rehash, user.id, new_hash)
 
     token = create_access_token({"sub": user.name, "user_id": user.id})
     # Set httpOnly cookie for compatibility, but also return token in body
@@ -291,10 +494,14 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     user_id = payload.get("user_id")
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
+    # served from the principal cache on the hot path; only misses touch the DB
+    user = PRINCIPALS.get(user_id)
+    if user is not None:
+        return user
     user = find_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    return PRINCIPALS.set(user_id, user)
 
 @app.get("/me")
 def me(current_user: User = Depends(get_current_user)):
@@ -304,79 +511,95 @@ def me(current_user: User = Depends(get_current_user)):
 # ----------------------
 # AI helpers / endpoints
 # ----------------------
+def _summary_response(address: str, res_obj: dict) -> dict:
+    """Compact /ai/summary body (status line + indicator) from a status dict."""
+    status = (res_obj.get('status') or '').title() if res_obj.get('status') else 'Unknown'
+    sold_date = res_obj.get('sold_date')
+    confidence = res_obj.get('confidence')
+    summary = res_obj.get('summary') if isinstance(res_obj.get('summary'), str) else None
+
+    short = status
+    if sold_date:
+        short += f" on {sold_date}"
+    if confidence is not None:
+        try:
+            short += f" (confidence {float(confidence):.2f})"
+        except Exception:
+            pass
+    if summary:
+        short += f": {summary}"
+
+    indicator = None
+    if status.lower() == 'sold':
+        indicator = 'SOLD'
+    elif status.lower() == 'active':
+        indicator = 'ACTIVE'
+    elif status.lower() == 'pending':
+        indicator = 'PENDING'
+
+    return { 'address': address, 'status': status, 'sold_date': sold_date, 'confidence': confidence, 'summary': short, 'indicator': indicator }
+
+
 @app.get("/ai/summary")
 async def ai_summary(address: str, current_user: User = Depends(get_current_user)):
     """Return a short AI-generated summary for a single property address.
-    Uses `ai_services.get_property_update` and returns a compact summary and an indicator.
+    Uses `ai_services.get_property_update_async` and returns a compact summary and an indicator.
+
+    `age` is the seconds since the summary was produced and `stale` tells
+    whether it is past the soft TTL; stale summaries are still returned
+    immediately while one background refresh is queued.
     """
-    # Use a per-session cache key so each user's session has its own AI summary cache.
-    key = f"user:{current_user.id}|addr:{address.lower().strip()}"
-
-    # Return cached result if fresh
-    cached = AI_CACHE.get(key)
-    if cached:
-        res_obj, ts = cached
-        if (time.time() - ts) < AI_CACHE_TTL:
-            # normalize and return quickly
-            status = (res_obj.get('status') or '').title() if res_obj.get('status') else 'Unknown'
-            sold_date = res_obj.get('sold_date')
-            confidence = res_obj.get('confidence')
-            summary = res_obj.get('summary') if isinstance(res_obj.get('summary'), str) else None
-            short = status
-            if sold_date:
-                short += f" on {sold_date}"
-            if confidence is not None:
-                try:
-                    short += f" (confidence {float(confidence):.2f})"
-                except Exception:
-                    pass
-            if summary:
-                short += f": {summary}"
-            indicator = None
-            if status.lower() == 'sold':
-                indicator = 'SOLD'
-            elif status.lower() == 'active':
-                indicator = 'ACTIVE'
-            elif status.lower() == 'pending':
-                indicator = 'PENDING'
-            return { 'address': address, 'status': status, 'sold_date': sold_date, 'confidence': confidence, 'summary': short, 'indicator': indicator }
-
-    # Not cached or expired: attempt to fetch but don't block too long
+    # Serve from cache while within the hard TTL. The cache is keyed by
+    # normalized address and shared across users, so another tenant's lookup
+    # of the same listing counts.
+    hit = AI_CACHE.lookup(address)
+    if hit is not None:
+        res_obj, age, stale = hit
+        if stale and AI_CACHE.begin_revalidate(address):
+            # stale-while-revalidate: one deduplicated refresh through the job queue
+            await _refresh_ai_cache(address)
+        return { **_summary_response(address, res_obj), 'age': int(age), 'stale': stale }
+
+    # Not cached or past the hard TTL: start (or join) the single upstream fetch
+    # for this address but don't block too long. shield() keeps the fetch alive on timeout.
+    fetch_task = AI_CACHE.fetch(address, _fetch_property_update(address))
     try:
-        # Try calling the blocking helper in a thread with a short timeout
-        res = await asyncio.wait_for(asyncio.to_thread(get_property_update, address), timeout=6.0)
+        res = await asyncio.wait_for(asyncio.shield(fetch_task), timeout=6.0)
     except asyncio.TimeoutError:
-        # schedule a background refresh (scoped to this user) and return a low-confidence placeholder quickly
-        asyncio.create_task(_refresh_ai_cache(address, user_id=current_user.id))
-        return { 'address': address, 'status': 'Unknown', 'sold_date': None, 'confidence': 0.0, 'summary': 'AI summary pending (request timed out); refresh shortly', 'indicator': None }
+        # the shared fetch keeps running and fills the cache; return a low-confidence placeholder quickly
+        return { 'address': address, 'status': 'Unknown', 'sold_date': None, 'confidence': 0.0, 'summary': 'AI summary pending (request timed out); refresh shortly', 'indicator': None, 'age': None, 'stale': False }
     except Exception as e:
-        # schedule background refresh (scoped to this user) and return an error-like placeholder
-        asyncio.create_task(_refresh_ai_cache(address, user_id=current_user.id))
+        # schedule background refresh and return an error-like placeholder
+        await _refresh_ai_cache(address)
         raise HTTPException(status_code=502, detail=f"AI service error: {str(e)}")
 
     # If the helper indicates quota/rate-limit exhaustion, surface 429 with Retry-After
     if isinstance(res, dict) and res.get('quota_exceeded'):
-        # schedule a background refresh attempt for later (scoped to this user)
-        asyncio.create_task(_refresh_ai_cache(address, user_id=current_user.id))
+        # schedule a background refresh attempt for later
+        await _refresh_ai_cache(address)
         retry = res.get('retry_after_seconds') or 60
         raise HTTPException(status_code=429, detail=res.get('error') or 'Quota exceeded', headers={"Retry-After": str(int(retry))})
 
     if isinstance(res, dict) and res.get('error'):
-        # If helper returned an error dict, schedule a refresh (scoped to this user) and surface helpful message
-        asyncio.create_task(_refresh_ai_cache(address, user_id=current_user.id))
+        # If helper returned an error dict, schedule a refresh and surface helpful message
+        await _refresh_ai_cache(address)
         raise HTTPException(status_code=502, detail=f"AI service error: {res.get('error')}")
 
     if not isinstance(res, dict):
         raise HTTPException(status_code=500, detail="AI returned unexpected response")
 
-    # store in session-scoped cache
-    AI_CACHE[key] = (res, time.time())
+    return { **_summary_response(address, res), 'age': 0, 'stale': False }
+
+
+# Longest a ?wait=true /ai/sync request blocks before returning partial results
+AI_SYNC_WAIT_SECONDS = float(os.getenv('AI_SYNC_WAIT_SECONDS', '120'))
 
-    status = (res.get('status') or '').title() if res.get('status') else 'Unknown'
-    sold_date = res.get('sold_date')
-    confidence = res.get('confidence')
-    summary = res.get('summary') if isinstance(res.get('summary'), str) else None
 
+def _format_sync_entry(addr: str, res_obj):
+    """Compact /ai/sync entry for one property from a status dict."""
+    status = (res_obj.get('status') or '').title() if res_obj and isinstance(res_obj, dict) else 'Unknown'
+    sold_date = res_obj.get('sold_date') if isinstance(res_obj, dict) else None
+    confidence = res_obj.get('confidence') if isinstance(res_obj, dict) else None
     short = status
     if sold_date:
         short += f" on {sold_date}"
@@ -385,8 +608,6 @@ async def ai_summary(address: str, current_user: User = Depends(get_current_user
             short += f" (confidence {float(confidence):.2f})"
         except Exception:
             pass
-    if summary:
-        short += f": {summary}"
 
     indicator = None
     if status.lower() == 'sold':
@@ -396,95 +617,265 @@ async def ai_summary(address: str, current_user: User = Depends(get_current_user
     elif status.lower() == 'pending':
         indicator = 'PENDING'
 
-    return { 'address': address, 'status': status, 'sold_date': sold_date, 'confidence': confidence, 'summary': short, 'indicator': indicator }
+    return {
+        'address': addr,
+        'status': status,
+        'sold_date': sold_date,
+        'confidence': confidence,
+        'summary': short,
+        'indicator': indicator
+    }
+
+
+def _job_results(db: Session, job_id: int):
+    """({key: summary entry}, {key: error}) for the finished tasks of a job.
+
+    Keys are property ids (or the address for cache-refresh jobs).
+    """
+    results, errors = {}, {}
+    for t in job_tasks(db, job_id):
+        key = t['property_id'] if t['property_id'] is not None else t['address']
+        if t['status'] == 'done':
+            results[key] = _format_sync_entry(t['address'], t['result'])
+        else:
+            errors[key] = t['error'] or 'failed'
+    return results, errors
+
+
+def _sync_targets(db: Session, payload: dict | None, current_user):
+    """(rows of (id, address), refresh flag) for an /ai/sync request body."""
+    # Select properties scoped to the current user's company for SaaS safety
+    q = select(Property.id, Property.address)
+    if current_user and getattr(current_user, 'company', None):
+        q = q.where(Property.company == current_user.company)
+
+    # If payload requests specific ids, filter
+    ids = None
+    refresh = False
+    if payload and isinstance(payload, dict):
+        ids = payload.get('property_ids')
+        refresh = bool(payload.get('refresh'))
+    if ids:
+        q = q.where(Property.id.in_(ids))
+    return db.execute(q).all(), refresh
+
+
+def _load_job(db: Session, job_id: int, current_user):
+    job = db.get(AISyncJob, job_id)
+    if job is None or not job_visible(job, getattr(current_user, 'company', None), getattr(current_user, 'id', None)):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# The async /ai/sync handlers run their DB steps in a worker thread, each
+# with its own short-lived session (like _poll_job below), so neither the
+# enqueue nor a ?wait=true poll blocks the event loop.
+def _enqueue_sync(payload: dict | None, current_user, skip_cached: bool = False):
+    """Select the targets of an /ai/sync body and queue a job for them.
+
+    Returns (props, cached, job progress or None). With skip_cached, fresh
+    AI cache hits go into `cached` as (id, entry) instead of the job, and no
+    job is queued when everything was cached.
+    """
+    db = SessionLocal()
+    try:
+        props, refresh = _sync_targets(db, payload, current_user)
+        cached, todo = [], []
+        for p in props:
+            hit = AI_CACHE.get(p.address) if (skip_cached and p.address and not refresh) else None
+            if hit is not None:
+                cached.append((p.id, _format_sync_entry(p.address, hit)))
+            else:
+                todo.append((p.id, p.address))
+        if skip_cached and not todo:
+            return props, cached, None
+        job = enqueue_sync_job(db, todo, getattr(current_user, 'company', None),
+                               getattr(current_user, 'id', None), refresh=refresh)
+        return props, cached, job_progress(job)
+    finally:
+        db.close()
+
+
+def _check_job(job_id: int, current_user) -> str:
+    """Status of a job the user may see (404 otherwise)."""
+    db = SessionLocal()
+    try:
+        return _load_job(db, job_id, current_user).status
+    finally:
+        db.close()
+
+
+def _read_job_results(job_id: int):
+    db = SessionLocal()
+    try:
+        return _job_results(db, job_id)
+    finally:
+        db.close()
 
 
 @app.post("/ai/sync")
-async def ai_sync_properties(payload: dict | None = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Sync AI summaries for properties belonging to the current user's company.
-    Optional JSON body: { "property_ids": [1,2,3] } to limit to specific properties.
-    Returns a mapping of property_id -> ai summary object.
+async def ai_sync_properties(response: Response, payload: dict | None = None, wait: bool = False,
+                             current_user: User = Depends(get_current_user)):
+    """Queue an AI summary sync for properties belonging to the current user's company.
+    Optional JSON body: { "property_ids": [1,2,3] } to limit to specific properties,
+    and "refresh": true to re-run the live search even for cached summaries
+    (the LLM is only called again when the search content changed).
+
+    Returns 202 with the job id and progress right away; follow it with
+    GET /ai/sync/jobs/{id} or the SSE stream at /ai/sync/jobs/{id}/events.
+    With ?wait=true the request blocks (up to AI_SYNC_WAIT_SECONDS) and returns
+    the legacy mapping of property_id -> ai summary object; the job keeps
+    running in the worker if the client goes away.
     """
+    props, _, progress = await asyncio.to_thread(_enqueue_sync, payload, current_user)
+    job_id = progress['job_id']
+    if AI_WORKER is not None:
+        AI_WORKER.wake()
+
+    if not wait:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            **progress,
+            'status_url': f"/ai/sync/jobs/{job_id}",
+            'events_url': f"/ai/sync/jobs/{job_id}/events",
+        }
+
+    deadline = time.monotonic() + AI_SYNC_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        if await asyncio.to_thread(_check_job, job_id, current_user) == 'done':
+            break
+        await asyncio.sleep(0.5)
+    results, errors = await asyncio.to_thread(_read_job_results, job_id)
+    out = dict(results)
+    for key, err in errors.items():
+        out[key] = { 'error': err }
+    for p in props:
+        if p.id not in out:
+            out[p.id] = { 'address': p.address, 'pending': True, 'job_id': job_id }
+    return out
+
+
+@app.get("/ai/sync/jobs/{job_id}")
+def ai_sync_job(job_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Progress of a sync job plus the summaries (and errors) finished so far."""
+    job = _load_job(db, job_id, current_user)
+    results, errors = _job_results(db, job_id)
+    return {**job_progress(job), 'results': results, 'errors': errors}
+
+
+def _stream_event(fmt: str, event: str, data: dict) -> str:
+    if fmt == 'ndjson':
+        return json.dumps({'event': event, **data}, default=str) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _poll_job(job_id: int, seen=None):
+    """Job progress plus its finished tasks not in `seen` (own session; runs in a thread)."""
+    s = SessionLocal()
     try:
-        # Select properties scoped to the current user's company for SaaS safety
-        q = db.query(Property)
-        if current_user and getattr(current_user, 'company', None):
-            q = q.filter(Property.company == current_user.company)
-
-        # If payload requests specific ids, filter
-        ids = None
-        if payload and isinstance(payload, dict):
-            ids = payload.get('property_ids')
-        if ids:
-            q = q.filter(Property.id.in_(ids))
-
-        props = q.all()
-    except ProgrammingError:
-        db.rollback()
-        # Fallback: textual select
-        rows = db.execute(text("SELECT id, address FROM properties")).mappings().all()
-        props = [ SimpleNamespace(**r) for r in rows ]
-
-    results = {}
-
-    # Limit concurrency to avoid exhausting provider connections
-    semaphore = asyncio.Semaphore(int(os.getenv('AI_SYNC_CONCURRENCY', '6')))
-
-    async def fetch_and_format(p):
-        addr = getattr(p, 'address', None)
-        if not addr:
-            return (getattr(p, 'id', addr), { 'error': 'No address' })
-        # Use per-session cache key so results are scoped to the requesting user
-        key = f"user:{current_user.id}|addr:{addr.lower().strip()}"
-
-        async with semaphore:
-            try:
-                # Prefer cached value if recent (session-scoped)
-                cached = AI_CACHE.get(key)
-                if cached and (time.time() - cached[1]) < AI_CACHE_TTL:
-                    res_obj = cached[0]
-                else:
-                    res_obj = await asyncio.to_thread(get_property_update, addr)
-                    if isinstance(res_obj, dict) and not res_obj.get('error'):
-                        AI_CACHE[key] = (res_obj, time.time())
-            except Exception as e:
-                return (getattr(p, 'id', addr), { 'error': str(e) })
-
-        status = (res_obj.get('status') or '').title() if res_obj and isinstance(res_obj, dict) else 'Unknown'
-        sold_date = res_obj.get('sold_date') if isinstance(res_obj, dict) else None
-        confidence = res_obj.get('confidence') if isinstance(res_obj, dict) else None
-        short = status
-        if sold_date:
-            short += f" on {sold_date}"
-        if confidence is not None:
-            try:
-                short += f" (confidence {float(confidence):.2f})"
-            except Exception:
-                pass
-
-        indicator = None
-        if status.lower() == 'sold':
-            indicator = 'SOLD'
-        elif status.lower() == 'active':
-            indicator = 'ACTIVE'
-        elif status.lower() == 'pending':
-            indicator = 'PENDING'
-
-        return (getattr(p, 'id', addr), {
-            'address': addr,
-            'status': status,
-            'sold_date': sold_date,
-            'confidence': confidence,
-            'summary': short,
-            'indicator': indicator
-        })
+        job = s.get(AISyncJob, job_id)
+        if seen is None:
+            return job_progress(job), []
+        return job_progress(job), job_tasks(s, job_id, exclude=seen)
+    finally:
+        s.close()
+
+
+async def _job_events(job_id: int):
+    """Yield ('result', data) per finished task of a job as it completes, plus
+    ('progress', data) when the counters change; returns when the job is done."""
+    seen, last = set(), None
+    while True:
+        progress, tasks = await asyncio.to_thread(_poll_job, job_id, set(seen))
+        for t in tasks:
+            seen.add(t['id'])
+            key = t['property_id'] if t['property_id'] is not None else t['address']
+            if t['status'] == 'done':
+                yield 'result', {'property_id': key, 'cached': False, **_format_sync_entry(t['address'], t['result'])}
+            else:
+                yield 'result', {'property_id': key, 'cached': False, 'address': t['address'],
+                                 'error': t['error'] or 'failed'}
+        counters = (progress['status'], progress['completed'], progress['failed'])
+        if counters != last:
+            last = counters
+            yield 'progress', progress
+        if progress['status'] == 'done':
+            return
+        # the in-process worker signals as soon as it records a chunk
+        if AI_WORKER is not None:
+            await AI_WORKER.wait_for_progress(timeout=1.0)
+        else:
+            await asyncio.sleep(0.5)
+
 
-    tasks = [ fetch_and_format(p) for p in props ]
-    done = await asyncio.gather(*tasks)
-    for k, v in done:
-        results[k] = v
+def _stream_format(format: str | None, request: Request) -> str:
+    if format in ('sse', 'ndjson'):
+        return format
+    return 'ndjson' if 'application/x-ndjson' in request.headers.get('accept', '') else 'sse'
 
-    return results
+
+@app.get("/ai/sync/jobs/{job_id}/events")
+async def ai_sync_job_events(job_id: int, request: Request, format: str | None = None,
+                             current_user: User = Depends(get_current_user)):
+    """Stream a sync job (SSE by default, NDJSON with ?format=ndjson): one
+    `result` event per property as it completes, `progress` events, and a
+    final `done` event with the counters."""
+    fmt = _stream_format(format, request)
+    await asyncio.to_thread(_check_job, job_id, current_user)
+
+    async def events():
+        async for event, data in _job_events(job_id):
+            yield _stream_event(fmt, event, data)
+        progress, _ = await asyncio.to_thread(_poll_job, job_id)
+        yield _stream_event(fmt, 'done', progress)
+
+    media = "application/x-ndjson" if fmt == 'ndjson' else "text/event-stream"
+    return StreamingResponse(events(), media_type=media, headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/ai/sync/stream")
+async def ai_sync_stream(request: Request, payload: dict | None = None, format: str | None = None,
+                         current_user: User = Depends(get_current_user)):
+    """Streaming /ai/sync: same body, results arrive as each property completes.
+
+    Cached summaries are emitted immediately as `result` events with
+    "cached": true; the remaining properties are queued as a background job
+    (so the work survives a disconnect) and streamed as the worker finishes
+    them, followed by one `summary` event with counts and timings. SSE by
+    default; NDJSON with ?format=ndjson or Accept: application/x-ndjson.
+    """
+    fmt = _stream_format(format, request)
+    started = time.perf_counter()
+    props, cached, progress = await asyncio.to_thread(_enqueue_sync, payload, current_user, True)
+    job_id = progress['job_id'] if progress else None
+    if job_id is not None and AI_WORKER is not None:
+        AI_WORKER.wake()
+
+    async def events():
+        first_result_ms = None
+        counts = {'cached': 0, 'fetched': 0, 'errors': 0}
+        for pid, entry in cached:
+            if first_result_ms is None:
+                first_result_ms = (time.perf_counter() - started) * 1000.0
+            counts['cached'] += 1
+            yield _stream_event(fmt, 'result', {'property_id': pid, 'cached': True, **entry})
+        if job_id is not None:
+            async for event, data in _job_events(job_id):
+                if event == 'result':
+                    counts['errors' if 'error' in data else 'fetched'] += 1
+                    if first_result_ms is None:
+                        first_result_ms = (time.perf_counter() - started) * 1000.0
+                yield _stream_event(fmt, event, data)
+        yield _stream_event(fmt, 'summary', {
+            'job_id': job_id,
+            'total': len(props),
+            **counts,
+            'time_to_first_result_ms': round(first_result_ms, 1) if first_result_ms is not None else None,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 1),
+        })
+
+    media = "application/x-ndjson" if fmt == 'ndjson' else "text/event-stream"
+    return StreamingResponse(events(), media_type=media, headers={"Cache-Control": "no-cache"})
 
 
 @app.get("/ai/models")
@@ -493,15 +884,118 @@ def ai_models(current_user: User = Depends(get_current_user)):
     This helps pick an alternative when you hit quota or Model NotFound errors.
     """
     # Groq-only diagnostics: list whether Groq is enabled and which model is configured
-    return {"groq_enabled": bool(GROQ_CLIENT), "groq_model": GROQ_MODEL if GROQ_CLIENT else None}
+    return {"groq_enabled": GROQ_ENABLED, "groq_model": GROQ_MODEL if GROQ_ENABLED else None}
+
+
+@app.get("/debug/schema")
+def debug_schema(current_user: User = Depends(get_current_user)):
+    """Developer helper: tables/columns the startup schema probe found missing."""
+    return SCHEMA.snapshot()
+
+
+@app.post("/debug/schema/refresh")
+def debug_schema_refresh(current_user: User = Depends(get_current_user)):
+    """Re-run the schema probe, e.g. after migrations were applied out-of-band."""
+    SCHEMA.refresh()
+    SEARCH.detect()
+    return SCHEMA.snapshot()
+
+
+@app.get("/debug/query_plans")
+def debug_query_plans(current_user: User = Depends(get_current_user)):
+    """Developer helper: EXPLAIN the queries behind the main endpoints for the
+    current user's company and report whether each one uses an index."""
+    return explain_endpoint_queries(getattr(current_user, 'company', None))
+
+
+@app.get("/ai/cache/stats")
+def ai_cache_stats(current_user: User = Depends(get_current_user)):
+    """Return hit/miss/eviction counters for the shared AI summary cache and
+    per-stage (search / classify) hit rates and upstream latencies."""
+    return {**AI_CACHE.stats(), 'stages': pipeline_stats(), 'worker': dict(AI_WORKER.stats) if AI_WORKER else None,
+            'refresh_ahead': dict(AI_REFRESH_AHEAD_TASK.stats) if AI_REFRESH_AHEAD_TASK else None,
+            'ask': {'intents': dict(ASK_ROUTER.stats), 'context': AI_CONTEXT.stats(), 'index': INTENT_INDEX.stats()}}
+
+
+@app.get("/debug/ledger")
+def debug_ledger(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Developer helper: payment ledger size, unfolded events and compactor counters."""
+    return {**payment_ledger.ledger_stats(db), 'compactor': dict(LEDGER_COMPACTOR.stats)}
+
+
+def _load_ai_context(db: Session, company: str | None) -> ContextSnapshot:
+    """Materialize the /ai/ask snapshot for a company scope.
+
+    One statement per piece; the schema probe fills columns an older DB lacks.
+    Lists are read one row past their size to learn whether they are complete.
+    """
+    prop_filters = listing_filters(company)
+    total_properties = int(db.execute(build_count_query(prop_filters)).scalar() or 0)
+    # join the photographer so we can report who shot each property
+    rows = db.execute(build_listing_query(prop_filters, ['address', 'status', 'price'], True, descending=True,
+                                          limit=AI_CONTEXT_SAMPLE_PROPERTIES)).mappings().all()
+    sample_props = [
+        {'id': r['id'], 'address': r['address'], 'status': r['status'], 'price': r['price'],
+         'photographer_id': r['photographer__id'], 'photographer_name': r['photographer__name']}
+        for r in rows[:AI_CONTEXT_SAMPLE_PROPERTIES]
+    ]
+
+    agents_q = SCHEMA.select(Agent, ['id', 'name', 'email', 'phone'])
+    if company is not None:
+        agents_q = agents_q.where(Agent.company == company)
+    agents = [dict(r) for r in db.execute(agents_q.order_by(Agent.id).limit(AI_CONTEXT_CONTACTS + 1)).mappings().all()]
+
+    # also gather photographers so the assistant has access to photographer contacts
+    photog_q = SCHEMA.select(Photographer, ['id', 'name', 'email', 'phone'])
+    if company is not None:
+        photog_q = photog_q.where(Photographer.company == company)
+    photographers = [dict(r) for r in db.execute(photog_q.order_by(Photographer.id).limit(AI_CONTEXT_CONTACTS + 1)).mappings().all()]
+
+    # recent daily rollups, and the all-time income from the coarsest rollup, each
+    # plus the payment events not compacted yet (see payment_ledger.py)
+    stats_rows = rollup_series(db, company, 'day', limit=AI_CONTEXT_STAT_ROWS, newest_first=True)
+    total_income = rollup_totals(db, company)[1]
+
+    return ContextSnapshot(
+        total_properties, sample_props, agents, photographers, stats_rows, total_income,
+        agents_complete=len(agents) <= AI_CONTEXT_CONTACTS,
+        photographers_complete=len(photographers) <= AI_CONTEXT_CONTACTS,
+    )
+
+
+def _load_intent_index(db: Session, company: str | None) -> CompanyIndex:
+    """Materialize the /ai/ask name index (contacts and property addresses) for a company scope."""
+    def rows(model, fields):
+        q = SCHEMA.select(model, fields)
+        if company is not None:
+            q = q.where(model.company == company)
+        return [dict(r) for r in db.execute(q).mappings().all()]
+
+    return CompanyIndex(
+        rows(Agent, ['id', 'name', 'email', 'phone']),
+        rows(Photographer, ['id', 'name', 'email', 'phone']),
+        rows(User, ['id', 'name', 'email']),
+        rows(Property, ['id', 'address', 'agent', 'photographer_id']),
+    )
+
+
+def _ask_snapshots(company: str | None) -> tuple[CompanyIndex, ContextSnapshot]:
+    """The company's intent index and context snapshot, loading whichever
+    expired (own session; runs in a thread: a miss scans the company's rows)."""
+    db = SessionLocal()
+    try:
+        return (INTENT_INDEX.get(company, lambda c: _load_intent_index(db, c)),
+                AI_CONTEXT.get(company, lambda c: _load_ai_context(db, c)))
+    finally:
+        db.close()
 
 
 @app.post("/ai/ask")
-async def ai_ask(payload: dict, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def ai_ask(payload: dict, current_user: User = Depends(get_current_user)):
     """General question-answer endpoint that can consult the database and use Groq to answer free-text questions.
 
     Request body: { "question": "..." }
-    Response: { "answer": "..." }
+    Response: { "answer": "..." } (plus "intent" when a local fast path answered)
     """
     question = None
     if payload and isinstance(payload, dict):
@@ -509,237 +1003,39 @@ async def ai_ask(payload: dict, current_user: User = Depends(get_current_user),
     if not question:
         raise HTTPException(status_code=400, detail="Missing 'question' in request body")
 
-    # Quick person lookup: if the user asked about a specific person, try to answer directly from DB
-    try:
-        import re
-        m = re.search(r"who is\s+([\w\s'.-]+)\??", question, re.IGNORECASE)
-        name_query = None
-        if m:
-            name_query = m.group(1).strip()
-        else:
-            # also handle 'tell me about NAME' pattern
-            m2 = re.search(r"tell me about\s+([\w\s'.-]+)\??", question, re.IGNORECASE)
-            if m2:
-                name_query = m2.group(1).strip()
-
-        if name_query:
-            # search agents table first
-            try:
-                row = db.execute(text("SELECT id, name, email, phone FROM agents WHERE lower(name) LIKE :q LIMIT 1"), {"q": f"%{name_query.lower()}%"}).mappings().first()
-                if row:
-                    a = SimpleNamespace(**row)
-                    # count properties for this agent if possible
-                    try:
-                        cnt = db.query(Property).filter((Property.agent == a.name) | (Property.agent_id == a.id)).count()
-                    except Exception:
-                        db.rollback()
-                        cnt_row = db.execute(text("SELECT count(*) as c FROM properties WHERE lower(agent) LIKE :q OR agent_id = :id"), {"q": f"%{name_query.lower()}%", "id": a.id}).mappings().first()
-                        cnt = int(cnt_row['c']) if cnt_row else 0
-                    return { 'answer': f"Agent {a.name}: email {a.email or 'unknown'}, phone {a.phone or 'unknown'}. Associated properties: {cnt}." }
-            except Exception:
-                db.rollback()
-
-            # also check photographers
-            try:
-                row = db.execute(text("SELECT id, name, email, phone FROM photographers WHERE lower(name) LIKE :q LIMIT 1"), {"q": f"%{name_query.lower()}%"}).mappings().first()
-                if row:
-                    p = SimpleNamespace(**row)
-                    return { 'answer': f"Photographer {p.name}: email {p.email or 'unknown'}, phone {p.phone or 'unknown'}." }
-            except Exception:
-                db.rollback()
-
-            # fallback: search users table
-            try:
-                row = db.execute(text("SELECT id, name, email FROM users WHERE lower(name) LIKE :q LIMIT 1"), {"q": f"%{name_query.lower()}%"}).mappings().first()
-                if row:
-                    u = SimpleNamespace(**row)
-                    return { 'answer': f"User {u.name}: email {u.email or 'unknown'}." }
-            except Exception:
-                db.rollback()
-        # continue to normal handling if no person found
-    except Exception:
-        # don't block assistant if lookup fails
-        try:
-            db.rollback()
-        except Exception:
-            pass
-
-    # Quick property -> photographer lookup: handle questions like
-    # "Who photographed 123 Main St?" or "Who shot 45 Elm Ave?"
-    try:
-        import re as _re
-        m_addr = _re.search(r"who\s+(?:shot|photographed|took(?: the)? photos (?:for|of)|took photos of)\s+(.+?)\??$", question, _re.IGNORECASE)
-        if m_addr:
-            addr_q = m_addr.group(1).strip()
-            try:
-                row = db.execute(text(
-                    "SELECT properties.address as address, p.id as photographer_id, p.name as photographer_name, p.email as photographer_email, p.phone as photographer_phone "
-                    "FROM properties LEFT JOIN photographers p ON properties.photographer_id = p.id "
-                    "WHERE lower(properties.address) LIKE :q LIMIT 1"
-                ), {"q": f"%{addr_q.lower()}%"}).mappings().first()
-                if row:
-                    pr = SimpleNamespace(**row)
-                    if pr.photographer_name:
-                        return { 'answer': f"Photographer {pr.photographer_name} photographed {pr.address}: email {pr.photographer_email or 'unknown'}, phone {pr.photographer_phone or 'unknown'}." }
-                    else:
-                        return { 'answer': f"No photographer is assigned to {pr.address}." }
-            except Exception:
-                try:
-                    db.rollback()
-                except Exception:
-                    pass
-    except Exception:
-        try:
-            db.rollback()
-        except Exception:
-            pass
-
-    # gather a small, privacy-minded snapshot of the database scoped to the user's company
-    try:
-        props_q = db.query(Property)
-        if current_user and getattr(current_user, 'company', None):
-            props_q = props_q.filter(Property.company == current_user.company)
-        total_properties = props_q.count()
-        # eager-load photographer relationship when available so we can report who shot each property
-        sample_props = props_q.options().order_by(Property.id.desc()).limit(10).all()
-    except ProgrammingError:
-        db.rollback()
-        # fallback textual queries; include joined photographer fields when possible
-        total_row = db.execute(text("SELECT count(*) as c FROM properties")).mappings().first()
-        total_properties = int(total_row['c']) if total_row else 0
-        rows = db.execute(text(
-            "SELECT properties.id, properties.address, properties.status, properties.price, properties.photographer_id, "
-            "p.name as photographer_name, p.email as photographer_email, p.phone as photographer_phone "
-            "FROM properties LEFT JOIN photographers p ON properties.photographer_id = p.id "
-            "ORDER BY properties.id DESC LIMIT 10"
-        )).mappings().all()
-        sample_props = [ SimpleNamespace(**r) for r in rows ]
-
-    try:
-        agents_q = db.query(Agent)
-        if current_user and getattr(current_user, 'company', None):
-            agents_q = agents_q.filter(Agent.company == current_user.company)
-        agents = agents_q.limit(20).all()
-    except ProgrammingError:
-        db.rollback()
-        rows = db.execute(text("SELECT id, name, email, phone FROM agents LIMIT 20")).mappings().all()
-        agents = [ SimpleNamespace(**r) for r in rows ]
-
-    # also gather photographers so the assistant has access to photographer contacts
-    try:
-        photog_q = db.query(Photographer)
-        if current_user and getattr(current_user, 'company', None):
-            photog_q = photog_q.filter(Photographer.company == current_user.company)
-        photographers = photog_q.limit(20).all()
-    except ProgrammingError:
-        db.rollback()
-        rows = db.execute(text("SELECT id, name, email, phone FROM photographers LIMIT 20")).mappings().all()
-        photographers = [ SimpleNamespace(**r) for r in rows ]
-
-    # Gather recent statistics (last N rows) and simple aggregates
-    stats_rows = []
-    total_shoots = 0
-    # total_income should be calculated from all logged statistics rows (not just the recent snapshot)
-    total_income = 0.0
-    avg_shoots_per_row = 0.0
-    try:
-        stats_q = db.query(Statistic).order_by(Statistic.date.desc())
-        # scope stats to current user's company when present
-        company = getattr(current_user, 'company', None)
-        if company is not None:
-            stats_q = stats_q.filter(Statistic.company == company)
-        stats_q = stats_q.limit(90)
-        stats_rows = stats_q.all()
-        total_shoots = sum(int(getattr(s, 'shoots_count', 0) or 0) for s in stats_rows)
-        # compute total income across all statistics rows in the DB, scoped to company when applicable
-        total_query = db.query(func.coalesce(func.sum(Statistic.income_total), 0.0))
-        if company is not None:
-            total_query = total_query.filter(Statistic.company == company)
-        total_income_all = total_query.scalar() or 0.0
-        total_income = float(total_income_all)
-        avg_shoots_per_row = (total_shoots / len(stats_rows)) if stats_rows else 0.0
-    except ProgrammingError:
-        db.rollback()
-        # textual fallback: include company filter when available
-        if company is not None:
-            rows = db.execute(text("SELECT date, shoots_count, income_total FROM statistics WHERE company = :company ORDER BY date DESC LIMIT 90"), {"company": company}).mappings().all()
-        else:
-            rows = db.execute(text("SELECT date, shoots_count, income_total FROM statistics ORDER BY date DESC LIMIT 90")).mappings().all()
-        stats_rows = [ SimpleNamespace(**r) for r in rows ]
-        total_shoots = sum(int(r.get('shoots_count') or 0) for r in rows)
-        # fallback: compute total income using textual SQL (scoped to company when possible)
-        if company is not None:
-            total_row = db.execute(text("SELECT COALESCE(SUM(income_total),0) as total FROM statistics WHERE company = :company"), {"company": company}).mappings().first()
-        else:
-            total_row = db.execute(text("SELECT COALESCE(SUM(income_total),0) as total FROM statistics")).mappings().first()
-        total_income = float(total_row['total']) if total_row else 0.0
-        avg_shoots_per_row = (total_shoots / len(rows)) if rows else 0.0
-
-    # build a concise context string for the model
-    ctx_lines = []
-    ctx_lines.append(f"Total properties in scope: {total_properties}")
-    if sample_props:
-        ctx_lines.append("Sample properties (most recent):")
-        for p in sample_props:
-            addr = getattr(p, 'address', None) or getattr(p, 'addr', None) or '—'
-            st = getattr(p, 'status', None) or 'Unknown'
-            pr = getattr(p, 'price', None)
-            pr_s = f"${float(pr):,.2f}" if pr is not None and str(pr) != 'None' else '—'
-            # photographer info: prefer ORM relationship, fall back to joined fields
-            phot = None
-            try:
-                phot_obj = getattr(p, 'photographer', None)
-                if phot_obj and getattr(phot_obj, 'name', None):
-                    phot = getattr(phot_obj, 'name')
-            except Exception:
-                phot = None
-            if not phot:
-                phot = getattr(p, 'photographer_name', None) or getattr(p, 'photographer', None) or '—'
-            ctx_lines.append(f"- {addr} | status: {st} | price: {pr_s} | photographer: {phot}")
-    if agents:
-        ctx_lines.append("Agents (name — email — phone):")
-        for a in agents[:20]:
-            name = getattr(a, 'name', getattr(a, 'agent', None)) or '—'
-            email = getattr(a, 'email', None) or '—'
-            phone = getattr(a, 'phone', None) or '—'
-            ctx_lines.append(f"- {name} — {email} — {phone}")
-
-    # include photographers in the prompt context so Groq can answer photographer questions
-    if 'photographers' in locals() and photographers:
-        ctx_lines.append("Photographers (name — email — phone):")
-        for p in photographers[:20]:
-            pname = getattr(p, 'name', None) or '—'
-            pemail = getattr(p, 'email', None) or '—'
-            pphone = getattr(p, 'phone', None) or '—'
-            ctx_lines.append(f"- {pname} — {pemail} — {pphone}")
-
-    # include simple stats summary for model context
-    if stats_rows:
-        ctx_lines.append("Statistics (recent):")
-        ctx_lines.append(f"- total_shoots: {total_shoots}")
-        ctx_lines.append(f"- total_income: ${total_income:,.2f}")
-        ctx_lines.append(f"- avg_shoots_per_period: {avg_shoots_per_row:.2f}")
-
-    context_text = "\n".join(ctx_lines)
+    # local fast paths (person / photographer lookups, counts, stats) answered
+    # from the in-memory company index and snapshot; a snapshot that needs
+    # (re)loading is read off the event loop
+    company = getattr(current_user, 'company', None)
+    index, snapshot = await asyncio.to_thread(_ask_snapshots, company)
+    ask_ctx = AskContext(company, index, snapshot)
+    routed = ASK_ROUTER.dispatch(question, ask_ctx)
+    if routed is not None:
+        return routed
+
+    # per-company snapshot, materialized once and patched on writes (see ai_context.py)
+    ctx = ask_ctx.snapshot
+    context_text = ctx.context_text
+    total_properties, total_income = ctx.total_properties, ctx.total_income
+    total_shoots, avg_shoots_per_day = ctx.total_shoots, ctx.avg_shoots_per_day
 
     # If Groq not configured, return a simple database-aware answer locally
-    if not GROQ_CLIENT:
+    if not GROQ_ENABLED:
         # Simple heuristics for common questions
         qlow = question.lower()
         # quick stats answers
         if 'shoot' in qlow or 'income' in qlow or 'stat' in qlow or 'average' in qlow:
-            return { 'answer': f"Recent stats: total_shoots={total_shoots}, total_income=${total_income:,.2f}, avg_shoots_per_period={avg_shoots_per_row:.2f}" }
+            return { 'answer': f"Recent stats: total_shoots={total_shoots}, total_income=${total_income:,.2f}, avg_shoots_per_day={avg_shoots_per_day:.2f}" }
         if 'how many' in qlow or 'total' in qlow or 'count' in qlow:
             return { 'answer': f"There are {total_properties} properties in your scoped dataset." }
         # try to match agent by name
-        for a in agents:
-            if a and getattr(a, 'name', '') and getattr(a, 'name', '').lower() in qlow:
-                return { 'answer': f"Agent {a.name}: email {getattr(a,'email', 'unknown')}, phone {getattr(a,'phone','unknown')}" }
+        for a in ctx.agents:
+            if a.get('name') and a['name'].lower() in qlow:
+                return { 'answer': f"Agent {a['name']}: email {a.get('email')}, phone {a.get('phone')}" }
         # try to match photographer by name as well
-        if 'photographers' in locals():
-            for p in photographers:
-                if p and getattr(p, 'name', '') and getattr(p, 'name', '').lower() in qlow:
-                    return { 'answer': f"Photographer {p.name}: email {getattr(p,'email', 'unknown')}, phone {getattr(p,'phone','unknown')}" }
+        for p in ctx.photographers:
+            if p.get('name') and p['name'].lower() in qlow:
+                return { 'answer': f"Photographer {p['name']}: email {p.get('email')}, phone {p.get('phone')}" }
         return { 'answer': f"Groq not configured. Context snapshot:\n{context_text}\n\nQuestion: {question}\n\nI couldn't run the LLM but here's the context for debugging." }
 
     # Build prompt for Groq
@@ -751,15 +1047,17 @@ async def ai_ask(payload: dict, current_user: User = Depends(get_current_user),
     user_msg = f"Database snapshot:\n{context_text}\n\nQuestion: {question}\nAnswer:" 
 
     try:
-        chat_completion = GROQ_CLIENT.chat.completions.create(
-            messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
+        content = await GROQ.chat(
+            [{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
             model=GROQ_MODEL,
         )
-        try:
-            content = chat_completion.choices[0].message.content
-        except Exception:
-            content = getattr(chat_completion, 'text', None) or str(chat_completion)
         return { 'answer': content }
+    except ProviderError as e:
+        if e.quota_exceeded:
+            # the governor could not admit the call (or Groq returned 429)
+            retry = int(math.ceil(e.retry_after or 1))
+            raise HTTPException(status_code=429, detail='AI quota exceeded, retry shortly', headers={"Retry-After": str(retry)})
+        return { 'error': str(e), 'context': context_text }
     except Exception as e:
         # fallback: return context and error
         return { 'error': str(e), 'context': context_text }
@@ -776,44 +1074,117 @@ class StatisticCreate(BaseModel):
 @app.post("/stats", status_code=201)
 def create_stat(s: StatisticCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # protected endpoint to record daily stats. Date is optional (YYYY-MM-DD string).
+    # The counts are appended to the payment ledger as a manual event (see
+    # payment_ledger.py); the response is the day's resulting totals.
+    if s.date:
+        try:
+            d = date.fromisoformat(s.date)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
+    else:
+        d = datetime.utcnow().date()
+    company = getattr(current_user, 'company', None)
     try:
-        if s.date:
-            try:
-                d = date.fromisoformat(s.date)
-            except Exception:
-                raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
-        else:
-            d = datetime.utcnow().date()
-
-        stat = Statistic(date=d, shoots_count=int(s.shoots_count), income_total=float(s.income_total), company=getattr(current_user, 'company', None))
-        db.add(stat)
+        shoots, income = int(s.shoots_count), float(s.income_total)
+        payment_ledger.append(db, 'manual', company, d, shoots, income)
+        record_change(db, {'kind': 'rollup', 'op': 'increment', 'company': company,
+                           'row': {'date': d, 'shoots_count': shoots, 'income_total': income}})
         db.commit()
-        db.refresh(stat)
-        return stat
+        day = rollup_series(db, company, 'day', since=d, limit=1)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    return {**day[0], 'company': company}
 
 
 @app.get("/stats/summary")
-def stats_summary(days: int = 30, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # return timeseries of daily stats for the last `days` days (inclusive).
-    # Fallback to textual select when the `statistics` table doesn't exist yet during rollouts.
+def stats_summary(days: int = 30, period: str = 'day', current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # return the timeseries of the last `days` days (inclusive), one row per day,
+    # week or month that has activity, read from the precomputed rollups plus
+    # the payment events not compacted into them yet.
+    # Returns an empty series when the rollup table doesn't exist yet during rollouts.
+    try:
+        period = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not SCHEMA.has_table(StatRollup.__tablename__):
+        return []
     cutoff = datetime.utcnow().date() - timedelta(days=max(1, days - 1))
+    company = getattr(current_user, 'company', None)
+    return rollup_series(db, company, period, since=cutoff)
+
+
+@app.get("/stats/analytics")
+def stats_analytics(request: Request, response: Response, period: str = 'day', buckets: int = 30,
+                    window: int = ANALYTICS_DEFAULT_WINDOW, current_user: User = Depends(get_current_user),
+                    db: Session = Depends(get_db)):
+    """Bucketed dashboard series: zero-filled days/weeks/months with a trailing
+    `window`-bucket moving average, per-bucket deltas and the change against
+    the preceding `buckets` periods (see stats_analytics.py).
+
+    Sends an ETag; a matching If-None-Match gets 304 without recomputing.
+    """
     try:
-        q = db.query(Statistic).filter(Statistic.date >= cutoff)
-        company = getattr(current_user, 'company', None)
-        if company is not None:
-            q = q.filter(Statistic.company == company)
-        rows = q.order_by(Statistic.date).all()
-        return rows
-    except ProgrammingError:
-        db.rollback()
-        if getattr(current_user, 'company', None) is not None:
-            rows = db.execute(text("SELECT id, date, shoots_count, income_total, created_at FROM statistics WHERE date >= :cutoff AND company = :company ORDER BY date"), {"cutoff": cutoff, "company": getattr(current_user, 'company', None)}).mappings().all()
-        else:
-            rows = db.execute(text("SELECT id, date, shoots_count, income_total, created_at FROM statistics WHERE date >= :cutoff ORDER BY date"), {"cutoff": cutoff}).mappings().all()
-        return [dict(r) for r in rows]
+        period = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not 1 <= buckets <= ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"buckets must be between 1 and {ANALYTICS_MAX_BUCKETS}")
+    if not 1 <= window <= ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"window must be between 1 and {ANALYTICS_MAX_BUCKETS}")
+    if not SCHEMA.has_table(PaymentEvent.__tablename__):
+        raise HTTPException(status_code=503, detail="payment ledger not migrated yet")
+    company = getattr(current_user, 'company', None)
+    tag = analytics_etag(db, company, period, buckets, window)
+    headers = {'ETag': tag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), tag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return compute_analytics(db, company, period, buckets, window)
+
+
+@app.get("/export/{table}")
+def export_table(table: str, format: str = 'arrow', current_user: User = Depends(get_current_user)):
+    """Stream a whole table as Arrow IPC (format=arrow) or Parquet (format=parquet),
+    scoped to the caller's company. Tables: properties, agents, photographers,
+    statistics, payment_events (see columnar_export.py)."""
+    try:
+        table, fmt = parse_export_table(table), parse_export_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, ext = EXPORT_FORMATS[fmt]
+    company = getattr(current_user, 'company', None)
+    # dedicated session, closed by the generator once the body is sent
+    return StreamingResponse(stream_export(SessionLocal(), table, company, fmt), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{table}.{ext}"'})
+
+
+@app.get("/reports")
+def list_reports(current_user: User = Depends(get_current_user)):
+    return {'reports': list(REPORTS), 'tables': list(EXPORT_TABLES), **REPORT_SNAPSHOTS.stats()}
+
+
+@app.get("/reports/{name}")
+def run_report(name: str, format: str = 'json', current_user: User = Depends(get_current_user)):
+    """Aggregate report over the caller's in-memory table snapshot (DuckDB),
+    as JSON rows or, with format=arrow|parquet, a columnar file."""
+    if name not in REPORTS:
+        raise HTTPException(status_code=404, detail=f"unknown report {name!r}")
+    try:
+        fmt = 'json' if format == 'json' else parse_export_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        result = REPORT_SNAPSHOTS.report(getattr(current_user, 'company', None), name)
+    except ReportsUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    if fmt == 'json':
+        return result.to_pylist()
+    buf = io.BytesIO()
+    write_batches(fmt, buf, result.schema, result.to_batches())
+    media_type, ext = EXPORT_FORMATS[fmt]
+    return Response(content=buf.getvalue(), media_type=media_type,
+                    headers={'Content-Disposition': f'attachment; filename="{name}.{ext}"'})
 
 
     @app.get("/debug/stats_recent")
@@ -843,44 +1214,107 @@ def stats_summary(days: int = 30, current_user: User = Depends(get_current_user)
             db.rollback()
             raise HTTPException(status_code=500, detail=str(e))
 
+# ----------------------
+# Search
+# ----------------------
+@app.get("/search")
+def search(
+    q: str,
+    kinds: str | None = None,
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Ranked, typo-tolerant search over properties, agents and photographers.
+
+    `kinds` is a comma-separated subset of property,agent,photographer. Items
+    are { kind, id, title, subtitle, score }, best match first, scoped to the
+    current user's company.
+    """
+    company = getattr(current_user, 'company', None)
+    try:
+        kind_list = parse_kinds(kinds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = SEARCH.search(db.connection(), q, company, kind_list, limit)
+    return {'query': q, 'backend': SEARCH.backend, 'items': items}
+
+
 # ----------------------
 # Existing properties endpoints
 # ----------------------
 @app.get("/properties")
-def get_properties(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_properties(
+    limit: int | None = None,
+    cursor: str | None = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    fields: str | None = None,
+    status_filter: str | None = Query(None, alias='status'),
+    paid: bool | None = None,
+    agent: str | None = None,
+    photographer_id: int | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    include_total: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """List properties using plain column selects (no ORM hydration).
+
+    Without `limit`/`cursor` the whole (filtered) listing is streamed as a JSON
+    array, as before. With `limit` or `cursor` a page is returned:
+    { items, next_cursor, total? } where `total` is only computed when
+    `include_total=true`. `fields` is a comma-separated projection; include
+    `photographer` to embed the photographer object.
+    """
     # SaaS: only return properties that belong to the current user's company
     company = getattr(current_user, 'company', None)
     try:
-        q = db.query(Property)
-        if company is not None:
-            q = q.filter(Property.company == company)
-        return q.all()
+        if order.lower() not in ('asc', 'desc'):
+            raise ValueError(f"Unsupported order: {order!r} (expected asc or desc)")
+        descending = order.lower() == 'desc'
+        prop_fields, with_photographer = parse_fields(fields)
+        after = decode_cursor(cursor, sort) if cursor else None
+        filters = listing_filters(company, status=status_filter, paid=paid, agent=agent, photographer_id=photographer_id,
+                                  min_price=min_price, max_price=max_price)
+        page_size = None
+        if limit is not None or cursor is not None:
+            page_size = max(1, min(int(limit or MAX_PAGE_SIZE), MAX_PAGE_SIZE))
+        stmt = build_listing_query(filters, prop_fields, with_photographer, sort=sort, descending=descending,
+                                   after=after, limit=page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if page_size is None:
+        # full listing: stream rows in chunks from a server-side cursor on a
+        # dedicated session (closed by the generator once the body is sent)
+        stream_db = SessionLocal()
+        try:
+            result = stream_db.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        except Exception:
+            stream_db.close()
+            raise
+        return StreamingResponse(stream_json_array(stream_db, result, prop_fields, with_photographer), media_type='application/json')
+
+    try:
+        rows = db.execute(stmt).mappings().all()
+        total = db.execute(build_count_query(filters)).scalar() if include_total else None
     except ProgrammingError:
         db.rollback()
-        # try to include `paid` and `image_url` if the columns exist; if not, fall back to a select
-        # that does not reference `image_url` to remain compatible with older schemas.
-        try:
-            if company is not None:
-                rows = db.execute(text("SELECT id, address, status, price, agent, company, paid, image_url FROM properties WHERE company = :company"), {"company": company}).mappings().all()
-            else:
-                rows = db.execute(text("SELECT id, address, status, price, agent, company, paid, image_url FROM properties")).mappings().all()
-            return [dict(r) for r in rows]
-        except ProgrammingError:
-            db.rollback()
-            # final safe fallback: do not reference `image_url` (it may not exist yet)
-            if company is not None:
-                rows = db.execute(text("SELECT id, address, status, price, agent, company FROM properties WHERE company = :company"), {"company": company}).mappings().all()
-            else:
-                rows = db.execute(text("SELECT id, address, status, price, agent, company FROM properties")).mappings().all()
-            out = [dict(r) for r in rows]
-            # ensure `paid` and `image_url` keys exist for frontend convenience
-            for o in out:
-                o.setdefault('paid', False)
-                o.setdefault('image_url', None)
-            return out
+        raise HTTPException(status_code=400, detail="Database schema not compatible with paginated listing. Run migrations.")
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(sort, rows[-1]['_sort'], rows[-1]['id'])
+    out = {'items': [row_to_item(r, prop_fields, with_photographer) for r in rows], 'next_cursor': next_cursor}
+    if include_total:
+        out['total'] = int(total or 0)
+    return out
+
 
 @app.post("/properties", status_code=201)
-def create_property(prop_data: PropertyCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_property(prop_data: PropertyCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # creation requires authentication; you can store current_user.id as created_by if you extend model
     # ensure created properties are tied to the user's company (SaaS multi-tenant)
     company = getattr(current_user, 'company', None)
@@ -896,6 +1330,8 @@ def create_property(prop_data: PropertyCreate, current_user: User = Depends(get_
     db.add(new_prop)
     db.commit()
     db.refresh(new_prop)
+    # geocode after the response is sent so /sun never has to hit the network for it
+    background_tasks.add_task(_geocode_property, new_prop.id, new_prop.address)
     return new_prop
  
 
@@ -904,38 +1340,49 @@ def create_property(prop_data: PropertyCreate, current_user: User = Depends(get_
 def get_property(property_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # SaaS: only allow viewing properties in the same company
     company = getattr(current_user, 'company', None)
-    try:
-        q = db.query(Property).filter(Property.id == property_id)
-        if company is not None:
-            q = q.filter(Property.company == company)
-        prop = q.first()
-        if not prop:
-            raise HTTPException(status_code=404, detail="Property not found")
-        return prop
-    except ProgrammingError:
-        db.rollback()
-        # attempt textual selects; include company constraint when possible
-        try:
-            if company is not None:
-                row = db.execute(text("SELECT id, address, status, price, agent, company, photographer_id, paid, image_url FROM properties WHERE id = :id AND company = :company LIMIT 1"), {"id": property_id, "company": company}).mappings().first()
-            else:
-                row = db.execute(text("SELECT id, address, status, price, agent, company, photographer_id, paid, image_url FROM properties WHERE id = :id LIMIT 1"), {"id": property_id}).mappings().first()
-            if not row:
-                raise HTTPException(status_code=404, detail="Property not found")
-            r = dict(row)
-            return r
-        except ProgrammingError:
-            db.rollback()
-            if company is not None:
-                row = db.execute(text("SELECT id, address, status, price, agent, company, photographer_id FROM properties WHERE id = :id AND company = :company LIMIT 1"), {"id": property_id, "company": company}).mappings().first()
-            else:
-                row = db.execute(text("SELECT id, address, status, price, agent, company, photographer_id FROM properties WHERE id = :id LIMIT 1"), {"id": property_id}).mappings().first()
-            if not row:
-                raise HTTPException(status_code=404, detail="Property not found")
-            r = dict(row)
-            r.setdefault('paid', False)
-            r.setdefault('image_url', None)
-            return r
+    filters = listing_filters(company) + [Property.id == property_id]
+    stmt = build_listing_query(filters, list(PROPERTY_FIELDS), True, limit=None)
+    row = db.execute(stmt).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Property not found")
+    return row_to_item(row, list(PROPERTY_FIELDS), True)
+
+
+def _set_paid(db: Session, prop: Property, paid: bool) -> None:
+    """Set prop.paid and append the matching payment ledger event.
+
+    Marking paid books one shoot and the price on today; un-marking appends
+    the exact negation of that paid event, whatever the price is now (see
+    payment_ledger.py). The event joins the caller's transaction, and the
+    /ai/ask snapshot picks the change up when it commits.
+
+    The flag flips with a conditional UPDATE (paid = the value we read), and
+    the event is appended only when that UPDATE hit the row. Two concurrent
+    requests (a double-click) can't both book the same transition: the
+    second one blocks on the row, then matches nothing. Otherwise a single
+    reversal would leave an orphan paid event in the rollups.
+    """
+    old_paid, new_paid = bool(prop.paid), bool(paid)
+    if old_paid == new_paid:
+        return
+    now = datetime.utcnow()
+    claimed = db.execute(
+        update(Property)
+        .where(Property.id == prop.id, Property.paid == old_paid)
+        .values(paid=new_paid, paid_at=now if new_paid else None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    paid_at = prop.paid_at
+    db.refresh(prop, ['paid', 'paid_at'])
+    if claimed != 1:
+        # another request made this change first; it booked the event
+        return
+    if new_paid:
+        event = payment_ledger.mark_paid(db, prop.id, prop.company, prop.price, now=now)
+    else:
+        event = payment_ledger.mark_unpaid(db, prop.id, prop.company, prop.price, paid_at=paid_at)
+    record_change(db, {'kind': 'rollup', 'op': 'increment', 'company': event['company'],
+                       'row': {'date': event['day'], 'shoots_count': event['shoots'], 'income_total': event['amount']}})
 
 
 # Mark property as paid/unpaid (protected)
@@ -950,54 +1397,7 @@ def set_property_paid(property_id: int, paid_update: PaidUpdate, current_user: U
         prop = q.first()
         if not prop:
             raise HTTPException(status_code=404, detail="Property not found")
-        old_paid = bool(prop.paid)
-        new_paid = bool(paid_update.paid)
-
-        # update the property paid flag
-        prop.paid = new_paid
-
-        # When marking paid, create a Statistic entry (one row per paid listing).
-        # When unmarking paid, remove one matching Statistic entry for today if present.
-        try:
-            today = date.today()
-            price_val = float(prop.price or 0.0)
-
-            if not old_paid and new_paid:
-                # Insert one Statistic row representing this property's paid event
-                stat = Statistic(date=today, shoots_count=1, income_total=price_val, company=company)
-                db.add(stat)
-
-            elif old_paid and not new_paid:
-                # Try to remove one Statistic row that most likely matches this property's payment
-                # Prefer an exact match on date and income_total and shoots_count == 1, newest first
-                match_q = db.query(Statistic).filter(
-                    Statistic.date == today,
-                    Statistic.income_total == price_val,
-                    Statistic.shoots_count == 1
-                )
-                if company is not None:
-                    match_q = match_q.filter(Statistic.company == company)
-                match = match_q.order_by(Statistic.created_at.desc()).first()
-
-                if match:
-                    db.delete(match)
-                else:
-                    # Fallback: if no exact per-listing row found, attempt to decrement an aggregate row
-                    agg_q = db.query(Statistic).filter(Statistic.date == today)
-                    if company is not None:
-                        agg_q = agg_q.filter(Statistic.company == company)
-                    agg = agg_q.first()
-                    if agg:
-                        agg.shoots_count = max(0, int((agg.shoots_count or 0) - 1))
-                        agg.income_total = max(0.0, float((agg.income_total or 0.0) - price_val))
-                        db.add(agg)
-        except Exception:
-            # do not block the paid update if stats fail; rollback stat changes if needed
-            try:
-                db.rollback()
-            except Exception:
-                pass
-
+        _set_paid(db, prop, paid_update.paid)
         db.add(prop)
         db.commit()
         db.refresh(prop)
@@ -1012,7 +1412,7 @@ def set_property_paid(property_id: int, paid_update: PaidUpdate, current_user: U
 # Update property (protected)
 # ----------------------
 @app.patch("/properties/{property_id}")
-def update_property(property_id: int, prop_up: PropertyUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_property(property_id: int, prop_up: PropertyUpdate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
         # ensure property belongs to current user's company
         company = getattr(current_user, 'company', None)
@@ -1025,6 +1425,12 @@ def update_property(property_id: int, prop_up: PropertyUpdate, current_user: Use
 
         # Only update fields that are present in payload
         if prop_up.address is not None:
+            if prop_up.address != prop.address:
+                # coordinates belong to the old address; refill them in the background
+                prop.latitude = None
+                prop.longitude = None
+                prop.timezone = None
+                background_tasks.add_task(_geocode_property, prop.id, prop_up.address)
             prop.address = prop_up.address
         if prop_up.status is not None:
             prop.status = prop_up.status
@@ -1037,41 +1443,8 @@ def update_property(property_id: int, prop_up: PropertyUpdate, current_user: Use
         if prop_up.photographer_id is not None:
             prop.photographer_id = prop_up.photographer_id
         if prop_up.paid is not None:
-            old_paid = bool(prop.paid)
-            new_paid = bool(prop_up.paid)
-            prop.paid = new_paid
-            # mirror statistics behavior when paid flag changes via PATCH
-            try:
-                today = date.today()
-                price_val = float(prop.price or 0.0)
-                if not old_paid and new_paid:
-                    stat = Statistic(date=today, shoots_count=1, income_total=price_val, company=company)
-                    db.add(stat)
-                elif old_paid and not new_paid:
-                    match_q = db.query(Statistic).filter(
-                        Statistic.date == today,
-                        Statistic.income_total == price_val,
-                        Statistic.shoots_count == 1
-                    )
-                    if company is not None:
-                        match_q = match_q.filter(Statistic.company == company)
-                    match = match_q.order_by(Statistic.created_at.desc()).first()
-                    if match:
-                        db.delete(match)
-                    else:
-                        agg_q = db.query(Statistic).filter(Statistic.date == today)
-                        if company is not None:
-                            agg_q = agg_q.filter(Statistic.company == company)
-                        agg = agg_q.first()
-                        if agg:
-                            agg.shoots_count = max(0, int((agg.shoots_count or 0) - 1))
-                            agg.income_total = max(0.0, float((agg.income_total or 0.0) - price_val))
-                            db.add(agg)
-            except Exception:
-                try:
-                    db.rollback()
-                except Exception:
-                    pass
+            # same statistics bookkeeping as POST /properties/{id}/paid
+            _set_paid(db, prop, prop_up.paid)
         if prop_up.image_url is not None:
             prop.image_url = prop_up.image_url
 
@@ -1091,18 +1464,10 @@ def update_property(property_id: int, prop_up: PropertyUpdate, current_user: Use
 def list_photographers(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Only return photographers for the current user's company
     company = getattr(current_user, 'company', None)
-    try:
-        q = db.query(Photographer)
-        if company is not None:
-            q = q.filter(Photographer.company == company)
-        return q.all()
-    except ProgrammingError:
-        db.rollback()
-        if company is not None:
-            rows = db.execute(text("SELECT id, name, email, phone, company, created_at FROM photographers WHERE company = :company"), {"company": company}).mappings().all()
-        else:
-            rows = db.execute(text("SELECT id, name, email, phone, company, created_at FROM photographers")).mappings().all()
-        return [dict(r) for r in rows]
+    q = SCHEMA.select(Photographer)
+    if company is not None:
+        q = q.where(Photographer.company == company)
+    return [dict(r) for r in db.execute(q).mappings().all()]
 
 
 @app.post("/photographers", status_code=201)
@@ -1152,18 +1517,10 @@ def delete_photographer(photographer_id: int, current_user: User = Depends(get_c
 def list_agents(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Only return agents for the current user's company
     company = getattr(current_user, 'company', None)
-    try:
-        q = db.query(Agent)
-        if company is not None:
-            q = q.filter(Agent.company == company)
-        return q.all()
-    except ProgrammingError:
-        db.rollback()
-        if company is not None:
-            rows = db.execute(text("SELECT id, name, email, phone, company, created_at FROM agents WHERE company = :company"), {"company": company}).mappings().all()
-        else:
-            rows = db.execute(text("SELECT id, name, email, phone, company, created_at FROM agents")).mappings().all()
-        return [dict(r) for r in rows]
+    q = SCHEMA.select(Agent)
+    if company is not None:
+        q = q.where(Agent.company == company)
+    return [dict(r) for r in db.execute(q).mappings().all()]
 
 
 @app.post("/agents", status_code=201)
@@ -1174,7 +1531,8 @@ def create_agent(a: AgentCreate, current_user: User = Depends(get_current_user),
     # basic uniqueness by name (case-insensitive)
     exists = None
     try:
-        exists = db.query(Agent).filter(Agent.name.ilike(a.name.strip())).first()
+        # lower(name) equality is served by ix_agents_lower_name
+        exists = db.query(Agent.id).filter(func.lower(Agent.name) == a.name.strip().lower()).first()
     except Exception:
         db.rollback()
     if exists:
@@ -1236,21 +1594,179 @@ def delete_agent(agent_id: int, current_user: User = Depends(get_current_user),
     return {"message": "deleted"}
 
 
+# ----------------------
+# Bulk import
+# ----------------------
+IMPORT_MODELS = {'properties': PropertyCreate, 'agents': AgentCreate, 'photographers': PhotographerCreate}
+
+
+@app.post("/import/{kind}")
+async def bulk_import(kind: str, request: Request, format: str | None = None,
+                      current_user: User = Depends(get_current_user)):
+    """Stream CSV (header row) or NDJSON rows of properties, agents or photographers.
+
+    Rows are validated with the single-row models, de-duplicated against
+    in-memory indexes and inserted in chunked executemany batches, one
+    transaction per chunk (see bulk_import.py). Invalid or duplicate rows are
+    skipped and listed in `errors` with their row numbers.
+    """
+    if kind not in IMPORT_MODELS:
+        raise HTTPException(status_code=404, detail=f"unknown import kind {kind!r}")
+    try:
+        fmt = detect_import_format(format, request.headers.get('content-type'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    company = getattr(current_user, 'company', None)
+    importer = await asyncio.to_thread(BulkImporter, engine, kind, IMPORT_MODELS[kind], company)
+    try:
+        async for batch in parse_import_batches(request.stream(), fmt):
+            await asyncio.to_thread(importer.load_chunk, batch)
+    finally:
+        # the inserts bypass the ORM hooks that patch these
+        if importer.inserted:
+            for touched in importer.companies:
+                AI_CONTEXT.invalidate(touched)
+                INTENT_INDEX.invalidate(touched)
+            REPORT_SNAPSHOTS.invalidate()
+        # coordinates are resolved in the background, not by the first /sun/batch
+        GEOCODE_QUEUE.submit(importer.new_properties)
+    return importer.report()
+
+
 # ----------------------
 # Sun times / watcher
 # ----------------------
 @app.get("/sun")
 def sun_times(address: str):
-    # Geocode the address using Nominatim (OpenStreetMap). Keep this public-read.
+    # Geocode through the cached geocoder (memory -> geocode_cache table -> offline
+    # gazetteer -> rate-limited Nominatim). Keep this public-read.
     try:
-        geolocator = Nominatim(user_agent="greentree_crm")
-        location = geolocator.geocode(address)
-        if not location:
+        coords = GEOCODER.geocode(address)
+        if not coords:
             raise HTTPException(status_code=404, detail="Address not found")
-        lat, lng = location.latitude, location.longitude
+        lat, lng = coords
         times = get_optimal_times(lat, lng)
         return {"address": address, "latitude": lat, "longitude": lng, "times": times}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/sun/cache/stats")
+def sun_cache_statistics(current_user: User = Depends(get_current_user)):
+    """Return hit/miss/eviction counters for the solar-result and timezone caches."""
+    return sun_cache_stats()
+
+
+SUN_BATCH_MAX_PROPERTIES = int(os.getenv("SUN_BATCH_MAX_PROPERTIES", "500"))
+SUN_BATCH_MAX_DAYS = int(os.getenv("SUN_BATCH_MAX_DAYS", "31"))
+
+
+def _geocode_property(property_id: int, address: str):
+    """Background task: geocode a property's address and store lat/lng/timezone.
+
+    The write is skipped if the address changed again in the meantime.
+    """
+    if not address or not SCHEMA.has_column(Property.__tablename__, 'latitude'):
+        return
+    coords = GEOCODER.geocode(address)
+    if not coords:
+        return
+    tzname = resolve_timezone(*coords)
+    precompute_timezones([(coords[0], coords[1], tzname)])
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Property)
+            .where(Property.id == property_id, Property.address == address)
+            .values(latitude=coords[0], longitude=coords[1], timezone=tzname)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+    finally:
+        db.close()
+
+
+# Properties without coordinates, geocoded one at a time off the request path
+GEOCODE_QUEUE = PropertyGeocodeQueue(_geocode_property)
+
+
+@app.on_event("shutdown")
+def _stop_geocode_queue():
+    GEOCODE_QUEUE.stop()
+
+
+@app.post("/sun/batch")
+def sun_batch(req: SunBatchRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Sun times for every (property, date) pair in one call.
+
+    Uses the coordinates stored on each property. A property that was never
+    geocoded is resolved from the local caches/gazetteer only; if that misses,
+    it is listed in `errors` as "pending geocode" and queued for background
+    geocoding, so a later call has its coordinates.
+    Response: { results: { id: { address, latitude, longitude, timezone, days: { date: times } } }, errors: { id: msg } }
+    """
+    ids = list(dict.fromkeys(req.property_ids or []))
+    if not ids:
+        raise HTTPException(status_code=400, detail="property_ids is required")
+    if len(ids) > SUN_BATCH_MAX_PROPERTIES:
+        raise HTTPException(status_code=400, detail=f"At most {SUN_BATCH_MAX_PROPERTIES} properties per request")
+    try:
+        start = date.fromisoformat(req.start_date) if req.start_date else datetime.utcnow().date()
+        end = date.fromisoformat(req.end_date) if req.end_date else start + timedelta(days=6)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
+    n_days = (end - start).days + 1
+    if n_days < 1 or n_days > SUN_BATCH_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must cover 1..{SUN_BATCH_MAX_DAYS} days")
+    day_strs = [(start + timedelta(days=i)).isoformat() for i in range(n_days)]
+
+    company = getattr(current_user, 'company', None)
+    q = SCHEMA.select(Property, ['id', 'address', 'latitude', 'longitude', 'timezone']).where(Property.id.in_(ids))
+    if company is not None:
+        q = q.where(Property.company == company)
+    rows = db.execute(q).mappings().all()
+
+    results, errors, fills, pending = {}, {}, [], []
+    for r in rows:
+        lat, lng, tzname = r['latitude'], r['longitude'], r['timezone']
+        if lat is None or lng is None:
+            if not r['address']:
+                errors[r['id']] = "Address could not be geocoded"
+                continue
+            coords = GEOCODER.geocode(r['address'], db=db, allow_remote=False)
+            if not coords:
+                errors[r['id']] = "pending geocode"
+                pending.append((r['id'], r['address']))
+                continue
+            lat, lng = coords
+            tzname = resolve_timezone(lat, lng)
+            precompute_timezones([(lat, lng, tzname)])
+            fills.append({'id': r['id'], 'address': r['address'], 'latitude': lat, 'longitude': lng, 'timezone': tzname})
+        results[r['id']] = {
+            'address': r['address'],
+            'latitude': lat,
+            'longitude': lng,
+            'timezone': tzname,
+            'days': get_optimal_times_range(lat, lng, day_strs),
+        }
+    for pid in ids:
+        if pid not in results and pid not in errors:
+            errors[pid] = "Property not found"
+    GEOCODE_QUEUE.submit(pending)
+
+    # persist coordinates resolved on the fly so the next call skips geocoding
+    if fills and SCHEMA.has_column(Property.__tablename__, 'latitude'):
+        try:
+            for f in fills:
+                db.execute(
+                    update(Property)
+                    .where(Property.id == f['id'], Property.address == f['address'])
+                    .values(latitude=f['latitude'], longitude=f['longitude'], timezone=f['timezone'])
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+    return {'results': results, 'errors': errors}
@@ -0,0 +1,265 @@
+"""
+migrations
+
+Small managed migration layer for the CRM schema. Migrations are ordered,
+idempotent functions registered with @migration(version, description); the
+applied versions are recorded in a `schema_migrations` table so each one runs
+once per database. `run_migrations()` is called once at API startup and
+replaces the bare `Base.metadata.create_all` calls that used to run at import.
+
+Also provides `explain_endpoint_queries()`, which runs EXPLAIN for the queries
+behind the main endpoints and reports whether each one hits an index.
+
+CLI (from src/app):
+    python migrations.py            # apply pending migrations
+    python migrations.py --explain  # also print query plans
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import (
+    Table, Column, Integer, String, DateTime, MetaData, select, func, insert, inspect,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import IntegrityError
+
+from database import (
+    engine as default_engine, Base, Property, Agent, Photographer, Statistic, User, GeocodeCache, AISyncJob, AISyncTask,
+    SearchDocument, StatRollup, PaymentEvent,
+)
+
+logger = logging.getLogger('migrations')
+
+_meta = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+MIGRATIONS: List[tuple] = []  # (version, description, fn(conn))
+
+
+def migration(version: int, description: str):
+    """Register `fn(conn)` as schema migration `version`."""
+    def decorator(fn: Callable[[Connection], None]):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f'duplicate migration version {version}')
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _add_missing_columns(conn: Connection, table: Table, names: List[str]) -> None:
+    """ALTER TABLE ... ADD COLUMN for model columns the live table lacks.
+
+    Only for nullable columns without server-side defaults, which every
+    dialect we run on can add in place.
+    """
+    present = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name in present:
+            continue
+        col = table.c[name]
+        col_type = col.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {name} {col_type}')
+
+
+def _create_model_indexes(conn: Connection, *tables) -> None:
+    # IF NOT EXISTS rather than checkfirst: reflection skips expression indexes
+    # such as lower(name), so checkfirst would try to create them again
+    for table in tables:
+        for idx in table.indexes:
+            conn.execute(CreateIndex(idx, if_not_exists=True))
+
+
+@migration(1, 'create base tables')
+def _create_base_tables(conn: Connection) -> None:
+    Base.metadata.create_all(conn)
+
+
+@migration(2, 'tenant-scoped composite indexes and lower(name) indexes')
+def _tenant_indexes(conn: Connection) -> None:
+    # create_all only adds indexes for tables it creates, so existing
+    # deployments get the indexes declared in database.py here
+    _create_model_indexes(
+        conn,
+        Property.__table__, Agent.__table__, Photographer.__table__,
+        Statistic.__table__, User.__table__,
+    )
+
+
+@migration(3, 'geocode cache table')
+def _geocode_cache(conn: Connection) -> None:
+    GeocodeCache.__table__.create(conn, checkfirst=True)
+
+
+@migration(4, 'property latitude/longitude/timezone columns')
+def _property_coordinates(conn: Connection) -> None:
+    _add_missing_columns(conn, Property.__table__, ['latitude', 'longitude', 'timezone'])
+
+
+@migration(5, 'background AI sync job and task tables')
+def _ai_sync_jobs(conn: Connection) -> None:
+    AISyncJob.__table__.create(conn, checkfirst=True)
+    AISyncTask.__table__.create(conn, checkfirst=True)
+    _create_model_indexes(conn, AISyncJob.__table__, AISyncTask.__table__)
+
+
+@migration(6, 'search documents with FTS5/pg_trgm index')
+def _search_documents(conn: Connection) -> None:
+    from search_index import install_backend_index, rebuild
+    SearchDocument.__table__.create(conn, checkfirst=True)
+    _create_model_indexes(conn, SearchDocument.__table__)
+    # the FTS5 triggers fill search_fts while rebuild() backfills the documents
+    install_backend_index(conn)
+    rebuild(conn)
+
+
+@migration(7, 'statistics rollups and properties.paid_at')
+def _stat_rollups(conn: Connection) -> None:
+    from stats_rollup import backfill
+    StatRollup.__table__.create(conn, checkfirst=True)
+    _create_model_indexes(conn, StatRollup.__table__)
+    _add_missing_columns(conn, Property.__table__, ['paid_at'])
+    # fold the per-event and aggregate rows of the legacy statistics table in once
+    daily = conn.execute(
+        select(Statistic.company, Statistic.date, func.sum(Statistic.shoots_count), func.sum(Statistic.income_total))
+        .group_by(Statistic.company, Statistic.date)
+    ).all()
+    backfill(conn, daily)
+
+
+@migration(8, 'append-only payment event ledger')
+def _payment_ledger(conn: Connection) -> None:
+    PaymentEvent.__table__.create(conn, checkfirst=True)
+    _create_model_indexes(conn, PaymentEvent.__table__)
+    if conn.execute(select(func.count()).select_from(PaymentEvent.__table__)).scalar():
+        return
+    # open the ledger with the current day rollups, already folded, so a replay reproduces them
+    now = datetime.utcnow()
+    opening = [
+        {'kind': 'opening', 'company': company or None, 'day': day, 'shoots': int(shoots or 0),
+         'amount': float(income or 0.0), 'created_at': now, 'folded': True}
+        for company, day, shoots, income in conn.execute(
+            select(StatRollup.company, StatRollup.period_start, StatRollup.shoots_count, StatRollup.income_total)
+            .where(StatRollup.period == 'day').order_by(StatRollup.period_start, StatRollup.company)
+        )
+    ]
+    if opening:
+        conn.execute(insert(PaymentEvent.__table__), opening)
+
+
+def applied_versions(bind: Engine | None = None) -> List[int]:
+    bind = bind or default_engine
+    _meta.create_all(bind)
+    with bind.connect() as conn:
+        return [r[0] for r in conn.execute(select(schema_migrations.c.version).order_by(schema_migrations.c.version))]
+
+
+def run_migrations(bind: Engine | None = None) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied now.
+
+    Each migration runs in its own transaction. If another worker applied the
+    same version concurrently the duplicate version insert is ignored.
+    """
+    bind = bind or default_engine
+    done = set(applied_versions(bind))
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with bind.begin() as conn:
+                fn(conn)
+                conn.execute(insert(schema_migrations).values(
+                    version=version, description=description, applied_at=datetime.utcnow()))
+            applied.append(version)
+            logger.info('applied migration %s: %s', version, description)
+        except IntegrityError:
+            logger.info('migration %s already applied by another process', version)
+    return applied
+
+
+# ----------------------
+# Query plan reporting
+# ----------------------
+def endpoint_queries(company: str | None) -> Dict[str, Any]:
+    """Representative statements for each endpoint, scoped like the handlers."""
+    from property_listing import PROPERTY_FIELDS, listing_filters, build_listing_query
+    from stats_rollup import series_query
+
+    def scoped(stmt, col):
+        return stmt.where(col == company) if company is not None else stmt
+
+    cutoff = datetime.utcnow().date() - timedelta(days=29)
+    return {
+        'GET /properties': build_listing_query(listing_filters(company), PROPERTY_FIELDS, True, limit=50),
+        'GET /properties?status=': build_listing_query(listing_filters(company, status='Active'), PROPERTY_FIELDS, False, limit=50),
+        'GET /properties?paid=': build_listing_query(listing_filters(company, paid=True), PROPERTY_FIELDS, False, limit=50),
+        'GET /properties/{id}': scoped(select(Property.__table__).where(Property.id == 1), Property.company),
+        'GET /agents': scoped(select(Agent.__table__), Agent.company),
+        'GET /photographers': scoped(select(Photographer.__table__), Photographer.company),
+        'GET /stats/summary': series_query(company, 'day', cutoff),
+        'POST /agents (dedupe)': select(Agent.id).where(func.lower(Agent.name) == 'jane doe').limit(1),
+        'POST /ai/ask (agent name)': select(Agent.id).where(func.lower(Agent.name) == 'jane doe').limit(1),
+        'POST /ai/ask (photographer name)': select(Photographer.id).where(func.lower(Photographer.name) == 'jane doe').limit(1),
+        'POST /ai/ask (user name)': select(User.id).where(func.lower(User.name) == 'jane doe').limit(1),
+    }
+
+
+def _explain(conn: Connection, stmt) -> List[str]:
+    compiled = stmt.compile(dialect=conn.dialect)
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    if compiled.positional:
+        params = tuple(compiled.params[k] for k in compiled.positiontup)
+    else:
+        params = compiled.params
+    rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    if conn.dialect.name == 'sqlite':
+        # (id, parent, notused, detail)
+        return [str(r[-1]) for r in rows]
+    return [str(r[0]) for r in rows]
+
+
+def _uses_index(dialect: str, plan: List[str]) -> bool:
+    text_plan = '\n'.join(plan).upper()
+    if dialect == 'sqlite':
+        return 'USING INDEX' in text_plan or 'USING COVERING INDEX' in text_plan or 'USING INTEGER PRIMARY KEY' in text_plan
+    return 'INDEX SCAN' in text_plan or 'INDEX ONLY SCAN' in text_plan or 'BITMAP INDEX SCAN' in text_plan
+
+
+def explain_endpoint_queries(company: str | None = None, bind: Engine | None = None) -> Dict[str, Any]:
+    """Return {endpoint: {plan: [...], uses_index: bool}} for the current database."""
+    bind = bind or default_engine
+    out = {}
+    with bind.connect() as conn:
+        for name, stmt in endpoint_queries(company).items():
+            try:
+                plan = _explain(conn, stmt)
+                out[name] = {'plan': plan, 'uses_index': _uses_index(conn.dialect.name, plan)}
+            except Exception as e:
+                out[name] = {'error': str(e)}
+    return out
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    ap = argparse.ArgumentParser(description='Apply schema migrations and optionally report query plans.')
+    ap.add_argument('--explain', action='store_true', help='print EXPLAIN output for endpoint queries')
+    ap.add_argument('--company', default=None, help='company used to scope the explained queries')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print('applied:', run_migrations() or 'nothing (up to date)')
+    if args.explain:
+        print(json.dumps(explain_endpoint_queries(args.company), indent=2))
@@ -1,5 +1,5 @@
 "use client";
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 import { Home, TreeDeciduous, DollarSign, Mail, Search, Moon, Sun, BarChart, Menu, X, MessageSquare } from 'lucide-react';
 import { useRouter } from 'next/navigation';
 
@@ -166,6 +166,9 @@ export default function Dashboard() {
   const [statsData, setStatsData] = useState([]);
   const [statsLoading, setStatsLoading] = useState(false);
   const [statsError, setStatsError] = useState(null);
+  // server-computed window totals from /stats/analytics, and its ETag for revalidation
+  const [statsTotals, setStatsTotals] = useState(null);
+  const statsEtag = useRef(null);
 
   // Derived monetary metric: total unpaid (estimated value of unsold listings)
   const totalUnpaid = Array.isArray(properties)
@@ -184,10 +187,11 @@ export default function Dashboard() {
     income: Number(s.income_total ?? s.income ?? 0)
   })) : [];
   const statsDays = statsParsed.length || 30;
-  const statsTotalShoots = statsParsed.reduce((sum, p) => sum + (p.shoots || 0), 0);
-  const statsTotalIncome = statsParsed.reduce((sum, p) => sum + (p.income || 0), 0);
-  const statsAvgShootsPerDay = statsDays ? (statsTotalShoots / statsDays) : 0;
-  const statsAvgIncomePerShoot = statsTotalShoots ? (statsTotalIncome / statsTotalShoots) : 0;
+  // the series is zero-filled server-side, so these are true per-day figures
+  const statsTotalShoots = statsTotals ? statsTotals.shoots : statsParsed.reduce((sum, p) => sum + (p.shoots || 0), 0);
+  const statsTotalIncome = statsTotals ? statsTotals.income : statsParsed.reduce((sum, p) => sum + (p.income || 0), 0);
+  const statsAvgShootsPerDay = statsTotals ? statsTotals.avg_shoots_per_bucket : (statsDays ? (statsTotalShoots / statsDays) : 0);
+  const statsAvgIncomePerShoot = statsTotals ? statsTotals.avg_income_per_shoot : (statsTotalShoots ? (statsTotalIncome / statsTotalShoots) : 0);
   // Watcher/sun times UI state
   const [watcherAddress, setWatcherAddress] = useState("");
   const [watcherLoading, setWatcherLoading] = useState(false);
@@ -197,6 +201,16 @@ export default function Dashboard() {
   // Listings menu state (left of main): search + sort
   const [listingSearch, setListingSearch] = useState("");
   const [listingSort, setListingSort] = useState("newest"); // newest | price_asc | price_desc
+  // typo fallback: ids the server-side /search index matched for listingSearch when
+  // no listing contains it literally (null: filter locally)
+  const [listingHits, setListingHits] = useState(null);
+  const [listingHitsTruncated, setListingHitsTruncated] = useState(false);
+  const LISTING_FALLBACK_LIMIT = 100;
+  const listingMatches = (p, q) => {
+    const needle = q.toLowerCase();
+    return String(p.address || "").toLowerCase().includes(needle)
+      || String(p.agent || "").toLowerCase().includes(needle);
+  };
 
   // Next.js router for navigation to property detail pages
   const router = useRouter();
@@ -210,6 +224,31 @@ export default function Dashboard() {
     return () => window.removeEventListener('resize', onResize);
   }, []);
 
+  // Listing search: the local address/agent substring filter is exact and covers every
+  // loaded listing, so it always wins. Only when it finds nothing do we ask the
+  // /search index (typo-tolerant) after a short pause in typing; its hits are the
+  // closest matches, capped at LISTING_FALLBACK_LIMIT
+  useEffect(() => {
+    const q = listingSearch.trim();
+    setListingHits(null);
+    setListingHitsTruncated(false);
+    if (q.length < 2 || (properties || []).some(p => listingMatches(p, q))) return;
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const data = await apiFetch(`/search?q=${encodeURIComponent(q)}&kinds=property&limit=${LISTING_FALLBACK_LIMIT}`);
+        const items = data?.items || [];
+        if (!cancelled) {
+          setListingHits(new Set(items.map(it => it.id)));
+          setListingHitsTruncated(items.length >= LISTING_FALLBACK_LIMIT);
+        }
+      } catch (e) {
+        // no fallback: the (empty) local result stands
+      }
+    }, 250);
+    return () => { cancelled = true; clearTimeout(timer); };
+  }, [listingSearch, properties]);
+
   // On mount: try to get token from localStorage and fetch /me with Authorization header
   useEffect(() => {
     let mounted = true;
@@ -465,18 +504,26 @@ export default function Dashboard() {
       setStatsLoading(true);
       let lastErr = null;
       for (const base of API_BASE_DEFAULTS) {
-        const url = `${base.replace(/\/$/, "")}/stats/summary?days=30`;
+        const url = `${base.replace(/\/$/, "")}/stats/analytics?period=day&buckets=30&window=7`;
         try {
           const token = localStorage.getItem("access_token");
           const headers = token ? { "Authorization": `Bearer ${token}` } : {};
+          if (statsEtag.current) headers["If-None-Match"] = statsEtag.current;
           const res = await fetch(url, { headers });
+          if (res.status === 304) {
+            // unchanged since the last fetch; keep what we have
+            if (mounted) setStatsLoading(false);
+            return;
+          }
           if (!res.ok) {
             lastErr = new Error(`${res.status} ${res.statusText}`);
             continue;
           }
           const data = await res.json();
           if (!mounted) return;
-          setStatsData(Array.isArray(data) ? data : []);
+          statsEtag.current = res.headers.get("ETag");
+          setStatsData(Array.isArray(data?.series) ? data.series : []);
+          setStatsTotals(data?.totals || null);
           setStatsError(null);
           setStatsLoading(false);
           return;
@@ -659,11 +706,9 @@ export default function Dashboard() {
   };
 
   // Derived listing collections used by the left-menu and dashboard
-  const filteredListings = (properties || []).filter(p => {
-    try {
-      return String(p.address || "").toLowerCase().includes(listingSearch.toLowerCase());
-    } catch (e) { return false; }
-  });
+  const filteredListings = (properties || []).filter(p =>
+    listingHits ? listingHits.has(p.id) : listingMatches(p, listingSearch.trim())
+  );
 
   const sortedListings = filteredListings.slice().sort((a, b) => {
     if (listingSort === 'price_asc') return (Number(a.price || 0) - Number(b.price || 0));
@@ -850,7 +895,7 @@ export default function Dashboard() {
       let data = null;
       let lastErr = null;
       for (const base of API_BASE_DEFAULTS) {
-        const url = `${base.replace(/\/$/, "")}/ai/sync`;
+        const url = `${base.replace(/\/$/, "")}/ai/sync?wait=true`;
         try {
           const res = await fetch(url, { method: 'POST', headers });
           if (!res.ok) {
@@ -1814,6 +1859,13 @@ export default function Dashboard() {
                           </select>
                         </div>
 
+                        {listingHits ? (
+                          <p className="mb-3 text-sm text-slate-500">
+                            {`No listing contains "${listingSearch.trim()}"; showing the closest matches`}
+                            {listingHitsTruncated ? ` (first ${LISTING_FALLBACK_LIMIT}, refine the search to see more)` : ''}.
+                          </p>
+                        ) : null}
+
                         <div className="overflow-x-auto">
                           <table className="w-full">
                             <thead className={THEME.tableHeadDark}>
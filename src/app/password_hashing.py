@@ -0,0 +1,120 @@
+"""
+password_hashing
+
+PBKDF2 hashing/verification runs in a dedicated process pool so a burst of
+logins neither holds the GIL in the API process nor starves FastAPI's default
+threadpool. The pool has a bounded number of pending jobs; when it is full the
+caller gets HashingSaturated (mapped to 503 + Retry-After by the API) instead of
+queueing without limit.
+
+Configuration:
+    PWD_HASH_WORKERS             process count (0 = run in a thread, no pool)
+    PWD_HASH_QUEUE_MAX           max jobs running + waiting before rejecting
+    PWD_HASH_RETRY_AFTER_SECONDS Retry-After hint returned when saturated
+"""
+
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Tuple
+
+# use a pure-python, well-supported scheme that accepts long passwords
+from passlib.context import CryptContext
+
+# Use pbkdf2_sha256 (pure-python). Accepts long inputs and avoids 72-byte bcrypt limit.
+PWD_CTX = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+PWD_HASH_WORKERS = int(os.getenv("PWD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PWD_HASH_QUEUE_MAX = int(os.getenv("PWD_HASH_QUEUE_MAX", "64"))
+PWD_HASH_RETRY_AFTER = int(os.getenv("PWD_HASH_RETRY_AFTER_SECONDS", "2"))
+
+
+class HashingSaturated(Exception):
+    """Raised when the hashing pool already has PWD_HASH_QUEUE_MAX jobs pending."""
+
+    def __init__(self, retry_after: int = PWD_HASH_RETRY_AFTER):
+        super().__init__("password hashing pool saturated")
+        self.retry_after = retry_after
+
+
+# Worker functions must be module-level so they can be pickled into the pool.
+def _hash(password: str) -> str:
+    return PWD_CTX.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, str | None]:
+    """Return (verified, new_hash). new_hash is set when PWD_CTX.needs_update
+    reports the stored hash uses deprecated settings and should be replaced.
+    """
+    try:
+        ok = PWD_CTX.verify(password, hashed)
+    except (ValueError, TypeError):
+        # malformed/too-long input: treat as authentication failure
+        return False, None
+    if ok and PWD_CTX.needs_update(hashed):
+        return True, PWD_CTX.hash(password)
+    return ok, None
+
+
+class HashingPool:
+    """Bounded front-end for a ProcessPoolExecutor running PBKDF2 jobs."""
+
+    def __init__(self, workers: int = PWD_HASH_WORKERS, queue_max: int = PWD_HASH_QUEUE_MAX,
+                 retry_after: int = PWD_HASH_RETRY_AFTER):
+        self.workers = max(0, int(workers))
+        self.queue_max = max(1, int(queue_max))
+        self.retry_after = retry_after
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor | None:
+        if self.workers == 0:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn avoids forking a process that already runs threads
+                    ctx = multiprocessing.get_context("spawn")
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_max:
+                self.rejected += 1
+                raise HashingSaturated(self.retry_after)
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            if executor is None:
+                return await asyncio.to_thread(fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, str | None]:
+        return await self._submit(_verify_and_update, password, hashed)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_max": self.queue_max,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,277 @@
+"""
+payment_ledger
+
+Append-only ledger of the payment events behind the statistics:
+
+- Marking a property paid appends a paid event: +1 shoot and +price on
+  today's date.
+- Un-marking appends the exact negation of that property's latest paid
+  event. The event is found through the (property_id, id) index, so the
+  reversal is one indexed read plus one insert. It cancels the day and
+  amount that were booked, even if the price has changed since or the
+  payment was on an earlier day.
+- Manual /stats entries are events too.
+- Amounts are never updated and rows are never deleted.
+
+Aggregates are folded in incrementally, tracked per event. compact() claims
+a batch of events with folded = false by flipping the flag, adds them to
+the stats_rollup day/week/month rollups (one upsert per company and bucket)
+and commits both together. The claim is conditional on the flag still
+being false, so two compactors never fold the same event twice: the loser
+sees fewer rows claimed and rolls back.
+
+Folding isn't an id high-water mark on purpose. Ids are assigned at insert
+but become visible at commit, so a transaction holding id N can commit
+after N+1 has been folded. With a watermark, N would fall below it and
+drop out of both the rollups and the unfolded tail. With the flag, it is
+simply folded on the next pass.
+
+Reads (series/totals) combine the rollups with the unfolded events, so they
+stay exact between compactions. LedgerCompactor runs compact() every
+PAYMENT_COMPACT_INTERVAL_SECONDS in the API process.
+
+replay() rebuilds every rollup from the ledger, for example after fixing
+event rows by hand. Bulk writes like that bypass the /ai/ask snapshots, so
+invalidate them or wait out AI_CONTEXT_TTL_SECONDS.
+
+CLI (from src/app):
+    python payment_ledger.py --compact
+    python payment_ledger.py --replay
+"""
+
+import os
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, false, func, insert, select, true, union_all, update
+
+from database import PaymentEvent, StatRollup
+import stats_rollup
+from stats_rollup import ROLLUP_PERIODS, period_start
+
+logger = logging.getLogger('payment_ledger')
+
+PAYMENT_COMPACT_INTERVAL = float(os.getenv("PAYMENT_COMPACT_INTERVAL_SECONDS", "60"))
+PAYMENT_COMPACT_BATCH = int(os.getenv("PAYMENT_COMPACT_BATCH", "5000"))
+
+_events = PaymentEvent.__table__
+_rollups = StatRollup.__table__
+
+
+# ----------------------
+# Appending
+# ----------------------
+def append(db, kind: str, company: Optional[str], day: date, shoots: int, amount: float,
+           property_id: Optional[int] = None, reverses_id: Optional[int] = None) -> Dict[str, Any]:
+    """Insert one event in the caller's transaction and return it as a dict."""
+    row = {'kind': kind, 'company': company, 'day': day, 'shoots': int(shoots), 'amount': float(amount),
+           'property_id': property_id, 'reverses_id': reverses_id, 'created_at': datetime.utcnow()}
+    row['id'] = db.execute(insert(_events).values(**row)).inserted_primary_key[0]
+    return row
+
+
+def last_event(db, property_id: int) -> Optional[Dict[str, Any]]:
+    row = db.execute(
+        select(_events).where(_events.c.property_id == property_id).order_by(_events.c.id.desc()).limit(1)
+    ).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def mark_paid(db, property_id: int, company: Optional[str], price: float, now: Optional[datetime] = None) -> Dict[str, Any]:
+    now = now or datetime.utcnow()
+    return append(db, 'paid', company, now.date(), 1, float(price or 0.0), property_id=property_id)
+
+
+def mark_unpaid(db, property_id: int, company: Optional[str], price: float,
+                paid_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Append the reversal of the property's outstanding paid event.
+
+    Properties paid before the ledger existed have no such event; their
+    reversal falls back to the paid_at day (else today) and the current price,
+    which is what the rollups were credited with at the time.
+    """
+    last = last_event(db, property_id)
+    if last is not None and last['kind'] == 'paid':
+        return append(db, 'unpaid', last['company'], last['day'], -last['shoots'], -last['amount'],
+                      property_id=property_id, reverses_id=last['id'])
+    day = (paid_at or datetime.utcnow()).date()
+    return append(db, 'unpaid', company, day, -1, -float(price or 0.0), property_id=property_id)
+
+
+# ----------------------
+# Folding into rollups
+# ----------------------
+def _grouped(db, where) -> List[Tuple[Optional[str], date, int, float]]:
+    """(company, day, shoots, amount) sums of the events matching `where`."""
+    stmt = select(_events.c.company, _events.c.day, func.sum(_events.c.shoots), func.sum(_events.c.amount)) \
+        .where(where).group_by(_events.c.company, _events.c.day)
+    return [tuple(r) for r in db.execute(stmt).all()]
+
+
+def _fold(conn, groups) -> None:
+    for company, day, shoots, amount in groups:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        stats_rollup.record(conn, company, day, int(shoots or 0), float(amount or 0.0))
+
+
+class AlreadyFolded(Exception):
+    """Another compactor claimed part of the batch first; the transaction was rolled back."""
+
+
+def compact(bind, batch: int = PAYMENT_COMPACT_BATCH) -> int:
+    """Fold up to `batch` unfolded events into the rollups; returns how many were folded."""
+    try:
+        with bind.begin() as conn:
+            ids = conn.execute(select(_events.c.id).where(unfolded()).order_by(_events.c.id).limit(batch)).scalars().all()
+            if not ids:
+                return 0
+            # claim before folding: a concurrent compactor blocks here on the row locks
+            claimed = conn.execute(update(_events).where(_events.c.id.in_(ids), unfolded()).values(folded=True)).rowcount
+            if claimed != len(ids):
+                raise AlreadyFolded()
+            _fold(conn, _grouped(conn, _events.c.id.in_(ids)))
+    except AlreadyFolded:
+        # our claims went with the rollback; the next pass picks up what's left
+        return 0
+    return len(ids)
+
+
+def replay(bind) -> int:
+    """Rebuild every rollup from the full ledger; returns the number of events replayed."""
+    with bind.begin() as conn:
+        # claim everything visible first, then fold exactly the claimed set: an
+        # event committing meanwhile stays unfolded for the next compaction
+        conn.execute(update(_events).where(unfolded()).values(folded=True))
+        conn.execute(delete(StatRollup.__table__))
+        _fold(conn, _grouped(conn, _events.c.folded == true()))
+        return int(conn.execute(select(func.count()).select_from(_events).where(_events.c.folded == true())).scalar() or 0)
+
+
+# ----------------------
+# Reads: rollups + unfolded tail
+# ----------------------
+def unfolded():
+    """WHERE clause for the events not compacted into the rollups yet."""
+    return _events.c.folded == false()
+
+
+def series(db, company: Optional[str], period: str = 'day', since: Optional[date] = None,
+           limit: Optional[int] = None, newest_first: bool = False) -> List[Dict[str, Any]]:
+    """Rows (date, shoots_count, income_total) per period start, like stats_rollup.series().
+
+    The rollups and the unfolded events (bucketed here) are read in one
+    statement, so a compaction committing in between cannot be counted twice.
+    """
+    roll = _rollups.c
+    rolled = select(roll.period_start.label('day'), roll.shoots_count.label('shoots'), roll.income_total.label('amount')) \
+        .where(roll.period == period)
+    tail = select(_events.c.day, _events.c.shoots, _events.c.amount).where(unfolded())
+    if company is not None:
+        rolled = rolled.where(roll.company == stats_rollup.company_key(company))
+        tail = tail.where(_events.c.company == company)
+    if since is not None:
+        start = period_start(period, since)
+        rolled = rolled.where(roll.period_start >= start)
+        tail = tail.where(_events.c.day >= start)
+    both = union_all(rolled, tail).subquery()
+    stmt = select(both.c.day, func.sum(both.c.shoots), func.sum(both.c.amount)).group_by(both.c.day)
+    rows: Dict[date, Dict[str, Any]] = {}
+    for day, shoots, amount in db.execute(stmt).all():
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        bucket = period_start(period, day)
+        row = rows.setdefault(bucket, {'date': bucket, 'shoots_count': 0, 'income_total': 0.0})
+        row['shoots_count'] += int(shoots or 0)
+        row['income_total'] += float(amount or 0.0)
+    out = sorted(rows.values(), key=lambda r: r['date'], reverse=newest_first)
+    return out[:limit] if limit is not None else out
+
+
+def totals(db, company: Optional[str]) -> Tuple[int, float]:
+    """All-time (shoots, income): the coarsest rollup plus the unfolded events, in one statement."""
+    roll = _rollups.c
+    rolled = select(roll.shoots_count.label('shoots'), roll.income_total.label('amount')) \
+        .where(roll.period == ROLLUP_PERIODS[-1])
+    tail = select(_events.c.shoots, _events.c.amount).where(unfolded())
+    if company is not None:
+        rolled = rolled.where(roll.company == stats_rollup.company_key(company))
+        tail = tail.where(_events.c.company == company)
+    both = union_all(rolled, tail).subquery()
+    shoots, income = db.execute(select(func.coalesce(func.sum(both.c.shoots), 0),
+                                       func.coalesce(func.sum(both.c.amount), 0.0))).one()
+    return int(shoots or 0), float(income or 0.0)
+
+
+def ledger_stats(db) -> Dict[str, Any]:
+    last = db.execute(select(func.max(_events.c.id))).scalar() or 0
+    return {'events': int(db.execute(select(func.count()).select_from(_events)).scalar() or 0),
+            'unfolded': int(db.execute(select(func.count()).select_from(_events).where(unfolded())).scalar() or 0),
+            'last_event_id': int(last), 'periods': list(ROLLUP_PERIODS)}
+
+
+class LedgerCompactor:
+    """Runs compact() in a worker thread every `interval` seconds."""
+
+    def __init__(self, bind, interval: float = PAYMENT_COMPACT_INTERVAL):
+        self.bind = bind
+        self.interval = max(1.0, interval)
+        self.stats = {'passes': 0, 'folded': 0}
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        folded = 0
+        while True:
+            n = await asyncio.to_thread(compact, self.bind)
+            folded += n
+            if n < PAYMENT_COMPACT_BATCH:
+                break
+        self.stats['passes'] += 1
+        self.stats['folded'] += folded
+        return folded
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception('payment ledger compaction failed')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from database import engine
+
+    ap = argparse.ArgumentParser(description='Fold payment events into the statistics rollups.')
+    ap.add_argument('--compact', action='store_true', help='fold every unfolded event')
+    ap.add_argument('--replay', action='store_true', help='rebuild all rollups from the full ledger')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.replay:
+        print('replayed', replay(engine), 'events')
+    elif args.compact:
+        total = 0
+        while True:
+            n = compact(engine)
+            total += n
+            if n < PAYMENT_COMPACT_BATCH:
+                break
+        print('folded', total, 'events')
+    else:
+        ap.print_help()
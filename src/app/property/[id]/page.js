@@ -376,7 +376,7 @@ export default function PropertyDetailPage() {
       let lastErr = null;
       for (const baseRaw of API_BASE_DEFAULTS) {
         const base = baseRaw.replace(/\/$/, "");
-        const url = `${base}/ai/sync`;
+        const url = `${base}/ai/sync?wait=true`;
         try {
           const res = await fetch(url, { method: 'POST', headers, body: JSON.stringify({ property_ids: [property.id] }) });
           if (!res.ok) {
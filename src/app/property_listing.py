@@ -0,0 +1,159 @@
+"""
+property_listing
+
+Column-level (non-ORM) queries behind GET /properties. Rows are selected as
+plain column tuples, never hydrated into Property objects, and support:
+
+- keyset pagination on id or any whitelisted sort column (opaque cursor)
+- a `fields=` projection (plus an optional embedded `photographer` object)
+- server-side filters on status / paid / agent / photographer / price range
+"""
+
+import json
+import base64
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import select, and_, or_, func, null
+
+from database import Property, Photographer
+from schema_probe import SCHEMA
+
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 1000
+
+PROPERTY_FIELDS = tuple(c.name for c in Property.__table__.columns)
+PHOTOGRAPHER_FIELDS = ('id', 'name', 'email', 'phone', 'company')
+
+# Sort key -> (column, value used in place of NULL). Nullable columns are
+# coalesced so keyset comparisons stay total.
+SORT_COLUMNS = {
+    'id': (Property.id, None),
+    'address': (Property.address, None),
+    'status': (Property.status, None),
+    'paid': (Property.paid, None),
+    'price': (Property.price, 0.0),
+    'agent': (Property.agent, ''),
+}
+
+
+def _sort_expr(sort: str):
+    col, null_value = SORT_COLUMNS[sort]
+    return col if null_value is None else func.coalesce(col, null_value)
+
+
+def encode_cursor(sort: str, value: Any, last_id: int) -> str:
+    raw = json.dumps([sort, value, last_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """Return (sort_value, last_id) or raise ValueError for a bad/foreign cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        c_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if c_sort != sort:
+        raise ValueError('Cursor was issued for a different sort order')
+    return value, int(last_id)
+
+
+def parse_fields(fields: str | None) -> Tuple[List[str], bool]:
+    """Parse a comma-separated projection. Returns (property_fields, include_photographer)."""
+    if not fields:
+        return list(PROPERTY_FIELDS), True
+    wanted = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in wanted if f not in PROPERTY_FIELDS and f != 'photographer']
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [f for f in wanted if f != 'photographer'], 'photographer' in wanted
+
+
+def listing_filters(company: str | None, status: str | None = None, paid: bool | None = None,
+                    agent: str | None = None, photographer_id: int | None = None,
+                    min_price: float | None = None, max_price: float | None = None) -> list:
+    clauses = []
+    if company is not None:
+        clauses.append(Property.company == company)
+    if status is not None:
+        clauses.append(Property.status == status)
+    if paid is not None:
+        clauses.append(Property.paid == paid)
+    if agent is not None:
+        clauses.append(Property.agent == agent)
+    if photographer_id is not None:
+        clauses.append(Property.photographer_id == photographer_id)
+    if min_price is not None:
+        clauses.append(Property.price >= min_price)
+    if max_price is not None:
+        clauses.append(Property.price <= max_price)
+    return clauses
+
+
+def build_listing_query(filters: list, prop_fields: Iterable[str], include_photographer: bool,
+                        sort: str = 'id', descending: bool = False, after: Tuple[Any, int] | None = None,
+                        limit: int | None = None):
+    """Build the SELECT for a listing page (or the whole listing when limit is None).
+
+    `id` and the sort key are always selected (as `id` and `_sort`) so the
+    caller can emit a cursor; trim them with `row_to_item`.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unsupported sort column: {sort}")
+    sort_expr = _sort_expr(sort)
+    # columns missing from an older database come back as their model default
+    cols = [SCHEMA.column(Property, f) for f in prop_fields if f != 'id']
+    cols.append(Property.id.label('id'))
+    cols.append(sort_expr.label('_sort'))
+    stmt = select(*cols).select_from(Property)
+    if include_photographer and SCHEMA.has_table(Photographer.__tablename__) and SCHEMA.has_column(Property.__tablename__, 'photographer_id'):
+        stmt = stmt.add_columns(*[SCHEMA.column(Photographer, f, f'photographer__{f}') for f in PHOTOGRAPHER_FIELDS])
+        stmt = stmt.outerjoin(Photographer, Property.photographer_id == Photographer.id)
+    elif include_photographer:
+        stmt = stmt.add_columns(*[null().label(f'photographer__{f}') for f in PHOTOGRAPHER_FIELDS])
+    clauses = list(filters)
+    if after is not None:
+        value, last_id = after
+        if descending:
+            clauses.append(or_(sort_expr < value, and_(sort_expr == value, Property.id < last_id)))
+        else:
+            clauses.append(or_(sort_expr > value, and_(sort_expr == value, Property.id > last_id)))
+    if clauses:
+        stmt = stmt.where(and_(*clauses))
+    if descending:
+        stmt = stmt.order_by(sort_expr.desc(), Property.id.desc())
+    else:
+        stmt = stmt.order_by(sort_expr.asc(), Property.id.asc())
+    if limit is not None:
+        # fetch one extra row to learn whether another page exists
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+def build_count_query(filters: list):
+    stmt = select(func.count()).select_from(Property)
+    return stmt.where(and_(*filters)) if filters else stmt
+
+
+def row_to_item(row, prop_fields: List[str], include_photographer: bool) -> Dict[str, Any]:
+    item = {f: row[f] for f in prop_fields}
+    if include_photographer:
+        if row['photographer__id'] is None:
+            item['photographer'] = None
+        else:
+            item['photographer'] = {f: row[f'photographer__{f}'] for f in PHOTOGRAPHER_FIELDS}
+    return item
+
+
+def stream_json_array(db, result, prop_fields: List[str], include_photographer: bool):
+    """Yield a JSON array chunk by chunk from a (yield_per) result; closes `db` at the end."""
+    try:
+        yield '['
+        sep = ''
+        for rows in result.mappings().partitions(STREAM_CHUNK_SIZE):
+            chunk = ','.join(json.dumps(row_to_item(r, prop_fields, include_photographer), default=str) for r in rows)
+            yield sep + chunk
+            sep = ','
+        yield ']'
+    finally:
+        db.close()
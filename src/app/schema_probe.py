@@ -0,0 +1,103 @@
+"""
+schema_probe
+
+Startup schema introspection. Some deployed databases lag behind the models
+(for example `users.company` or `properties.image_url` missing), which used to
+make handlers try an ORM query, catch ProgrammingError, roll back and retry
+with textual SELECTs on every request.
+
+Instead, SchemaCapabilities records once which tables/columns exist and builds
+a column projection per model: present columns are selected directly and
+missing ones are rendered as a typed literal of the model default, so every
+handler issues exactly one statement and always gets every key back.
+
+Call SCHEMA.refresh() after a migration has run (the API does this at startup
+and exposes POST /debug/schema/refresh for out-of-band migrations).
+"""
+
+import threading
+from typing import Any, Dict, List, Set
+
+from sqlalchemy import inspect, literal, select
+
+from database import engine, Base
+
+
+def _column_default(col) -> Any:
+    """Python-side scalar default for a Column, or None."""
+    d = col.default
+    if d is not None and getattr(d, 'is_scalar', False):
+        return d.arg
+    return None
+
+
+class SchemaCapabilities:
+    """Cached view of which model tables/columns exist in the live database."""
+
+    def __init__(self, bind=None):
+        self.bind = bind or engine
+        self._lock = threading.Lock()
+        self._columns: Dict[str, Set[str]] | None = None
+        self._projections: Dict[str, list] = {}
+
+    def refresh(self) -> None:
+        insp = inspect(self.bind)
+        existing = set(insp.get_table_names())
+        columns = {}
+        for name in Base.metadata.tables:
+            if name in existing:
+                columns[name] = {c['name'] for c in insp.get_columns(name)}
+        with self._lock:
+            self._columns = columns
+            self._projections = {}
+
+    def _cols(self) -> Dict[str, Set[str]]:
+        if self._columns is None:
+            self.refresh()
+        return self._columns
+
+    def has_table(self, table: str) -> bool:
+        return table in self._cols()
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self._cols().get(table, ())
+
+    def missing_columns(self, model) -> List[str]:
+        table = model.__table__
+        present = self._cols().get(table.name, set())
+        return [c.name for c in table.columns if c.name not in present]
+
+    def column(self, model, name: str, label: str | None = None):
+        """The real column when present, else a labeled literal of its default."""
+        col = model.__table__.c[name]
+        if self.has_column(model.__table__.name, name):
+            return col.label(label or name)
+        return literal(_column_default(col), type_=col.type).label(label or name)
+
+    def projection(self, model, names: List[str] | None = None) -> list:
+        """Labeled column expressions for `names` (default: every model column)."""
+        if names is None:
+            key = model.__table__.name
+            proj = self._projections.get(key)
+            if proj is None:
+                proj = [self.column(model, c.name) for c in model.__table__.columns]
+                self._projections[key] = proj
+            return proj
+        return [self.column(model, n) for n in names]
+
+    def select(self, model, names: List[str] | None = None):
+        return select(*self.projection(model, names)).select_from(model.__table__)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out = {}
+        for table in Base.metadata.sorted_tables:
+            model_cols = [c.name for c in table.columns]
+            present = self._cols().get(table.name)
+            out[table.name] = {
+                'exists': present is not None,
+                'missing_columns': [c for c in model_cols if present is None or c not in present],
+            }
+        return out
+
+
+SCHEMA = SchemaCapabilities()
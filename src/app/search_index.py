@@ -0,0 +1,386 @@
+"""
+search_index
+
+Full-text and fuzzy search over properties, agents and photographers for the
+/search endpoint. Every searchable row has a SearchDocument: its kind and id,
+company, display title/subtitle and a lowercased `body` that joins the address,
+agent, photographer name and company (for properties) or the name, email, phone
+and company (for contacts).
+
+All backends use the same interface and rank the same way:
+
+- fts5:    SQLite. `search_fts` is an FTS5 table with the trigram tokenizer over
+           search_documents.body, kept in sync by triggers. Substring queries run
+           as a phrase match. For typos, the candidates come from an OR of the
+           query's rarest trigrams ranked by bm25. Rarity is looked up in the
+           search_fts_vocab table, so a trigram in nearly every document
+           ("st ", "uni") does not rank the whole table.
+- pg_trgm: Postgres. A GIN gin_trgm_ops index on body serves both the
+           LIKE '%q%' match and the `body %> q` word-similarity match.
+- like:    any other database, or one without FTS5/pg_trgm. LIKE over
+           search_documents only, so there is no typo tolerance.
+
+Candidates are re-ranked in Python. The order is: an exact title, a title
+prefix, a substring of the title, a substring elsewhere in the document, then
+a fuzzy match. The fuzzy score is the fraction of the query's (padded,
+per-word) trigrams that occur in the document, roughly pg_trgm's
+word_similarity. Matches scoring under SEARCH_MIN_SCORE are
+dropped.
+
+Documents are maintained incrementally inside the writing transaction by ORM
+hooks (install_search_hooks), so the create/update/delete endpoints keep the
+index current without extra calls. Writes made with bulk/text SQL bypass the
+hooks; call rebuild() (or reindex() for a subset) afterwards.
+"""
+
+import os
+import re
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, column, delete, func, insert, inspect, literal, select, table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from database import Property, Agent, Photographer, SearchDocument
+
+logger = logging.getLogger('search_index')
+
+SEARCH_MAX_LIMIT = 100
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.5"))
+# rows fetched from the index before re-ranking
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "200"))
+# fts5 typo matching ORs only this many of the query's rarest trigrams, and
+# ranks them with bm25 only while they match at most SEARCH_RANK_BUDGET documents
+SEARCH_FUZZY_TERMS = int(os.getenv("SEARCH_FUZZY_TERMS", "4"))
+SEARCH_RANK_BUDGET = int(os.getenv("SEARCH_RANK_BUDGET", "5000"))
+
+KINDS = ('property', 'agent', 'photographer')
+_MODELS = {'property': Property, 'agent': Agent, 'photographer': Photographer}
+# source columns that feed a document; updates touching none of them are skipped
+_FIELDS = {
+    'property': ('address', 'agent', 'photographer_id', 'company'),
+    'agent': ('name', 'email', 'phone', 'company'),
+    'photographer': ('name', 'email', 'phone', 'company'),
+}
+
+_docs = SearchDocument.__table__
+_fts_vocab = table('search_fts_vocab', column('term'), column('doc'))
+
+_WS_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _norm(text: Any) -> str:
+    return _WS_RE.sub(' ', str(text or '').lower()).strip()
+
+
+def _word_trigrams(text: str) -> Set[str]:
+    """pg_trgm-style trigrams: each word padded with two leading and one trailing space."""
+    grams = set()
+    for w in _WORD_RE.findall(text):
+        padded = f"  {w} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def parse_kinds(kinds: Optional[str]) -> List[str]:
+    """Comma-separated kinds -> list; raises ValueError on an unknown kind."""
+    if not kinds:
+        return list(KINDS)
+    out = [k.strip().lower() for k in kinds.split(',') if k.strip()]
+    unknown = [k for k in out if k not in KINDS]
+    if unknown:
+        raise ValueError(f"unknown search kind(s): {', '.join(unknown)}; expected {', '.join(KINDS)}")
+    return out
+
+
+def score(query: str, title: Any, body: str, query_grams: Optional[Set[str]] = None) -> float:
+    """Rank of one document for a normalized query (higher is better)."""
+    t = _norm(title)
+    if t == query:
+        return 4.0
+    if t.startswith(query):
+        return 3.0
+    if query in t:
+        return 2.5
+    if query in body:
+        return 2.0
+    grams = query_grams if query_grams is not None else _word_trigrams(query)
+    if not grams:
+        return 0.0
+    # body similarity decides; the title share breaks ties between a contact and its listings
+    return (0.9 * len(grams & _word_trigrams(body)) + 0.1 * len(grams & _word_trigrams(t))) / len(grams)
+
+
+# ----------------------
+# Document building
+# ----------------------
+def _join_text(*cols):
+    expr = func.coalesce(cols[0], '')
+    for c in cols[1:]:
+        expr = expr + literal(' ') + func.coalesce(c, '')
+    return func.lower(expr)
+
+
+def document_select(kind: str):
+    """SELECT producing search_documents rows for every row of `kind`."""
+    if kind == 'property':
+        return (
+            select(
+                literal('property').label('kind'), Property.id.label('ref_id'), Property.company.label('company'),
+                Property.address.label('title'), Property.agent.label('subtitle'),
+                _join_text(Property.address, Property.agent, Photographer.name, Property.company).label('body'),
+            )
+            .select_from(Property.__table__.outerjoin(Photographer.__table__, Property.photographer_id == Photographer.id))
+        )
+    model = _MODELS[kind]
+    return select(
+        literal(kind).label('kind'), model.id.label('ref_id'), model.company.label('company'),
+        model.name.label('title'), model.email.label('subtitle'),
+        _join_text(model.name, model.email, model.phone, model.company).label('body'),
+    ).select_from(model.__table__)
+
+
+def reindex(conn: Connection, kind: str, where=None) -> None:
+    """Rewrite the documents of `kind` rows matching `where` (all rows when None)."""
+    model = _MODELS[kind]
+    stale = delete(_docs).where(_docs.c.kind == kind)
+    if where is not None:
+        stale = stale.where(_docs.c.ref_id.in_(select(model.id).where(where).scalar_subquery()))
+    conn.execute(stale)
+    sel = document_select(kind)
+    if where is not None:
+        sel = sel.where(where)
+    conn.execute(insert(_docs).from_select(['kind', 'ref_id', 'company', 'title', 'subtitle', 'body'], sel))
+
+
+_ROW_STATEMENTS: Dict[str, tuple] = {}
+
+
+def _row_statements(kind: str) -> tuple:
+    # built once per kind: the hooks run on every write, and constructing the
+    # INSERT ... SELECT each time costs more than executing it
+    stmts = _ROW_STATEMENTS.get(kind)
+    if stmts is None:
+        model = _MODELS[kind]
+        stmts = _ROW_STATEMENTS[kind] = (
+            delete(_docs).where(_docs.c.kind == kind, _docs.c.ref_id == bindparam('ref_id')),
+            insert(_docs).from_select(['kind', 'ref_id', 'company', 'title', 'subtitle', 'body'],
+                                      document_select(kind).where(model.id == bindparam('ref_id'))),
+        )
+    return stmts
+
+
+def reindex_row(conn: Connection, kind: str, ref_id: int) -> None:
+    """Rewrite the document of one `kind` row."""
+    stale, fresh = _row_statements(kind)
+    conn.execute(stale, {'ref_id': ref_id})
+    conn.execute(fresh, {'ref_id': ref_id})
+
+
+def remove(conn: Connection, kind: str, ref_id: int) -> None:
+    conn.execute(_row_statements(kind)[0], {'ref_id': ref_id})
+
+
+def rebuild(conn: Connection, kinds: Iterable[str] = KINDS) -> None:
+    """Recreate every document of `kinds` from the source tables."""
+    for kind in kinds:
+        reindex(conn, kind)
+    if conn.dialect.name == 'sqlite' and inspect(conn).has_table('search_fts'):
+        conn.exec_driver_sql("INSERT INTO search_fts(search_fts) VALUES ('optimize')")
+
+
+def install_backend_index(conn: Connection) -> str:
+    """Create the dialect's text index over search_documents.body; returns the backend name.
+
+    Runs in a savepoint so a missing FTS5 trigram tokenizer (SQLite < 3.34) or
+    missing pg_trgm privileges leaves the LIKE backend in place instead of
+    failing the migration.
+    """
+    dialect = conn.dialect.name
+    try:
+        with conn.begin_nested():
+            if dialect == 'sqlite':
+                conn.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+                    "body, content='search_documents', content_rowid='id', tokenize='trigram')")
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+                    "INSERT INTO search_fts(rowid, body) VALUES (new.id, new.body); END")
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+                    "INSERT INTO search_fts(search_fts, rowid, body) VALUES ('delete', old.id, old.body); END")
+                conn.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+                    "INSERT INTO search_fts(search_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+                    "INSERT INTO search_fts(rowid, body) VALUES (new.id, new.body); END")
+                conn.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts_vocab USING fts5vocab(search_fts, 'row')")
+                conn.exec_driver_sql("INSERT INTO search_fts(search_fts) VALUES ('rebuild')")
+                return 'fts5'
+            if dialect == 'postgresql':
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                conn.exec_driver_sql(
+                    "CREATE INDEX IF NOT EXISTS ix_search_documents_body_trgm "
+                    "ON search_documents USING gin (body gin_trgm_ops)")
+                return 'pg_trgm'
+    except DBAPIError as e:
+        logger.warning('search: no %s text index (%s); falling back to LIKE', dialect, e)
+    return 'like'
+
+
+# ----------------------
+# Query side
+# ----------------------
+class SearchIndex:
+    """Backend detection and ranked, company-scoped lookups."""
+
+    def __init__(self, bind: Engine):
+        self.bind = bind
+        self.backend: Optional[str] = None   # None until detect(); 'none' without the table
+        self.queries = 0
+        self.fuzzy_queries = 0
+        self.total_ms = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.backend not in (None, 'none')
+
+    def detect(self) -> str:
+        with self.bind.connect() as conn:
+            insp = inspect(conn)
+            if not insp.has_table(_docs.name):
+                self.backend = 'none'
+            elif conn.dialect.name == 'sqlite' and insp.has_table('search_fts'):
+                self.backend = 'fts5'
+            elif conn.dialect.name == 'postgresql' and conn.exec_driver_sql(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first():
+                self.backend = 'pg_trgm'
+            else:
+                self.backend = 'like'
+        return self.backend
+
+    def _scoped(self, stmt, company: Optional[str], kinds: List[str]):
+        if company is not None:
+            stmt = stmt.where(_docs.c.company == company)
+        if len(kinds) < len(KINDS):
+            stmt = stmt.where(_docs.c.kind.in_(kinds))
+        return stmt
+
+    def _fts_query(self, conn: Connection, match: str, company: Optional[str], kinds: List[str], ranked: bool) -> list:
+        # CROSS JOIN pins search_fts as the outer loop; with a plain JOIN SQLite may
+        # walk the company index instead and evaluate MATCH once per document
+        sql = ("SELECT d.id, d.kind, d.ref_id, d.title, d.subtitle, d.body "
+               "FROM search_fts CROSS JOIN search_documents d ON d.id = search_fts.rowid "
+               "WHERE search_fts MATCH :match")
+        params: Dict[str, Any] = {'match': match, 'limit': SEARCH_CANDIDATES}
+        stmt_params = []
+        if company is not None:
+            sql += " AND d.company = :company"
+            params['company'] = company
+        if len(kinds) < len(KINDS):
+            sql += " AND d.kind IN :kinds"
+            params['kinds'] = list(kinds)
+            stmt_params.append(bindparam('kinds', expanding=True))
+        sql += (" ORDER BY search_fts.rank" if ranked else "") + " LIMIT :limit"
+        return conn.execute(text(sql).bindparams(*stmt_params), params).all()
+
+    @staticmethod
+    def _rarest_trigrams(conn: Connection, q: str) -> Tuple[List[str], int]:
+        """Up to SEARCH_FUZZY_TERMS indexed trigrams of `q`, rarest first, and their summed document counts."""
+        grams = {g for g in (q[i:i + 3] for i in range(len(q) - 2)) if ' ' not in g}
+        counts = []
+        for g in grams:
+            # one equality lookup per trigram; fts5vocab does not index IN (...)
+            doc = conn.execute(select(_fts_vocab.c.doc).where(_fts_vocab.c.term == g)).scalar()
+            if doc:
+                counts.append((doc, g))
+        rare = sorted(counts)[:SEARCH_FUZZY_TERMS]
+        return [g for _, g in rare], sum(doc for doc, _ in rare)
+
+    def _candidates(self, conn: Connection, q: str, company: Optional[str], kinds: List[str], limit: int) -> list:
+        cols = select(_docs.c.id, _docs.c.kind, _docs.c.ref_id, _docs.c.title, _docs.c.subtitle, _docs.c.body)
+        if self.backend == 'fts5' and len(q) >= 3:
+            # substring hits all rank alike here, so skip bm25 and stop at the first candidates in rowid order
+            rows = self._fts_query(conn, '"' + q.replace('"', '""') + '"', company, kinds, ranked=False)
+            if len(rows) >= limit:
+                return rows
+            rare, postings = self._rarest_trigrams(conn, q)
+            if not rare:
+                return rows
+            self.fuzzy_queries += 1
+            seen = {r.id for r in rows}
+            # past the budget bm25 would score most of the table; take the first matches instead
+            fuzzy = self._fts_query(conn, ' OR '.join('"' + g.replace('"', '""') + '"' for g in rare),
+                                    company, kinds, ranked=postings <= SEARCH_RANK_BUDGET)
+            return rows + [r for r in fuzzy if r.id not in seen]
+        if self.backend == 'pg_trgm':
+            self.fuzzy_queries += 1
+            sim = func.word_similarity(q, _docs.c.body)
+            cond = _docs.c.body.contains(q, autoescape=True) | _docs.c.body.op('%>')(q)
+            return conn.execute(self._scoped(cols.where(cond), company, kinds)
+                                .order_by(sim.desc()).limit(SEARCH_CANDIDATES)).all()
+        return conn.execute(self._scoped(cols.where(_docs.c.body.contains(q, autoescape=True)), company, kinds)
+                            .order_by(_docs.c.id).limit(SEARCH_CANDIDATES)).all()
+
+    def search(self, conn: Connection, query: str, company: Optional[str], kinds: List[str] = KINDS,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        t0 = time.perf_counter()
+        q = _norm(query)
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+        if not q or not self.available:
+            return []
+        grams = _word_trigrams(q)
+        ranked = []
+        for r in self._candidates(conn, q, company, list(kinds), limit):
+            s = score(q, r.title, r.body, grams)
+            if s >= SEARCH_MIN_SCORE:
+                ranked.append((s, KINDS.index(r.kind), r.ref_id, r))
+        ranked.sort(key=lambda x: (-x[0], x[1], x[2]))
+        self.queries += 1
+        self.total_ms += (time.perf_counter() - t0) * 1000.0
+        return [{'kind': r.kind, 'id': r.ref_id, 'title': r.title, 'subtitle': r.subtitle, 'score': round(s, 3)}
+                for s, _, _, r in ranked[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.backend, 'queries': self.queries, 'fuzzy_queries': self.fuzzy_queries,
+            'avg_ms': round(self.total_ms / self.queries, 3) if self.queries else 0.0,
+        }
+
+
+# ----------------------
+# ORM hooks
+# ----------------------
+def install_search_hooks(index: SearchIndex) -> None:
+    """Keep search_documents current from ORM writes, inside the writing transaction."""
+    from sqlalchemy import event
+
+    def _upsert(kind: str, op: str):
+        def handler(mapper, connection, target):
+            if not index.available:
+                return
+            state = inspect(target)
+            if op == 'update' and not any(state.attrs[f].history.has_changes() for f in _FIELDS[kind]):
+                return
+            reindex_row(connection, kind, target.id)
+            if kind == 'photographer' and state.attrs.name.history.has_changes():
+                # property documents carry the photographer's name
+                reindex(connection, 'property', Property.photographer_id == target.id)
+        return handler
+
+    def _delete(kind: str):
+        def handler(mapper, connection, target):
+            if not index.available:
+                return
+            remove(connection, kind, target.id)
+            if kind == 'photographer':
+                reindex(connection, 'property', Property.photographer_id == target.id)
+        return handler
+
+    for kind, model in _MODELS.items():
+        event.listen(model, 'after_insert', _upsert(kind, 'insert'))
+        event.listen(model, 'after_update', _upsert(kind, 'update'))
+        event.listen(model, 'after_delete', _delete(kind))
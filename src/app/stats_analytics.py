@@ -0,0 +1,134 @@
+"""
+stats_analytics
+
+Dashboard time series computed on the server: one bucket per day, week or
+month over the last N periods.
+
+- Gaps are zero-filled, so averages are per calendar period rather than
+  per active row.
+- Each bucket has a trailing moving average and a delta against the
+  previous bucket.
+- The window totals are compared with the N periods before them.
+
+The numbers come from payment_ledger.series(): the precomputed rollups plus
+the events that have not been compacted yet. That is at most
+2N + window - 1 rows, fetched as (date, shoots, income) columns and
+processed with NumPy.
+
+The result changes when a payment event is appended, when the rollups are
+rewritten, or when the calendar day rolls over. etag() derives the
+validator from all three in one aggregate query, so a conditional GET
+answers 304 without building the series at all:
+
+- Event count and newest event id. The count catches an event that
+  commits after a higher id: its id doesn't move the max, but it does
+  change the count.
+- Newest stat_rollups.updated_at, the rollup generation. Every compaction
+  and replay() stamps the rows it writes. After event rows are fixed by
+  hand and the rollups rebuilt with `payment_ledger.py --replay`, the
+  event count and max id are unchanged, and only this column moves.
+"""
+
+import os
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from database import PaymentEvent, StatRollup
+import payment_ledger
+from stats_rollup import period_start
+
+ANALYTICS_MAX_BUCKETS = int(os.getenv("STATS_ANALYTICS_MAX_BUCKETS", "366"))
+ANALYTICS_DEFAULT_WINDOW = int(os.getenv("STATS_ANALYTICS_WINDOW", "7"))
+
+
+def bucket_starts(period: str, end: date, n: int) -> List[date]:
+    """The `n` period starts ending with the bucket that contains `end`, oldest first."""
+    last = period_start(period, end)
+    if period == 'day':
+        return [last - timedelta(days=i) for i in range(n - 1, -1, -1)]
+    if period == 'week':
+        return [last - timedelta(weeks=i) for i in range(n - 1, -1, -1)]
+    out = []
+    y, m = last.year, last.month
+    for _ in range(n):
+        out.append(date(y, m, 1))
+        y, m = (y, m - 1) if m > 1 else (y - 1, 12)
+    return out[::-1]
+
+
+def _trailing_mean(x: np.ndarray, window: int) -> np.ndarray:
+    c = np.concatenate(([0.0], np.cumsum(x, dtype=float)))
+    hi = np.arange(1, len(x) + 1)
+    lo = np.maximum(0, hi - window)
+    return (c[hi] - c[lo]) / (hi - lo)
+
+
+def _pct(cur: float, prev: float) -> Optional[float]:
+    return round((cur - prev) / prev * 100.0, 2) if prev else None
+
+
+def etag(db, company: Optional[str], period: str, buckets: int, window: int,
+         today: Optional[date] = None) -> str:
+    generation = select(func.max(StatRollup.updated_at)).scalar_subquery()
+    events, last_event, rolled_at = db.execute(
+        select(func.count(PaymentEvent.id), func.max(PaymentEvent.id), generation)).one()
+    today = today or datetime.utcnow().date()
+    key = f"{company or ''}|{period}|{buckets}|{window}|{today.isoformat()}|{events}|{last_event or 0}|{rolled_at or ''}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    # weak comparison (RFC 9110 8.8.3.2): a W/ prefix doesn't matter for GET revalidation
+    candidates = [t.strip() for t in if_none_match.split(',')]
+    return any(t == '*' or t.removeprefix('W/') == tag for t in candidates)
+
+
+def analytics(db, company: Optional[str], period: str = 'day', buckets: int = 30,
+              window: int = ANALYTICS_DEFAULT_WINDOW, today: Optional[date] = None) -> Dict[str, Any]:
+    """Zero-filled series for the last `buckets` periods with moving averages and deltas."""
+    today = today or datetime.utcnow().date()
+    # history before the window feeds the first moving averages and the previous-window totals
+    lookback = max(buckets, window - 1, 1)
+    starts = bucket_starts(period, today, buckets + lookback)
+    index = {d: i for i, d in enumerate(starts)}
+    shoots = np.zeros(len(starts), dtype=np.int64)
+    income = np.zeros(len(starts), dtype=float)
+    for row in payment_ledger.series(db, company, period, since=starts[0]):
+        i = index.get(row['date'])
+        if i is not None:
+            shoots[i] = row['shoots_count']
+            income[i] = row['income_total']
+
+    shoots_avg = _trailing_mean(shoots, window)[lookback:]
+    income_avg = _trailing_mean(income, window)[lookback:]
+    shoots_delta = np.diff(shoots)[lookback - 1:]
+    income_delta = np.diff(income)[lookback - 1:]
+    cur = slice(lookback, None)
+    prev = slice(lookback - buckets, lookback)
+
+    series = [
+        {'date': d, 'shoots_count': int(s), 'income_total': round(float(inc), 2),
+         'shoots_avg': round(float(sa), 3), 'income_avg': round(float(ia), 2),
+         'shoots_delta': int(sd), 'income_delta': round(float(idl), 2)}
+        for d, s, inc, sa, ia, sd, idl in zip(starts[cur], shoots[cur], income[cur], shoots_avg, income_avg,
+                                               shoots_delta, income_delta)
+    ]
+    total_shoots, total_income = int(shoots[cur].sum()), float(income[cur].sum())
+    prev_shoots, prev_income = int(shoots[prev].sum()), float(income[prev].sum())
+    return {
+        'period': period, 'window': window, 'start': starts[lookback], 'end': today,
+        'series': series,
+        'totals': {
+            'shoots': total_shoots, 'income': round(total_income, 2),
+            'avg_shoots_per_bucket': round(total_shoots / buckets, 3),
+            'avg_income_per_shoot': round(total_income / total_shoots, 2) if total_shoots else 0.0,
+        },
+        'previous': {'shoots': prev_shoots, 'income': round(prev_income, 2)},
+        'change_pct': {'shoots': _pct(total_shoots, prev_shoots), 'income': _pct(total_income, prev_income)},
+    }
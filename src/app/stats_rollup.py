@@ -0,0 +1,179 @@
+"""
+stats_rollup
+
+Precomputed shoot/income counters per company and period. The writes come
+from payment_ledger.compact(), which folds batches of payment events in with
+one atomic upsert per (company, day) and enabled period:
+
+    INSERT INTO stat_rollups (...) VALUES (...)
+    ON CONFLICT (period, company, period_start)
+    DO UPDATE SET shoots_count = shoots_count + excluded.shoots_count, ...
+
+A reversal is the same upsert with negative deltas. Nothing has to be
+matched against earlier rows, and concurrent writers cannot lose updates.
+SQLite and Postgres use their native ON CONFLICT; other dialects fall back to
+UPDATE-then-INSERT.
+
+'day' rollups are always kept. STATS_ROLLUP_PERIODS can add 'week' (Monday
+start) and 'month' (default: day,week,month). Reads (series/totals) cost
+O(periods) rows rather than one row per event: /stats/summary returns the
+day/week/month series directly, and the all-time totals sum the coarsest
+enabled period.
+
+The legacy `statistics` table is no longer written; migration 7 folds its
+rows into the rollups once, and migration 8 opens the payment ledger with them.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, update, insert
+from sqlalchemy.exc import IntegrityError
+
+from database import StatRollup
+
+_ALL_PERIODS = ('day', 'week', 'month')
+ROLLUP_PERIODS = tuple(
+    p for p in _ALL_PERIODS
+    if p == 'day' or p in {x.strip().lower() for x in os.getenv("STATS_ROLLUP_PERIODS", "day,week,month").split(',')}
+)
+
+_rollups = StatRollup.__table__
+
+
+def company_key(company: Optional[str]) -> str:
+    return company or ''
+
+
+def period_start(period: str, d: date) -> date:
+    if isinstance(d, datetime):
+        d = d.date()
+    if period == 'day':
+        return d
+    if period == 'week':
+        return d - timedelta(days=d.weekday())
+    if period == 'month':
+        return d.replace(day=1)
+    raise ValueError(f"unknown rollup period: {period}")
+
+
+def parse_period(period: Optional[str]) -> str:
+    """Validate a requested period; raises ValueError when it is unknown or not maintained."""
+    p = (period or 'day').strip().lower()
+    if p not in _ALL_PERIODS:
+        raise ValueError(f"unknown period {period!r}; expected one of {', '.join(_ALL_PERIODS)}")
+    if p not in ROLLUP_PERIODS:
+        raise ValueError(f"{p} rollups are disabled (STATS_ROLLUP_PERIODS={','.join(ROLLUP_PERIODS)})")
+    return p
+
+
+def _upsert_stmt(dialect: str, values: Dict[str, Any]):
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    stmt = dialect_insert(_rollups).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=[_rollups.c.period, _rollups.c.company, _rollups.c.period_start],
+        set_={
+            'shoots_count': _rollups.c.shoots_count + stmt.excluded.shoots_count,
+            'income_total': _rollups.c.income_total + stmt.excluded.income_total,
+            'updated_at': stmt.excluded.updated_at,
+        },
+    )
+
+
+def record(db, company: Optional[str], day: date, shoots: int = 0, income: float = 0.0) -> None:
+    """Add `shoots`/`income` (negative to reverse) to every enabled rollup containing `day`.
+
+    `db` is a Session or Connection; the upserts join its transaction.
+    """
+    dialect = db.get_bind().dialect.name if hasattr(db, 'get_bind') else db.dialect.name
+    now = datetime.utcnow()
+    for period in ROLLUP_PERIODS:
+        values = {'period': period, 'company': company_key(company), 'period_start': period_start(period, day),
+                  'shoots_count': int(shoots), 'income_total': float(income), 'updated_at': now}
+        stmt = _upsert_stmt(dialect, values)
+        if stmt is not None:
+            db.execute(stmt)
+            continue
+        _update_or_insert(db, values)
+
+
+def _update_or_insert(db, values: Dict[str, Any]) -> None:
+    key = (_rollups.c.period == values['period'], _rollups.c.company == values['company'],
+           _rollups.c.period_start == values['period_start'])
+    bump = update(_rollups).where(*key).values(
+        shoots_count=_rollups.c.shoots_count + values['shoots_count'],
+        income_total=_rollups.c.income_total + values['income_total'],
+        updated_at=values['updated_at'],
+    )
+    if db.execute(bump).rowcount:
+        return
+    nested = db.begin_nested()
+    try:
+        db.execute(insert(_rollups).values(**values))
+        nested.commit()
+    except IntegrityError:
+        # another writer created the row first
+        nested.rollback()
+        db.execute(bump)
+
+
+# ----------------------
+# Reads
+# ----------------------
+def series_query(company: Optional[str], period: str = 'day', since: Optional[date] = None,
+                 limit: Optional[int] = None, newest_first: bool = False):
+    """Rows (date, shoots_count, income_total) per period start; summed over companies when unscoped."""
+    stmt = (
+        select(
+            _rollups.c.period_start.label('date'),
+            func.sum(_rollups.c.shoots_count).label('shoots_count'),
+            func.sum(_rollups.c.income_total).label('income_total'),
+        )
+        .where(_rollups.c.period == period)
+        .group_by(_rollups.c.period_start)
+    )
+    if company is not None:
+        stmt = stmt.where(_rollups.c.company == company_key(company))
+    if since is not None:
+        stmt = stmt.where(_rollups.c.period_start >= period_start(period, since))
+    stmt = stmt.order_by(_rollups.c.period_start.desc() if newest_first else _rollups.c.period_start)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def series(db, company: Optional[str], period: str = 'day', since: Optional[date] = None,
+           limit: Optional[int] = None, newest_first: bool = False) -> List[Dict[str, Any]]:
+    rows = db.execute(series_query(company, period, since, limit, newest_first)).mappings().all()
+    return [{'date': r['date'], 'shoots_count': int(r['shoots_count'] or 0), 'income_total': float(r['income_total'] or 0.0)}
+            for r in rows]
+
+
+def totals(db, company: Optional[str]) -> Tuple[int, float]:
+    """All-time (shoots, income) from the coarsest enabled rollup."""
+    stmt = select(func.coalesce(func.sum(_rollups.c.shoots_count), 0),
+                  func.coalesce(func.sum(_rollups.c.income_total), 0.0)).where(_rollups.c.period == ROLLUP_PERIODS[-1])
+    if company is not None:
+        stmt = stmt.where(_rollups.c.company == company_key(company))
+    shoots, income = db.execute(stmt).one()
+    return int(shoots or 0), float(income or 0.0)
+
+
+# ----------------------
+# Backfill
+# ----------------------
+def backfill(conn, daily: Iterable[Tuple[Optional[str], date, int, float]]) -> int:
+    """Fold (company, day, shoots, income) sums into the rollups; returns the rows folded."""
+    n = 0
+    for company, day, shoots, income in daily:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        record(conn, company, day, int(shoots or 0), float(income or 0.0))
+        n += 1
+    return n